@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# bench_csv_schema_typing.py
+# Benchmark: CSV ingestion with per-cell type inference versus schema-driven column types
+# (csv_to_3dss --schema-types) on a generated 1M-cell points CSV.
+#
+# Usage:
+#   python bench_csv_schema_typing.py [--schema ../3DSS.schema.json] [--rows 100000] [--repeat 3]
+#
+import csv
+import time
+import json
+import random
+import argparse
+import tempfile
+from pathlib import Path
+from typing import List
+
+from xls2json_core import ELEMENT_DEFS, compile_csv_plan, schema_column_types
+
+HEADER = [
+    "meta.uuid", "signification.name",
+    "appearance.position[0]", "appearance.position[1]", "appearance.position[2]",
+    "appearance.marker.primitive", "appearance.marker.radius",
+    "appearance.marker.common.color", "appearance.marker.common.opacity",
+    "appearance.visible",
+]
+
+def _write_csv(path: Path, rows: int) -> None:
+    rnd = random.Random(0)
+    with path.open("w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(HEADER)
+        for i in range(rows):
+            w.writerow([
+                f"00000000-0000-4000-8000-{i:012d}", str(i),
+                f"{rnd.uniform(-100, 100):.6f}", f"{rnd.uniform(-100, 100):.6f}", str(i % 50),
+                "sphere", "1.5", "#ffffff", "0.4", "true" if i % 2 else "false",
+            ])
+
+def _run(path: Path, types) -> float:
+    t0 = time.perf_counter()
+    with path.open("r", encoding="utf-8", newline="") as f:
+        rows = csv.reader(f)
+        plan = compile_csv_plan([k.strip() for k in next(rows)], types)
+        for r in rows:
+            plan.build(r)
+    return time.perf_counter() - t0
+
+def _run_coerce(path: Path, types) -> float:
+    # coercion only (no set_path / trim), to isolate the typing cost
+    with path.open("r", encoding="utf-8", newline="") as f:
+        rows = csv.reader(f)
+        plan = compile_csv_plan([k.strip() for k in next(rows)], types)
+        data = list(rows)
+    ops = [(c.index, c.coerce) for c in plan.columns]
+    t0 = time.perf_counter()
+    for r in data:
+        for idx, coerce_fn in ops:
+            coerce_fn(r[idx])
+    return time.perf_counter() - t0
+
+def _best(fn, path: Path, types, repeat: int) -> float:
+    return min(fn(path, types) for _ in range(repeat))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--schema", default=str(Path(__file__).resolve().parent.parent / "3DSS.schema.json"))
+    ap.add_argument("--rows", type=int, default=100000, help="Rows to generate (x10 columns)")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    schema = json.loads(Path(args.schema).read_text(encoding="utf-8"))
+    types: List[str] = schema_column_types(schema, ELEMENT_DEFS["points"], HEADER)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "points.csv"
+        _write_csv(path, args.rows)
+        cells = args.rows * len(HEADER)
+        results = [
+            ("coerce only", _best(_run_coerce, path, None, args.repeat), _best(_run_coerce, path, types, args.repeat)),
+            ("full rows  ", _best(_run, path, None, args.repeat), _best(_run, path, types, args.repeat)),
+        ]
+
+    print(f"[bench] rows={args.rows} cells={cells}")
+    print(f"[bench] column types: {dict(zip(HEADER, types))}")
+    for label, t_infer, t_typed in results:
+        print(f"[bench] {label}: inference {t_infer / cells * 1e9:.0f} ns/cell, "
+              f"schema types {t_typed / cells * 1e9:.0f} ns/cell (x{t_infer / t_typed:.2f})")
+
+if __name__ == "__main__":
+    main()
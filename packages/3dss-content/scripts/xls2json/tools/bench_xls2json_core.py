@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# bench_xls2json_core.py
+# Micro-benchmark: per-cell cost of the legacy converter row loop (_parse_steps/_set_path
+# re-run for every cell) versus an xls2json_core ColumnPlan compiled once per header row.
+#
+# Usage:
+#   python bench_xls2json_core.py [--rows 20000] [--repeat 3]
+#
+import re
+import time
+import random
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+from xls2json_core import compile_xlsx_plan, coerce, base_type, trim
+
+HEADER_KEYS = [
+    "meta.uuid", "meta.creator_memo", "signification.name",
+    "appearance.position[0]", "appearance.position[1]", "appearance.position[2]",
+    "appearance.marker.primitive", "appearance.marker.radius",
+    "appearance.marker.common.color", "appearance.marker.common.opacity",
+    "appearance.visible", "meta.tags_json",
+]
+HEADER_TYPES = [
+    "string", "string", "string", "number", "number", "number",
+    "string", "number", "string", "number (default=0.4)", "boolean", "json",
+]
+
+
+# ---------------------------------------------------------------------------
+# legacy row loop (as it was duplicated in each converter), kept as the baseline;
+# only the container choice is fixed so nested "a.b[0]" keys run at all
+# ---------------------------------------------------------------------------
+
+ARRAY_IDX_RE = re.compile(r"^(?P<name>[^\[\]]+)(?:\[(?P<idx>\d+)\])?$")
+
+def _legacy_parse_steps(key: str) -> List[Tuple[str, Optional[int]]]:
+    steps: List[Tuple[str, Optional[int]]] = []
+    for seg in key.split("."):
+        m = ARRAY_IDX_RE.match(seg)
+        if not m:
+            steps.append((seg, None))
+            continue
+        name = m.group("name")
+        idx = m.group("idx")
+        steps.append((name, int(idx)) if idx is not None else (name, None))
+    return steps
+
+def _legacy_set_path(obj: Dict[str, Any], key: str, value: Any) -> None:
+    steps = _legacy_parse_steps(key)
+    cur: Any = obj
+    for i, (name, idx) in enumerate(steps):
+        is_last = (i == len(steps) - 1)
+        if idx is None:
+            if is_last:
+                cur[name] = value
+                return
+            if name not in cur or not isinstance(cur[name], (dict, list)):
+                cur[name] = {}
+            cur = cur[name]
+        else:
+            if name not in cur or not isinstance(cur[name], list):
+                cur[name] = []
+            lst = cur[name]
+            if len(lst) < idx + 1:
+                lst.extend([None] * (idx + 1 - len(lst)))
+            if is_last:
+                lst[idx] = value
+                return
+            if lst[idx] is None or not isinstance(lst[idx], (dict, list)):
+                lst[idx] = {}
+            cur = lst[idx]
+
+def _legacy_rows(rows: List[Tuple[Any, ...]]) -> List[Dict[str, Any]]:
+    col_map = [(i, k, base_type(t)) for i, (k, t) in enumerate(zip(HEADER_KEYS, HEADER_TYPES))]
+    out = []
+    for values in rows:
+        obj: Dict[str, Any] = {}
+        any_value = False
+        for col_idx, key_s, base_t in col_map:
+            v = coerce(values[col_idx], base_t, key_s)
+            if v is None:
+                continue
+            any_value = True
+            _legacy_set_path(obj, key_s, v)
+        if any_value:
+            out.append(trim(obj))
+    return out
+
+def _plan_rows(rows: List[Tuple[Any, ...]]) -> List[Dict[str, Any]]:
+    plan = compile_xlsx_plan(HEADER_KEYS, HEADER_TYPES)
+    out = []
+    for values in rows:
+        obj = plan.build(values)
+        if obj is not None:
+            out.append(obj)
+    return out
+
+
+def _make_rows(n: int) -> List[Tuple[Any, ...]]:
+    rnd = random.Random(0)
+    rows = []
+    for i in range(n):
+        rows.append((
+            f"00000000-0000-4000-8000-{i:012d}", None, f"P{i}",
+            rnd.uniform(-100, 100), rnd.uniform(-100, 100), rnd.uniform(-100, 100),
+            "sphere", 1.5, "#ffffff", 0.4, bool(i % 2), '["s:bench"]',
+        ))
+    return rows
+
+def _best(fn, rows, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    rows = _make_rows(args.rows)
+    if _legacy_rows(rows[:100]) != _plan_rows(rows[:100]):
+        raise SystemExit("[bench] legacy and plan outputs differ")
+
+    cells = args.rows * len(HEADER_KEYS)
+    t_legacy = _best(_legacy_rows, rows, args.repeat)
+    t_plan = _best(_plan_rows, rows, args.repeat)
+    print(f"[bench] rows={args.rows} cells={cells}")
+    print(f"[bench] legacy : {t_legacy:.3f}s  {t_legacy / cells * 1e9:.0f} ns/cell")
+    print(f"[bench] plan   : {t_plan:.3f}s  {t_plan / cells * 1e9:.0f} ns/cell")
+    print(f"[bench] speedup: x{t_legacy / t_plan:.2f}")
+
+if __name__ == "__main__":
+    main()
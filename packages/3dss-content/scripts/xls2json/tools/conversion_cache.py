@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# conversion_cache.py
+# Content-addressed cache for the xlsx/csv -> 3DSS converters (xlsx_to_3dss_v2, csv_to_3dss).
+#
+# The key is the sha256 of the input files' content, the schema file, the converter sources
+# (the script plus the shared modules it runs) and the conversion options. A hit copies the
+# stored output into place; a miss converts as usual and stores the result. Entries are
+# evicted least-recently-used (by mtime, bumped on every hit) once the cache exceeds its
+# size bound. Hit / miss / store / eviction counts are kept in stats.json.
+#
+# Cache directory: <$DSS_CACHE_DIR or ~/.cache/3dss>/conversions (or --cache-dir)
+#
+# Usage:
+#   python xlsx_to_3dss_v2.py --xlsx in.xlsx --out out.3dss.json --deterministic --cache
+#   python conversion_cache.py stats [--cache-dir DIR]
+#   python conversion_cache.py prune [--cache-dir DIR] [--max-mb 2048]
+#   python conversion_cache.py clear [--cache-dir DIR]
+#
+# Without --deterministic a hit returns the uuids and revised_at of the run that stored it.
+#
+import os
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+# bump when the key derivation or entry layout changes
+CACHE_FORMAT = 1
+DEFAULT_MAX_MB = 2048
+# modules every converter runs besides its own script
+SHARED_SOURCES = ("xls2json_core.py", "dss_writer.py", "dss_validator.py", "dss_decimate.py", "dss_refcheck.py")
+
+PathLike = Union[str, Path]
+
+
+def default_cache_dir() -> Path:
+    env = os.environ.get("DSS_CACHE_DIR")
+    base = Path(env) if env else Path.home() / ".cache" / "3dss"
+    return base / "conversions"
+
+def file_hash(path: PathLike, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            b = f.read(bufsize)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+def converter_sources(script: PathLike) -> List[Path]:
+    here = Path(script).resolve().parent
+    return [Path(script).resolve()] + [here / name for name in SHARED_SOURCES if (here / name).exists()]
+
+def cache_options(args: argparse.Namespace, input_args: Iterable[str]) -> Dict[str, Any]:
+    """
+    The converter options that shape the output: everything except the output path and
+    the cache flags; input paths are reduced to their names (their content is hashed).
+    """
+    skip = {"out", "cache", "cache_dir", "cache_max_mb", "schema"}
+    opts = {k: v for k, v in vars(args).items() if k not in skip}
+    for name in input_args:
+        if opts.get(name):
+            opts[name] = Path(opts[name]).name
+    # pinned_timestamp() reads it when --timestamp is not given
+    if os.environ.get("SOURCE_DATE_EPOCH"):
+        opts["SOURCE_DATE_EPOCH"] = os.environ["SOURCE_DATE_EPOCH"]
+    return opts
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ConversionCache:
+    """
+    <root>/objects/<k[:2]>/<k>.json holds the converted document and <k>.info.json what
+    the converter reported for it (element counts).
+    """
+
+    def __init__(self, cache_dir: Optional[PathLike] = None, max_mb: int = DEFAULT_MAX_MB):
+        self.root = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.max_bytes = max_mb * 1024 * 1024
+
+    # -- keys ----------------------------------------------------------------
+
+    def key(self, inputs: Iterable[Optional[PathLike]], schema: Optional[PathLike],
+            sources: Iterable[PathLike], options: Dict[str, Any]) -> str:
+        h = hashlib.sha256()
+        h.update(f"3dss-conversion-cache/{CACHE_FORMAT}\n".encode("utf-8"))
+        for p in inputs:
+            h.update(f"input:{file_hash(p) if p else '-'}\n".encode("utf-8"))
+        h.update(f"schema:{file_hash(schema) if schema else '-'}\n".encode("utf-8"))
+        for p in sources:
+            h.update(f"source:{Path(p).name}:{file_hash(p)}\n".encode("utf-8"))
+        h.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+        return h.hexdigest()
+
+    def _paths(self, key: str):
+        d = self.root / "objects" / key[:2]
+        return d / f"{key}.json", d / f"{key}.info.json"
+
+    # -- lookup / store ------------------------------------------------------
+
+    def fetch(self, key: str, out: PathLike) -> Optional[Dict[str, Any]]:
+        """
+        Copy the stored output to `out` and return its info, or None on a miss.
+        """
+        data_path, info_path = self._paths(key)
+        try:
+            info = json.loads(info_path.read_text(encoding="utf-8"))
+            out = Path(out)
+            out.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=str(out.parent), prefix=f".{out.name}.", suffix=".tmp")
+            os.close(fd)
+            shutil.copyfile(data_path, tmp)
+            os.replace(tmp, out)
+            os.utime(data_path)
+            os.utime(info_path)
+        except (OSError, ValueError):
+            self._count(misses=1)
+            return None
+        self._count(hits=1)
+        return info
+
+    def store(self, key: str, out: PathLike, info: Dict[str, Any]) -> None:
+        data_path, info_path = self._paths(key)
+        try:
+            data_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=str(data_path.parent), suffix=".tmp")
+            os.close(fd)
+            shutil.copyfile(out, tmp)
+            os.replace(tmp, data_path)
+            # info last: an entry only counts once both files are in place
+            _atomic_write(info_path, json.dumps(info).encode("utf-8"))
+        except OSError:
+            return
+        self._count(stores=1)
+        self.prune()
+
+    # -- maintenance ---------------------------------------------------------
+
+    def entries(self) -> List[Path]:
+        return list((self.root / "objects").glob("*/*.info.json"))
+
+    def prune(self, max_bytes: Optional[int] = None) -> int:
+        """
+        Evict least-recently-used entries until the cache fits; returns the eviction count.
+        """
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        items = []
+        total = 0
+        for info_path in self.entries():
+            data_path = info_path.with_name(info_path.name[:-len(".info.json")] + ".json")
+            try:
+                st = data_path.stat()
+            except OSError:
+                continue
+            size = st.st_size + info_path.stat().st_size
+            items.append((st.st_mtime, size, data_path, info_path))
+            total += size
+        evicted = 0
+        for _, size, data_path, info_path in sorted(items, key=lambda t: t[0]):
+            if total <= limit:
+                break
+            for p in (info_path, data_path):
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+            total -= size
+            evicted += 1
+        if evicted:
+            self._count(evictions=evicted)
+        return evicted
+
+    def clear(self) -> None:
+        shutil.rmtree(self.root / "objects", ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            stats = json.loads((self.root / "stats.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            stats = {}
+        for k in ("hits", "misses", "stores", "evictions"):
+            stats.setdefault(k, 0)
+        return stats
+
+    def _count(self, **deltas: int) -> None:
+        # best effort: concurrent builds may drop an increment, never corrupt the file
+        stats = self.stats()
+        for k, v in deltas.items():
+            stats[k] = stats.get(k, 0) + v
+        try:
+            _atomic_write(self.root / "stats.json", json.dumps(stats, sort_keys=True).encode("utf-8"))
+        except OSError:
+            pass
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["stats", "prune", "clear"])
+    ap.add_argument("--cache-dir", default=None, help="Cache directory (default: $DSS_CACHE_DIR/conversions)")
+    ap.add_argument("--max-mb", type=int, default=DEFAULT_MAX_MB, help="Size bound for prune")
+    args = ap.parse_args()
+
+    cache = ConversionCache(args.cache_dir, max_mb=args.max_mb)
+    if args.command == "clear":
+        cache.clear()
+        print(f"[cache] cleared {cache.root}")
+    elif args.command == "prune":
+        print(f"[cache] evicted {cache.prune()} entries")
+    else:
+        entries = cache.entries()
+        size = sum(p.stat().st_size for p in (cache.root / "objects").glob("*/*") if p.is_file())
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        ratio = f"{stats['hits'] / lookups:.1%}" if lookups else "-"
+        print(f"[cache] {cache.root}: entries={len(entries)} size={size / 1024 / 1024:.1f}MB "
+              f"hits={stats['hits']} misses={stats['misses']} hit_ratio={ratio} "
+              f"stores={stats['stores']} evictions={stats['evictions']}")
+
+if __name__ == "__main__":
+    main()
@@ -12,171 +12,71 @@
 #   - "true/false" -> boolean
 #   - columns ending with "_json" are parsed as JSON
 #
+# With --schema-types, each header path is resolved once against the --schema element
+# definitions ($defs/point/node, $defs/line/node) and the column gets a fixed type
+# (e.g. "signification.name" stays a string even for "1"). Columns the schema does not
+# pin to one scalar type fall back to the per-cell inference above.
+#
+# Rows are streamed from the CSV reader to the output file one at a time; --chunk-size
+# sets how many serialized elements are batched per write.
+#
+# --deterministic fills missing meta.uuid with UUIDv5 ids derived from the document
+# namespace, the file role ("points" / "lines") and the row content, and pins the generated
+# revised_at (--timestamp / $SOURCE_DATE_EPOCH), so identical inputs give identical bytes.
+#
+# On the way to the file the elements go through the output stages shared with the xlsx
+# converters (xls2json_core.OutputStages: --decimate, the ref check, --schema validation
+# while streaming); --cache looks the conversion up in conversion_cache.py first.
+#
 import csv
 import json
-import re
-import uuid
-import datetime
 import argparse
 from pathlib import Path
-from typing import Any, Dict, List, Tuple, Optional
-
-try:
-    import jsonschema
-except Exception:
-    jsonschema = None
-
-ARRAY_IDX_RE = re.compile(r"^(?P<name>[^\[\]]+)(?:\[(?P<idx>\d+)\])?$")
-
-def _parse_steps(key: str) -> List[Tuple[Optional[str], Optional[int]]]:
-    steps: List[Tuple[Optional[str], Optional[int]]] = []
-    for seg in key.split("."):
-        m = ARRAY_IDX_RE.match(seg)
-        if not m:
-            steps.append((seg, None))
-            continue
-        name = m.group("name")
-        idx = m.group("idx")
-        steps.append((name, int(idx)) if idx is not None else (name, None))
-    return steps
-
-def _ensure_list_len(lst: List[Any], n: int) -> None:
-    if len(lst) < n:
-        lst.extend([None] * (n - len(lst)))
-
-def _set_path(obj: Dict[str, Any], key: str, value: Any) -> None:
-    steps = _parse_steps(key)
-    cur: Any = obj
-    for i, (name, idx) in enumerate(steps):
-        is_last = (i == len(steps) - 1)
-        if idx is None:
-            if is_last:
-                cur[name] = value
-                return
-            if name not in cur or not isinstance(cur[name], (dict, list)):
-                nxt_name, nxt_idx = steps[i + 1]
-                cur[name] = [] if nxt_idx is not None else {}
-            cur = cur[name]
-        else:
-            if name not in cur or not isinstance(cur[name], list):
-                cur[name] = []
-            lst = cur[name]
-            _ensure_list_len(lst, idx + 1)
-            if is_last:
-                lst[idx] = value
-                return
-            if lst[idx] is None or not isinstance(lst[idx], (dict, list)):
-                nxt_name, nxt_idx = steps[i + 1]
-                lst[idx] = [] if nxt_idx is not None else {}
-            cur = lst[idx]
-
-def _trim(obj: Any) -> Any:
-    if isinstance(obj, dict):
-        out = {}
-        for k, v in obj.items():
-            v2 = _trim(v)
-            if v2 is None:
-                continue
-            if isinstance(v2, dict) and not v2:
-                continue
-            if isinstance(v2, list) and len(v2) == 0:
-                continue
-            out[k] = v2
-        return out
-    if isinstance(obj, list):
-        out = [_trim(v) for v in obj]
-        while out and out[-1] is None:
-            out.pop()
-        if all(v is None for v in out):
-            return []
-        return out
-    return obj
-
-def _coerce(s: str, key: str) -> Any:
-    if s is None:
-        return None
-    s = s.strip()
-    if s == "":
-        return None
+from typing import Any, Dict, Iterator, List, Optional
 
-    if key.endswith("_json"):
-        try:
-            return json.loads(s)
-        except Exception:
-            return s
+from conversion_cache import ConversionCache, cache_options, converter_sources
+from dss_writer import write_document
+from xls2json_core import (
+    ELEMENT_DEFS, DeterministicIds, OutputStages, add_output_arguments, check_output_arguments,
+    compile_csv_plan, default_document_meta, document_namespace, ensure_uuid, pinned_timestamp,
+    schema_column_types, trim,
+)
 
-    ls = s.lower()
-    if ls in ("true", "false"):
-        return ls == "true"
+# Pipeline: read -> coerce -> set_path -> trim -> uuid fill -> serialize.
+# Every stage is a generator, so only one row is in flight between the CSV reader and
+# the output file; peak memory does not grow with the number of rows.
 
-    # int?
-    try:
-        if re.fullmatch(r"[+-]?\d+", s):
-            return int(s)
-    except Exception:
-        pass
-
-    # float?
-    try:
-        if re.fullmatch(r"[+-]?\d+(\.\d+)?([eE][+-]?\d+)?", s):
-            return float(s)
-    except Exception:
-        pass
-
-    return s
-
-def _read_csv(path: Optional[str]) -> List[Dict[str, Any]]:
+def _iter_rows(path: Optional[str]) -> Iterator[List[str]]:
     if not path:
-        return []
+        return
     p = Path(path)
     if not p.exists():
-        return []
+        return
     with p.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-    if not rows:
-        return []
-
-    keys = [k.strip() for k in rows[0]]
-    out: List[Dict[str, Any]] = []
-    for r in rows[1:]:
-        obj: Dict[str, Any] = {}
-        any_value = False
-        for key, cell in zip(keys, r):
-            if not key:
-                continue
-            v = _coerce(cell, key)
-            if v is None:
-                continue
-            any_value = True
-            _set_path(obj, key, v)
-        if not any_value:
-            continue
-        obj = _trim(obj)
-        meta = obj.get("meta")
-        if isinstance(meta, dict) and not meta.get("uuid"):
-            meta["uuid"] = str(uuid.uuid4())
-        elif meta is None:
-            obj["meta"] = {"uuid": str(uuid.uuid4())}
-        out.append(obj)
-    return out
-
-def _default_document_meta(schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    schema_uri = "https://3dsl.jp/schemas/release/v1.1.4/3DSS.schema.json#v1.1.4"
-    if schema and isinstance(schema, dict):
-        sid = schema.get("$id") or ""
-        anch = schema.get("$anchor") or ""
-        if sid:
-            base = sid[:-1] if sid.endswith("#") else sid
-            schema_uri = f"{base}#{anch}" if anch else base
-    return {
-        "document_title": "Untitled",
-        "document_uuid": str(uuid.uuid4()),
-        "schema_uri": schema_uri,
-        "author": "unknown",
-        "version": "1.0.0",
-        "revised_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
-    }
+        yield from csv.reader(f)
+
+def _iter_csv(path: Optional[str], schema: Optional[Dict[str, Any]] = None,
+              element_ref: Optional[str] = None, sheet: str = "",
+              ids: Optional[DeterministicIds] = None) -> Iterator[Dict[str, Any]]:
+    rows = _iter_rows(path)
+    header = next(rows, None)
+    if not header:
+        return
+    keys = [k.strip() for k in header]
+    types = None
+    if schema is not None and element_ref:
+        types = schema_column_types(schema, element_ref, keys)
+        inferred = [k for k, t in zip(keys, types) if k and t == "any"]
+        print(f"[schema-types] {path}: {len(keys) - keys.count('') - len(inferred)} typed, "
+              f"{len(inferred)} inferred per cell" + (f" ({', '.join(inferred)})" if inferred else ""))
+    plan = compile_csv_plan(keys, types)
+
+    assembled = (plan.assemble(r) for r in rows)                # coerce + set_path
+    trimmed = (trim(obj) for obj in assembled if obj is not None)
+    if ids is not None:
+        yield from (ids.ensure_uuid(sheet, obj) for obj in trimmed)   # uuid5 fill
+    else:
+        yield from (ensure_uuid(obj) for obj in trimmed)        # uuid fill
 
 def main():
     ap = argparse.ArgumentParser()
@@ -185,32 +85,61 @@ def main():
     ap.add_argument("--out", required=True, help="Output .json")
     ap.add_argument("--schema", default=None, help="Optional 3DSS.schema.json to validate output")
     ap.add_argument("--meta-json", default=None, help="Optional JSON file containing document_meta object")
-    ap.add_argument("--no-validate", action="store_true")
+    ap.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    ap.add_argument("--chunk-size", type=int, default=1000, help="Elements serialized per batched write (default: 1000)")
+    ap.add_argument("--schema-types", action="store_true", help="Type each column from --schema instead of guessing per cell")
+    ap.add_argument("--deterministic", action="store_true",
+                    help="Reproducible output: UUIDv5 element ids from row content, pinned timestamps")
+    ap.add_argument("--uuid-namespace", default=None,
+                    help="Namespace for --deterministic ids (UUID or any text; default: document_uuid, else input name)")
+    ap.add_argument("--timestamp", default=None,
+                    help="revised_at for --deterministic (ISO 8601 or epoch; default: $SOURCE_DATE_EPOCH, else 0)")
+    add_output_arguments(ap, cache=True)
     args = ap.parse_args()
+    if args.schema_types and not args.schema:
+        ap.error("--schema-types requires --schema")
+    check_output_arguments(ap, args)
+
+    cache = cache_key = None
+    if args.cache or args.cache_dir:
+        cache = ConversionCache(args.cache_dir, max_mb=args.cache_max_mb)
+        cache_key = cache.key([args.points, args.lines], args.schema, converter_sources(__file__),
+                              cache_options(args, ("points", "lines")))
+        info = cache.fetch(cache_key, args.out)
+        if info is not None:
+            print(f"[cache] hit {cache_key[:12]}")
+            print(f"[write] {args.out} (points={info['points']} lines={info['lines']})")
+            return
 
     schema = None
     if args.schema:
         schema = json.loads(Path(args.schema).read_text(encoding="utf-8"))
+    typing_schema = schema if args.schema_types else None
 
-    points = _read_csv(args.points)
-    lines = _read_csv(args.lines)
-
+    document_meta = None
     if args.meta_json:
         document_meta = json.loads(Path(args.meta_json).read_text(encoding="utf-8"))
-    else:
-        document_meta = _default_document_meta(schema)
-
-    doc = {"document_meta": document_meta, "points": points, "lines": lines}
-    Path(args.out).write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    if args.schema and not args.no_validate and jsonschema is not None:
-        try:
-            jsonschema.validate(instance=doc, schema=schema)
-        except Exception as e:
-            raise SystemExit(f"[validate] FAILED: {e}")
-        print("[validate] OK")
-
-    print(f"[write] {args.out} (points={len(points)} lines={len(lines)})")
+    ids = None
+    if args.deterministic:
+        names = "+".join(Path(p).name for p in (args.points, args.lines) if p)
+        ns = document_namespace(args.uuid_namespace, document_meta, names)
+        ids = DeterministicIds(ns)
+        document_meta = document_meta or default_document_meta(
+            schema, document_uuid=str(ns), revised_at=pinned_timestamp(args.timestamp))
+    elif document_meta is None:
+        document_meta = default_document_meta(schema)
+
+    stages = OutputStages(args)
+    counts = write_document(args.out, document_meta, {
+        "points": stages.watch("points", _iter_csv(args.points, typing_schema, ELEMENT_DEFS["points"], "points", ids)),
+        "lines": stages.watch("lines", _iter_csv(args.lines, typing_schema, ELEMENT_DEFS["lines"], "lines", ids)),
+    }, pretty=not args.compact, chunk_size=args.chunk_size)
+    stages.finish(document_meta)
+
+    if cache is not None:
+        cache.store(cache_key, args.out, counts)
+        print(f"[cache] stored {cache_key[:12]}")
+    print(f"[write] {args.out} (points={counts['points']} lines={counts['lines']})")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# dss_columnar.py
+# Columnar binary sidecar for 3DSS documents (.3dss.npz, a NumPy npz container).
+#
+# The bulky numeric parts of a document are stored as packed arrays and everything else
+# as dictionary-encoded JSON, so a large scene loads as a handful of bulk reads:
+#
+#   format                      int64[1]      layout version (FORMAT)
+#   document                    uint8[]       UTF-8 JSON of the document with "points" /
+#                                             "lines" left as null placeholders
+#   <s>.count                   int64[1]      elements in section <s> (points, lines)
+#   <s>.skeleton_codes          int32[N]      element -> entry of <s>.skeleton_table
+#   <s>.skeleton_table          uint8[]       JSON array of distinct element skeletons: the
+#                                             element JSON with every column value below
+#                                             replaced by null (key order kept)
+#   <s>.uuid                    uint8[N,16]   meta.uuid as bytes
+#   <s>.uuid_mask               bool[N]       meta.uuid stored in <s>.uuid
+#   <s>.name_codes              int32[N]      signification.name -> <s>.name_table, -1 = in skeleton
+#   <s>.name_table              uint8[]       JSON array of distinct string names
+#   points.position             float64[N,3]  appearance.position
+#   points.position_kind        uint8[N]      0 = in skeleton, else 1 | (component i is an
+#                                             integer) << (i + 1)
+#   lines.end_a / lines.end_b   int32[N]      appearance.end_*.ref as a point index, -1 = in
+#                                             skeleton (coord endpoints, unknown refs)
+#   lines.polyline_offsets      int64[N+1]    vertex range of each line in polyline_points
+#   lines.polyline_points       float64[M,3]  appearance.geometry.polyline_points
+#   lines.polyline_int          uint8[M]      per-vertex integer-component bits (as above)
+#   lines.polyline_mask         bool[N]       polyline_points stored in the columns
+#
+# A value only moves into a column when it comes back identical (same JSON value, same
+# int/float type, uuids in canonical lowercase form, refs that resolve to a point), so
+# decoding gives back the original document exactly, key order included.
+#
+# Usage:
+#   python dss_columnar.py encode in.3dss.json out.3dss.npz [--compress]
+#   python dss_columnar.py decode in.3dss.npz out.3dss.json [--compact]
+#   python dss_columnar.py info in.3dss.npz
+#
+import json
+import uuid
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from dss_writer import DocumentWriter
+
+FORMAT = 1
+SECTIONS = ("points", "lines")
+
+POSITION = ("appearance", "position")
+END_A = ("appearance", "end_a", "ref")
+END_B = ("appearance", "end_b", "ref")
+POLYLINE = ("appearance", "geometry", "polyline_points")
+UUID = ("meta", "uuid")
+NAME = ("signification", "name")
+
+MAX_EXACT_INT = 2 ** 53
+
+PathLike = Union[str, Path]
+
+
+# ---------------------------------------------------------------------------
+# helpers
+# ---------------------------------------------------------------------------
+
+def _get(obj: Any, path: Tuple[str, ...]) -> Any:
+    cur = obj
+    for k in path:
+        if not isinstance(cur, dict) or k not in cur:
+            return None
+        cur = cur[k]
+    return cur
+
+def _blank(obj: Dict[str, Any], path: Tuple[str, ...]) -> Dict[str, Any]:
+    # copy of obj with the value at path set to null; only dicts along the path are copied
+    out = dict(obj)
+    cur = out
+    for k in path[:-1]:
+        cur[k] = dict(cur[k])
+        cur = cur[k]
+    cur[path[-1]] = None
+    return out
+
+def _put(obj: Dict[str, Any], path: Tuple[str, ...], value: Any) -> None:
+    cur = obj
+    for k in path[:-1]:
+        cur = cur[k]
+    cur[path[-1]] = value
+
+def _vec3_kind(v: Any) -> int:
+    """
+    1 | integer-component bits for a vec3 a float64 triple restores exactly, else 0.
+    """
+    if not isinstance(v, list) or len(v) != 3:
+        return 0
+    kind = 1
+    for i, c in enumerate(v):
+        if isinstance(c, bool):
+            return 0
+        if isinstance(c, int):
+            if abs(c) > MAX_EXACT_INT:
+                return 0
+            kind |= 1 << (i + 1)
+        elif not isinstance(c, float):
+            return 0
+    return kind
+
+def _restore_vec3(row, kind: int) -> List[Any]:
+    return [int(row[i]) if kind & (1 << (i + 1)) else float(row[i]) for i in range(3)]
+
+def _uuid_bytes(s: Any) -> Optional[bytes]:
+    if not isinstance(s, str):
+        return None
+    try:
+        u = uuid.UUID(s)
+    except ValueError:
+        return None
+    return u.bytes if str(u) == s else None
+
+def _json_bytes(value: Any) -> np.ndarray:
+    data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return np.frombuffer(data, dtype=np.uint8)
+
+def _json_value(arr: np.ndarray) -> Any:
+    return json.loads(arr.tobytes().decode("utf-8"))
+
+class _Dictionary:
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.table: List[str] = []
+
+    def code(self, value: str) -> int:
+        c = self.codes.get(value)
+        if c is None:
+            c = self.codes[value] = len(self.table)
+            self.table.append(value)
+        return c
+
+
+# ---------------------------------------------------------------------------
+# encode
+# ---------------------------------------------------------------------------
+
+def _encode_section(name: str, elements: List[Any], point_index: Dict[str, int]) -> Dict[str, np.ndarray]:
+    n = len(elements)
+    skeletons = _Dictionary()
+    names = _Dictionary()
+    skel_codes = np.empty(n, dtype=np.int32)
+    name_codes = np.full(n, -1, dtype=np.int32)
+    uuids = np.zeros((n, 16), dtype=np.uint8)
+    uuid_mask = np.zeros(n, dtype=bool)
+    cols: Dict[str, np.ndarray] = {}
+
+    if name == "points":
+        position = np.zeros((n, 3), dtype=np.float64)
+        position_kind = np.zeros(n, dtype=np.uint8)
+    else:
+        end_a = np.full(n, -1, dtype=np.int32)
+        end_b = np.full(n, -1, dtype=np.int32)
+        poly_offsets = np.zeros(n + 1, dtype=np.int64)
+        poly_mask = np.zeros(n, dtype=bool)
+        poly_points: List[List[float]] = []
+        poly_int: List[int] = []
+
+    for i, el in enumerate(elements):
+        skel = el
+        if isinstance(el, dict):
+            b = _uuid_bytes(_get(el, UUID))
+            if b is not None:
+                uuids[i] = np.frombuffer(b, dtype=np.uint8)
+                uuid_mask[i] = True
+                skel = _blank(skel, UUID)
+            nm = _get(el, NAME)
+            if isinstance(nm, str):
+                name_codes[i] = names.code(nm)
+                skel = _blank(skel, NAME)
+            if name == "points":
+                pos = _get(el, POSITION)
+                kind = _vec3_kind(pos)
+                if kind:
+                    position[i] = pos
+                    position_kind[i] = kind
+                    skel = _blank(skel, POSITION)
+            else:
+                for path, col in ((END_A, end_a), (END_B, end_b)):
+                    ref = _get(el, path)
+                    idx = point_index.get(ref) if isinstance(ref, str) else None
+                    if idx is not None:
+                        col[i] = idx
+                        skel = _blank(skel, path)
+                pts = _get(el, POLYLINE)
+                if isinstance(pts, list):
+                    kinds = [_vec3_kind(p) for p in pts]
+                    if all(kinds):
+                        poly_points.extend(pts)
+                        poly_int.extend(kinds)
+                        poly_mask[i] = True
+                        skel = _blank(skel, POLYLINE)
+                poly_offsets[i + 1] = len(poly_points)
+        skel_codes[i] = skeletons.code(json.dumps(skel, ensure_ascii=False, separators=(",", ":")))
+
+    cols[f"{name}.count"] = np.array([n], dtype=np.int64)
+    cols[f"{name}.skeleton_codes"] = skel_codes
+    cols[f"{name}.skeleton_table"] = _json_bytes(skeletons.table)
+    cols[f"{name}.uuid"] = uuids
+    cols[f"{name}.uuid_mask"] = uuid_mask
+    cols[f"{name}.name_codes"] = name_codes
+    cols[f"{name}.name_table"] = _json_bytes(names.table)
+    if name == "points":
+        cols["points.position"] = position
+        cols["points.position_kind"] = position_kind
+    else:
+        cols["lines.end_a"] = end_a
+        cols["lines.end_b"] = end_b
+        cols["lines.polyline_offsets"] = poly_offsets
+        cols["lines.polyline_points"] = np.array(poly_points, dtype=np.float64).reshape(-1, 3)
+        cols["lines.polyline_int"] = np.array(poly_int, dtype=np.uint8)
+        cols["lines.polyline_mask"] = poly_mask
+    return cols
+
+def encode(doc: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """
+    Column arrays for a parsed 3DSS document (see the layout at the top of this file).
+    """
+    cols: Dict[str, np.ndarray] = {"format": np.array([FORMAT], dtype=np.int64)}
+    sections = {s: doc[s] for s in SECTIONS if isinstance(doc.get(s), list)}
+    # first occurrence wins for duplicate uuids; the ref string restores the same either way
+    point_index: Dict[str, int] = {}
+    for i, p in enumerate(sections.get("points", [])):
+        u = _get(p, UUID)
+        if isinstance(u, str) and _uuid_bytes(u) is not None:
+            point_index.setdefault(u, i)
+    for s, elements in sections.items():
+        cols.update(_encode_section(s, elements, point_index))
+    cols["document"] = _json_bytes({k: (None if k in sections else v) for k, v in doc.items()})
+    return cols
+
+def write_columnar(doc: Dict[str, Any], path: PathLike, compress: bool = False) -> None:
+    cols = encode(doc)
+    # np.savez appends ".npz" to bare names; writing through a file object keeps `path` as is
+    with open(path, "wb") as f:
+        (np.savez_compressed if compress else np.savez)(f, **cols)
+
+
+# ---------------------------------------------------------------------------
+# decode
+# ---------------------------------------------------------------------------
+
+class ColumnarDocument:
+    """
+    Opened .3dss.npz. Arrays are read on first access (np.load is lazy per member);
+    elements() / to_document() materialize dicts.
+    """
+
+    def __init__(self, path: PathLike):
+        self._npz = np.load(str(path), allow_pickle=False)
+        fmt = int(self._npz["format"][0])
+        if fmt != FORMAT:
+            raise ValueError(f"{path}: unsupported columnar format {fmt}")
+        self._cache: Dict[str, np.ndarray] = {}
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        arr = self._cache.get(key)
+        if arr is None:
+            arr = self._cache[key] = self._npz[key]
+        return arr
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._npz.files
+
+    def close(self) -> None:
+        self._npz.close()
+
+    def count(self, section: str) -> int:
+        return int(self[f"{section}.count"][0]) if f"{section}.count" in self else 0
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self["points.position"]
+
+    def uuid_strings(self, section: str) -> List[Optional[str]]:
+        raw = self[f"{section}.uuid"]
+        mask = self[f"{section}.uuid_mask"]
+        return [str(uuid.UUID(bytes=raw[i].tobytes())) if mask[i] else None for i in range(len(mask))]
+
+    def document_meta(self) -> Any:
+        return _json_value(self["document"]).get("document_meta")
+
+    def elements(self, section: str) -> Iterator[Any]:
+        n = self.count(section)
+        if not n:
+            return
+        table = _json_value(self[f"{section}.skeleton_table"])
+        names = _json_value(self[f"{section}.name_table"])
+        codes = self[f"{section}.skeleton_codes"]
+        name_codes = self[f"{section}.name_codes"]
+        uuids = self.uuid_strings(section)
+        if section == "points":
+            position = self["points.position"]
+            kinds = self["points.position_kind"]
+        else:
+            point_uuids = self.uuid_strings("points") if self.count("points") else []
+            end_a, end_b = self["lines.end_a"], self["lines.end_b"]
+            offsets = self["lines.polyline_offsets"]
+            poly, poly_int = self["lines.polyline_points"], self["lines.polyline_int"]
+            poly_mask = self["lines.polyline_mask"]
+
+        for i in range(n):
+            el = json.loads(table[codes[i]])
+            if uuids[i] is not None:
+                _put(el, UUID, uuids[i])
+            if name_codes[i] >= 0:
+                _put(el, NAME, names[name_codes[i]])
+            if section == "points":
+                if kinds[i]:
+                    _put(el, POSITION, _restore_vec3(position[i], int(kinds[i])))
+            else:
+                if end_a[i] >= 0:
+                    _put(el, END_A, point_uuids[end_a[i]])
+                if end_b[i] >= 0:
+                    _put(el, END_B, point_uuids[end_b[i]])
+                if poly_mask[i]:
+                    lo, hi = int(offsets[i]), int(offsets[i + 1])
+                    _put(el, POLYLINE, [_restore_vec3(poly[j], int(poly_int[j])) for j in range(lo, hi)])
+            yield el
+
+    def to_document(self) -> Dict[str, Any]:
+        doc = _json_value(self["document"])
+        for s in SECTIONS:
+            if s in doc and doc[s] is None and f"{s}.count" in self:
+                doc[s] = list(self.elements(s))
+        return doc
+
+    def write_json(self, path: PathLike, pretty: bool = True) -> Dict[str, int]:
+        """
+        Stream the decoded document to `path` (same bytes as json.dumps of to_document()).
+        """
+        doc = _json_value(self["document"])
+        counts: Dict[str, int] = {}
+        with DocumentWriter(path, pretty=pretty, chunk_size=1000) as w:
+            for k, v in doc.items():
+                if k in SECTIONS and v is None and f"{k}.count" in self:
+                    counts[k] = w.write_array(k, self.elements(k))
+                else:
+                    w.write_member(k, v)
+        return counts
+
+def read_columnar(path: PathLike) -> ColumnarDocument:
+    return ColumnarDocument(path)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="command", required=True)
+    enc = sub.add_parser("encode", help=".3dss.json -> .3dss.npz")
+    enc.add_argument("src")
+    enc.add_argument("dst")
+    enc.add_argument("--compress", action="store_true", help="Deflate the npz members")
+    dec = sub.add_parser("decode", help=".3dss.npz -> .3dss.json")
+    dec.add_argument("src")
+    dec.add_argument("dst")
+    dec.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    inf = sub.add_parser("info", help="Print the columns of a .3dss.npz")
+    inf.add_argument("src")
+    args = ap.parse_args()
+
+    if args.command == "encode":
+        doc = json.loads(Path(args.src).read_text(encoding="utf-8-sig"))
+        write_columnar(doc, args.dst, compress=args.compress)
+        counts = {s: len(doc[s]) for s in SECTIONS if isinstance(doc.get(s), list)}
+        print(f"[write] {args.dst} ({' '.join(f'{k}={v}' for k, v in counts.items())})")
+    elif args.command == "decode":
+        cd = read_columnar(args.src)
+        counts = cd.write_json(args.dst, pretty=not args.compact)
+        cd.close()
+        print(f"[write] {args.dst} ({' '.join(f'{k}={v}' for k, v in counts.items())})")
+    else:
+        cd = read_columnar(args.src)
+        for key in sorted(cd._npz.files):
+            arr = cd[key]
+            print(f"{key:28s} {str(arr.dtype):8s} {arr.shape}")
+        cd.close()
+
+if __name__ == "__main__":
+    main()
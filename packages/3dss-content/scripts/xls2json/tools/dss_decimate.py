@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# dss_decimate.py
+# Douglas-Peucker decimation of line geometry vertex lists:
+#   lines[*].appearance.geometry.polyline_points / catmullrom_points
+#
+# A vertex is kept when, at the time its span is examined, it is the farthest from the
+# span's chord (point-to-segment distance) and farther than --tolerance (world units).
+# The first and last vertex of every list are always kept, unchanged. With
+# --max-vertices, a list that still has more vertices keeps only the endpoints and the
+# vertices with the largest split distances.
+#
+# The recursion is run level by level: all open spans of all lists in the batch are
+# processed together, each level one NumPy pass over their interior vertices, so a
+# document with many polylines costs a few array passes rather than a Python loop per
+# vertex. Kept vertices are the original JSON values (no re-rounding).
+#
+# Usage:
+#   python dss_decimate.py in.3dss.json out.3dss.json --tolerance 0.01 [--max-vertices 2000] [--report r.json]
+#
+# Usage (from a sibling script / converter stage):
+#   from dss_decimate import Decimator
+#   dec = Decimator(0.01, max_vertices=2000)
+#   lines = dec.watch(lines)          # decimates each line element as it passes
+#   print(dec.summary())
+#
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from dss_writer import DocumentWriter
+
+FIELDS = ("polyline_points", "catmullrom_points")
+
+
+# ---------------------------------------------------------------------------
+# core
+# ---------------------------------------------------------------------------
+
+def _ragged(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    owner = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    return owner, np.arange(int(counts.sum()), dtype=np.int64) - starts[owner]
+
+def _segment_distance(p: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    ab = b - a
+    den = np.einsum("ij,ij->i", ab, ab)
+    t = np.einsum("ij,ij->i", p - a, ab) / np.where(den > 0, den, 1.0)
+    t = np.clip(np.where(den > 0, t, 0.0), 0.0, 1.0)
+    return np.linalg.norm(p - (a + t[:, None] * ab), axis=1)
+
+def simplify(points: np.ndarray, offsets: np.ndarray, tolerance: float,
+             max_vertices: Optional[int] = None) -> np.ndarray:
+    """
+    Keep mask for float64[M,3] points holding several vertex lists (list i is
+    points[offsets[i]:offsets[i+1]]), decimated together.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    sizes = np.diff(offsets)
+    nonempty = sizes > 0
+    keep[offsets[:-1][nonempty]] = True
+    keep[offsets[1:][nonempty] - 1] = True
+    # split distance of every kept interior vertex
+    importance = np.zeros(n)
+
+    s = offsets[:-1][sizes > 2].astype(np.int64)
+    e = (offsets[1:][sizes > 2] - 1).astype(np.int64)
+    while len(s):
+        owner, k = _ragged(e - s - 1)
+        idx = s[owner] + 1 + k
+        d = _segment_distance(points[idx], points[s[owner]], points[e[owner]])
+        first = np.cumsum(e - s - 1) - (e - s - 1)
+        peak = np.maximum.reduceat(d, first)
+        split = peak > tolerance
+        # first interior vertex reaching the peak of each span
+        hit = np.flatnonzero(d == peak[owner])
+        _, at = np.unique(owner[hit], return_index=True)
+        pivot = idx[hit[at]]
+        pivot, s_, e_ = pivot[split], s[split], e[split]
+        keep[pivot] = True
+        importance[pivot] = peak[split]
+        s = np.concatenate([s_, pivot])
+        e = np.concatenate([pivot, e_])
+        open_ = e - s > 1
+        s, e = s[open_], e[open_]
+
+    if max_vertices is not None:
+        cap = max(int(max_vertices), 2)
+        for i in np.flatnonzero(sizes > cap):
+            lo, hi = int(offsets[i]) + 1, int(offsets[i + 1]) - 1
+            inner = np.flatnonzero(keep[lo:hi]) + lo
+            if len(inner) > cap - 2:
+                drop = inner[np.argsort(-importance[inner], kind="stable")[cap - 2:]]
+                keep[drop] = False
+    return keep
+
+
+# ---------------------------------------------------------------------------
+# documents
+# ---------------------------------------------------------------------------
+
+def _vertex_lists(el: Any) -> List[Tuple[str, List[Any]]]:
+    app = el.get("appearance") if isinstance(el, dict) else None
+    g = app.get("geometry") if isinstance(app, dict) else None
+    if not isinstance(g, dict):
+        return []
+    out = []
+    for field in FIELDS:
+        pts = g.get(field)
+        if isinstance(pts, list) and len(pts) > 2 and all(
+                isinstance(p, list) and len(p) == 3 and all(
+                    isinstance(c, (int, float)) and not isinstance(c, bool) for c in p) for p in pts):
+            out.append((field, pts))
+    return out
+
+def _with_geometry(el: Dict[str, Any], fields: Dict[str, List[Any]]) -> Dict[str, Any]:
+    app = el["appearance"]
+    return dict(el, appearance=dict(app, geometry=dict(app["geometry"], **fields)))
+
+
+class Decimator:
+    """
+    Decimates line elements and keeps before/after vertex counts. decimate() handles a
+    list of elements in one simplify() call; watch() streams elements through it in batches.
+    """
+
+    def __init__(self, tolerance: float, max_vertices: Optional[int] = None):
+        self.tolerance = tolerance
+        self.max_vertices = max_vertices
+        self.before = 0
+        self.after = 0
+        # one entry per vertex list that lost vertices
+        self.changed: List[Dict[str, Any]] = []
+        self._index = 0
+
+    def decimate(self, elements: List[Any]) -> List[Any]:
+        lists = []
+        for i, el in enumerate(elements):
+            for field, pts in _vertex_lists(el):
+                lists.append((i, field, pts))
+        if not lists:
+            self._index += len(elements)
+            return elements
+        sizes = np.array([len(pts) for _, _, pts in lists], dtype=np.int64)
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        points = np.array([p for _, _, pts in lists for p in pts], dtype=np.float64)
+        keep = simplify(points, offsets, self.tolerance, self.max_vertices)
+        kept = np.add.reduceat(keep.astype(np.int64), offsets[:-1])
+
+        updates: Dict[int, Dict[str, List[Any]]] = {}
+        for (i, field, pts), lo, n_before, n_after in zip(lists, offsets, sizes, kept):
+            self.before += int(n_before)
+            self.after += int(n_after)
+            if n_after < n_before:
+                mask = keep[lo:lo + n_before]
+                updates.setdefault(i, {})[field] = [p for p, m in zip(pts, mask) if m]
+                meta = elements[i].get("meta")
+                self.changed.append({"line": self._index + i,
+                                     "uuid": meta.get("uuid") if isinstance(meta, dict) else None,
+                                     "field": field, "before": int(n_before), "after": int(n_after)})
+        self._index += len(elements)
+        return [_with_geometry(el, updates[i]) if i in updates else el for i, el in enumerate(elements)]
+
+    def element(self, el: Any) -> Any:
+        return self.decimate([el])[0]
+
+    def watch(self, elements: Iterable[Any], batch: int = 256) -> Iterator[Any]:
+        """
+        Pass elements through, decimated in batches of `batch`.
+        """
+        buf: List[Any] = []
+        for el in elements:
+            buf.append(el)
+            if len(buf) >= batch:
+                yield from self.decimate(buf)
+                buf = []
+        if buf:
+            yield from self.decimate(buf)
+
+    def summary(self) -> str:
+        return (f"vertices {self.before} -> {self.after} "
+                f"({len(self.changed)} list(s) decimated, tolerance={self.tolerance:g}"
+                + (f", max_vertices={self.max_vertices}" if self.max_vertices else "") + ")")
+
+    def report(self) -> Dict[str, Any]:
+        return {"tolerance": self.tolerance, "max_vertices": self.max_vertices,
+                "vertices_before": self.before, "vertices_after": self.after, "changed": self.changed}
+
+def decimate_document(doc: Dict[str, Any], tolerance: float,
+                      max_vertices: Optional[int] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    (decimated copy of doc, report); untouched elements are shared with doc.
+    """
+    dec = Decimator(tolerance, max_vertices)
+    out = dict(doc)
+    if isinstance(doc.get("lines"), list):
+        out["lines"] = dec.decimate(doc["lines"])
+    return out, dec.report()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("json", help="Input .3dss.json")
+    ap.add_argument("out", help="Output .3dss.json")
+    ap.add_argument("--tolerance", type=float, required=True, help="Max deviation in world units")
+    ap.add_argument("--max-vertices", type=int, default=None, help="Cap per vertex list (endpoints included)")
+    ap.add_argument("--report", default=None, help="Write the per-line before/after counts (JSON) here")
+    ap.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    args = ap.parse_args()
+    if args.tolerance < 0:
+        ap.error("--tolerance must be >= 0")
+    if args.max_vertices is not None and args.max_vertices < 2:
+        ap.error("--max-vertices must be >= 2")
+
+    with open(args.json, "r", encoding="utf-8-sig") as f:
+        doc = json.load(f)
+    out, report = decimate_document(doc, args.tolerance, args.max_vertices)
+    with DocumentWriter(args.out, pretty=not args.compact, chunk_size=1000) as w:
+        for k, v in out.items():
+            if isinstance(v, list):
+                w.write_array(k, v)
+            else:
+                w.write_member(k, v)
+    print(f"[write] {args.out}")
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"[write] {args.report}")
+    print(f"[decimate] vertices {report['vertices_before']} -> {report['vertices_after']} "
+          f"({len(report['changed'])} list(s) decimated)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
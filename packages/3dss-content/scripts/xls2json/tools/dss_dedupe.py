@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# dss_dedupe.py
+# Merge duplicate and near-coincident points of a 3DSS document.
+#
+# Two points are linked when their appearance.position are within --eps (Euclidean) of
+# each other, and with --match-marker only if their appearance.marker are also equal;
+# linked points form groups (single linkage, so a chain a~b~c is one group). Each group
+# keeps its first point in document order; the others are dropped and every line
+# appearance.end_a.ref / end_b.ref naming a dropped point is rewritten to the survivor.
+#
+# Pairs are found with a spatial hash instead of comparing all pairs:
+#   1. points at exactly the same position (and marker) collapse to one representative;
+#   2. representatives are bucketed into cells of size eps, so a partner can only be in
+#      the same or one of the 26 neighbouring cells (13 of them visited per cell pair);
+#   3. candidate pairs are distance-tested in bounded batches and joined with a
+#      vectorized union-find.
+# Points without a position or a string meta.uuid are never merged.
+#
+# A merge report (JSON) lists every group: survivor uuid, merged uuids and the largest
+# distance to the survivor, plus the number of rewritten refs and the lines that became
+# self-loops. It goes to --report, else next to OUT (OUT.3dss.json -> OUT.3dss.merge.json),
+# or next to the input with --dry-run and no OUT.
+#
+# Usage:
+#   python dss_dedupe.py in.3dss.json out.3dss.json [--eps 1e-6] [--match-marker] [--report merge.json]
+#   python dss_dedupe.py in.3dss.json --dry-run          # report only
+#
+import json
+import argparse
+import itertools
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from dss_spatial import positions_of
+from dss_writer import DocumentWriter
+
+DEFAULT_EPS = 1e-6
+# candidate pairs distance-tested at once
+PAIR_BATCH = 1 << 22
+
+# the 13 neighbour offsets whose mirror image is not in the list (each cell pair once)
+_HALF_OFFSETS = [o for o in itertools.product((-1, 0, 1), repeat=3) if o > (0, 0, 0)]
+
+
+# ---------------------------------------------------------------------------
+# union-find
+# ---------------------------------------------------------------------------
+
+def _compress(parent: np.ndarray) -> None:
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return
+        parent[:] = grand
+
+def _union(parent: np.ndarray, a: np.ndarray, b: np.ndarray) -> None:
+    """
+    Join the sets of a[i] and b[i] for all i; roots are always the smallest member.
+    """
+    while len(a):
+        ra, rb = parent[a], parent[b]
+        differ = ra != rb
+        if not differ.any():
+            return
+        a, b, ra, rb = a[differ], b[differ], ra[differ], rb[differ]
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        _compress(parent)
+
+
+# ---------------------------------------------------------------------------
+# spatial hash
+# ---------------------------------------------------------------------------
+
+class _CellKeys:
+    """
+    Sortable keys of grid cells. Each coordinate is replaced by its rank among the values
+    occurring on that axis (so a neighbour coordinate that never occurs is known to be
+    empty without a lookup); the ranks are packed into one int64 when they fit and
+    compared as 24 raw big-endian bytes otherwise.
+    """
+
+    def __init__(self, cells: np.ndarray):
+        self.axes: List[np.ndarray] = []
+        self.ranks = np.empty_like(cells)
+        for k in range(3):
+            u, inv = np.unique(cells[:, k], return_inverse=True)
+            self.axes.append(u)
+            self.ranks[:, k] = inv.ravel()
+        self.sizes = np.array([len(u) for u in self.axes], dtype=np.int64)
+        self._mul = None
+        if float(np.prod(self.sizes.astype(np.float64))) < 2.0 ** 62:
+            self._mul = np.array([self.sizes[1] * self.sizes[2], self.sizes[2], 1], dtype=np.int64)
+
+    def pack(self, ranks: np.ndarray) -> np.ndarray:
+        if self._mul is not None:
+            return ranks @ self._mul
+        return np.ascontiguousarray(ranks.astype(">u8")).view("V24").ravel()
+
+    def shifted(self, ranks: np.ndarray, cells: np.ndarray, off: Tuple[int, int, int]):
+        """
+        (keys, ok) of the cells at cells + off; ok is False where that cell is certainly empty.
+        """
+        r = ranks + np.array(off, dtype=np.int64)
+        ok = np.ones(len(r), dtype=bool)
+        for k in range(3):
+            if off[k]:
+                rk = np.clip(r[:, k], 0, self.sizes[k] - 1)
+                ok &= (r[:, k] == rk) & (self.axes[k][rk] == cells[:, k] + off[k])
+        r[~ok] = 0
+        return self.pack(r), ok
+
+def _cross_pairs(starts: np.ndarray, counts: np.ndarray, ca: np.ndarray, cb: np.ndarray,
+                 same: bool):
+    """
+    Yield (i, j) slot arrays for every point pair between cells ca[k] and cb[k], in
+    batches of about PAIR_BATCH pairs (same=True: pairs inside one cell, i < j).
+    """
+    sa, sb = counts[ca], counts[cb]
+    tot = sa * sb
+    if same:
+        keep = sa > 1
+        ca, cb, sa, sb, tot = ca[keep], cb[keep], sa[keep], sb[keep], tot[keep]
+    ends = np.cumsum(tot)
+    lo = 0
+    while lo < len(tot):
+        base = ends[lo - 1] if lo else 0
+        hi = max(lo + 1, int(np.searchsorted(ends, base + PAIR_BATCH, side="right")))
+        n = int(ends[hi - 1] - base)
+        k = np.repeat(np.arange(lo, hi), tot[lo:hi])
+        t = np.arange(n, dtype=np.int64) - (ends[k] - tot[k] - base)
+        i = starts[ca[k]] + t // sb[k]
+        j = starts[cb[k]] + t % sb[k]
+        if same:
+            keep = i < j
+            i, j = i[keep], j[keep]
+        yield i, j
+        lo = hi
+
+def near_groups(pos: np.ndarray, eps: float, tags: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    For float64[N,3] positions (NaN rows are skipped) return int64[N] group ids: the
+    smallest index of the group each point belongs to (itself when unmerged). With tags,
+    only points with equal tags are linked.
+    """
+    n = len(pos)
+    group = np.arange(n, dtype=np.int64)
+    valid = np.nonzero(~np.isnan(pos).any(axis=1))[0]
+    if len(valid) < 2:
+        return group
+    tag = tags[valid] if tags is not None else np.zeros(len(valid), dtype=np.int64)
+
+    # 1. exact duplicates -> one representative (the smallest index, np.unique keeps order)
+    rows = np.column_stack([pos[valid], tag.astype(np.float64)])
+    uniq, first, inv = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+    inv = inv.ravel()
+    rep_pos, rep_tag = uniq[:, :3], tag[first]
+    parent = np.arange(len(uniq), dtype=np.int64)
+
+    # 2. + 3. neighbour cells of the representatives
+    if eps > 0 and len(uniq) > 1:
+        cells = np.floor(rep_pos / eps).astype(np.int64)
+        ck = _CellKeys(cells)
+        keys = ck.pack(ck.ranks)
+        order = np.argsort(keys, kind="stable")
+        ukeys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        cell_xyz = cells[order][starts]
+        cell_rank = ck.ranks[order][starts]
+        sorted_pos = rep_pos[order]
+        sorted_tag = rep_tag[order]
+        jobs = [(np.arange(len(ukeys)),) * 2 + (True,)]
+        for off in _HALF_OFFSETS:
+            nk, ok = ck.shifted(cell_rank, cell_xyz, off)
+            ca = np.nonzero(ok)[0]
+            at = np.minimum(np.searchsorted(ukeys, nk[ca]), len(ukeys) - 1)
+            hit = ukeys[at] == nk[ca]
+            if hit.any():
+                jobs.append((ca[hit], at[hit], False))
+        eps2 = eps * eps
+        for ca, cb, same in jobs:
+            for i, j in _cross_pairs(starts, counts, ca, cb, same):
+                d2 = np.sum((sorted_pos[i] - sorted_pos[j]) ** 2, axis=1)
+                hit = d2 <= eps2
+                if tags is not None:
+                    hit &= sorted_tag[i] == sorted_tag[j]
+                if hit.any():
+                    _union(parent, order[i[hit]], order[j[hit]])
+
+    # roots are representative numbers; map them to the smallest point index
+    rep_root = parent
+    smallest = np.full(len(uniq), n, dtype=np.int64)
+    np.minimum.at(smallest, rep_root[inv], valid)
+    group[valid] = smallest[rep_root[inv]]
+    return group
+
+
+# ---------------------------------------------------------------------------
+# document
+# ---------------------------------------------------------------------------
+
+def _uuid(el: Any) -> Optional[str]:
+    meta = el.get("meta") if isinstance(el, dict) else None
+    u = meta.get("uuid") if isinstance(meta, dict) else None
+    return u if isinstance(u, str) else None
+
+def _marker_tags(points: List[Any]) -> np.ndarray:
+    ids: Dict[str, int] = {}
+    out = np.empty(len(points), dtype=np.int64)
+    for i, el in enumerate(points):
+        app = el.get("appearance") if isinstance(el, dict) else None
+        marker = app.get("marker") if isinstance(app, dict) else None
+        out[i] = ids.setdefault(json.dumps(marker, sort_keys=True, separators=(",", ":")), len(ids))
+    return out
+
+def dedupe(doc: Dict[str, Any], eps: float = DEFAULT_EPS,
+           match_marker: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Return (deduplicated document, merge report). The input document is not modified;
+    untouched elements are shared with it.
+    """
+    points = doc.get("points") if isinstance(doc.get("points"), list) else []
+    uuids = [_uuid(el) for el in points]
+    pos = positions_of(doc)
+    pos[[u is None for u in uuids]] = np.nan
+    group = near_groups(pos, eps, _marker_tags(points) if match_marker else None)
+
+    merged = np.nonzero(group != np.arange(len(points)))[0]
+    remap: Dict[str, str] = {uuids[i]: uuids[group[i]] for i in merged}
+    members: Dict[int, List[int]] = {}
+    for i in merged:
+        members.setdefault(int(group[i]), []).append(int(i))
+    groups = []
+    for s, ms in members.items():
+        spread = float(np.max(np.linalg.norm(pos[ms] - pos[s], axis=1)))
+        groups.append({"survivor": uuids[s], "merged": [uuids[i] for i in ms], "max_distance": spread})
+
+    out = dict(doc)
+    if len(merged):
+        drop = np.zeros(len(points), dtype=bool)
+        drop[merged] = True
+        out["points"] = [el for el, d in zip(points, drop) if not d]
+
+    rewritten = 0
+    self_loops: List[Any] = []
+    lines = doc.get("lines")
+    if remap and isinstance(lines, list):
+        new_lines = []
+        for i, el in enumerate(lines):
+            app = el.get("appearance") if isinstance(el, dict) else None
+            if isinstance(app, dict):
+                ends = {}
+                for name in ("end_a", "end_b"):
+                    end = app.get(name)
+                    ref = end.get("ref") if isinstance(end, dict) else None
+                    if isinstance(ref, str) and ref in remap:
+                        ends[name] = dict(end, ref=remap[ref])
+                if ends:
+                    rewritten += len(ends)
+                    el = dict(el, appearance=dict(app, **ends))
+                    a, b = el["appearance"].get("end_a"), el["appearance"].get("end_b")
+                    if isinstance(a, dict) and isinstance(b, dict) and a.get("ref") is not None \
+                            and a.get("ref") == b.get("ref"):
+                        self_loops.append(_uuid(el) or f"lines[{i}]")
+            new_lines.append(el)
+        out["lines"] = new_lines
+
+    report = {
+        "eps": eps,
+        "match_marker": match_marker,
+        "points_in": len(points),
+        "points_out": len(points) - len(merged),
+        "merged": len(merged),
+        "refs_rewritten": rewritten,
+        "self_loops": self_loops,
+        "groups": groups,
+    }
+    return out, report
+
+def default_report_path(path: str) -> str:
+    p = Path(path)
+    stem = p.name[:-len(".json")] if p.name.endswith(".json") else p.name
+    return str(p.with_name(stem + ".merge.json"))
+
+def write_json(doc: Dict[str, Any], path: str, pretty: bool = True) -> None:
+    with DocumentWriter(path, pretty=pretty, chunk_size=1000) as w:
+        for k, v in doc.items():
+            if isinstance(v, list):
+                w.write_array(k, v)
+            else:
+                w.write_member(k, v)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("json", help="Input .3dss.json")
+    ap.add_argument("out", nargs="?", default=None, help="Output .3dss.json")
+    ap.add_argument("--eps", type=float, default=DEFAULT_EPS,
+                    help=f"Merge points closer than this (default: {DEFAULT_EPS:g}; 0 = exact duplicates only)")
+    ap.add_argument("--match-marker", action="store_true", help="Only merge points whose appearance.marker is equal")
+    ap.add_argument("--report", default=None, help="Merge report path (default: OUT, or the input with --dry-run, with .json -> .merge.json)")
+    ap.add_argument("--dry-run", action="store_true", help="Write the report only")
+    ap.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    args = ap.parse_args()
+    if args.eps < 0:
+        ap.error("--eps must be >= 0")
+    if not args.out and not args.dry_run:
+        ap.error("OUT is required unless --dry-run")
+
+    with open(args.json, "r", encoding="utf-8-sig") as f:
+        doc = json.load(f)
+    out, report = dedupe(doc, eps=args.eps, match_marker=args.match_marker)
+
+    report_path = args.report or default_report_path(args.out or args.json)
+    Path(report_path).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"[write] {report_path}")
+    if not args.dry_run:
+        write_json(out, args.out, pretty=not args.compact)
+        print(f"[write] {args.out}")
+    print(f"[dedupe] points {report['points_in']} -> {report['points_out']} "
+          f"(groups={len(report['groups'])} refs_rewritten={report['refs_rewritten']} "
+          f"self_loops={len(report['self_loops'])})")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# dss_diff.py
+# Structural diff / patch of 3DSS documents keyed by meta.uuid.
+#
+# Each of points / lines / aux is indexed by element key in one pass over the base
+# (key = meta.uuid; a repeated uuid gets "#2", "#3", ... appended, an element without one
+# is "#<n>", its position among the unkeyed elements of the section). One pass over the
+# target then sorts every element into unchanged / modified / added, and the keys left in
+# the index are the removed ones, so a diff is O(size of both documents). Files are read
+# through their dss_store index (memory-mapped; built once per file version, so repeated
+# diffs against the same base skip the scan): an element whose bytes are identical on both
+# sides is not parsed a second time, and neither document is held in memory as a whole.
+#
+# The delta (JSON):
+#   format, base        format version; element counts of the base (checked by apply)
+#   members             {name: JSON Patch ops} for document_meta and any other non-section
+#                       top-level member (path "" adds / removes the whole member)
+#   member_order        top-level member names of the target
+#   sections.<s>
+#     removed           [key]
+#     modified          {key: JSON Patch ops (RFC 6902), paths relative to the element}
+#     added             [{"key", "after": key of the preceding target element | null, "element"}]
+#     order             [key] of the whole target section; only when surviving elements
+#                       changed their relative order
+# Element ops are field level: dicts recurse by key, lists by index (length changes are
+# appends / removes at the end), anything else is a "replace".
+#
+# apply (add / remove / replace / move / copy / test ops) reproduces the target exactly:
+# survivors keep the base order, added elements are inserted after their "after" anchor.
+# It streams the base the same way and writes with DocumentWriter.
+#
+# Usage:
+#   python dss_diff.py diff base.3dss.json target.3dss.json [-o delta.json] [--compact]
+#   python dss_diff.py apply base.3dss.json delta.json out.3dss.json [--compact]
+#
+# Usage (from a sibling script):
+#   from dss_diff import diff_documents, apply_delta
+#   delta = diff_documents(base_doc, target_doc)   # parsed documents
+#   doc = apply_delta(base_doc, delta)             # base_doc is not modified
+#
+import sys
+import copy
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from dss_writer import DocumentWriter
+
+DELTA_FORMAT = 1
+SECTIONS = ("points", "lines", "aux")
+
+Op = Dict[str, Any]
+PathLike = Union[str, Path]
+
+
+# ---------------------------------------------------------------------------
+# JSON Patch
+# ---------------------------------------------------------------------------
+
+def _escape(token: Any) -> str:
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+def _diff_value(a: Any, b: Any, path: str, ops: List[Op]) -> None:
+    if type(a) is not type(b):
+        ops.append({"op": "replace", "path": path, "value": b})
+    elif isinstance(a, dict):
+        for k in a:
+            if k not in b:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(k)}"})
+        for k, v in b.items():
+            if k not in a:
+                ops.append({"op": "add", "path": f"{path}/{_escape(k)}", "value": v})
+            elif a[k] != v or type(a[k]) is not type(v):
+                _diff_value(a[k], v, f"{path}/{_escape(k)}", ops)
+    elif isinstance(a, list):
+        n = min(len(a), len(b))
+        for i in range(n):
+            if a[i] != b[i] or type(a[i]) is not type(b[i]):
+                _diff_value(a[i], b[i], f"{path}/{i}", ops)
+        for i in range(n, len(b)):
+            ops.append({"op": "add", "path": f"{path}/{i}", "value": b[i]})
+        for i in range(len(a) - 1, n - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{i}"})
+    elif a != b:
+        ops.append({"op": "replace", "path": path, "value": b})
+
+def diff_value(a: Any, b: Any) -> List[Op]:
+    """
+    RFC 6902 ops turning a into b (paths relative to a).
+    """
+    ops: List[Op] = []
+    _diff_value(a, b, "", ops)
+    return ops
+
+def _tokens(pointer: str) -> List[str]:
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise ValueError(f"bad JSON pointer {pointer!r}")
+    return [t.replace("~1", "/").replace("~0", "~") for t in pointer[1:].split("/")]
+
+def _index(container: List[Any], token: str, insert: bool = False) -> int:
+    if insert and token == "-":
+        return len(container)
+    if not (token.isascii() and token.isdigit()) or (len(token) > 1 and token[0] == "0"):
+        raise ValueError(f"bad array index {token!r}")
+    i = int(token)
+    if i > len(container) or (i == len(container) and not insert):
+        raise ValueError(f"array index {i} out of range")
+    return i
+
+def _resolve(doc: Any, tokens: List[str]) -> Any:
+    for t in tokens:
+        if isinstance(doc, dict):
+            if t not in doc:
+                raise ValueError(f"no member {t!r}")
+            doc = doc[t]
+        elif isinstance(doc, list):
+            doc = doc[_index(doc, t)]
+        else:
+            raise ValueError(f"cannot descend into {type(doc).__name__} at {t!r}")
+    return doc
+
+def _add(doc: Any, tokens: List[str], value: Any) -> Any:
+    if not tokens:
+        return value
+    parent = _resolve(doc, tokens[:-1])
+    last = tokens[-1]
+    if isinstance(parent, dict):
+        parent[last] = value
+    elif isinstance(parent, list):
+        parent.insert(_index(parent, last, insert=True), value)
+    else:
+        raise ValueError(f"cannot add into {type(parent).__name__}")
+    return doc
+
+def _remove(doc: Any, tokens: List[str]) -> Tuple[Any, Any]:
+    if not tokens:
+        return None, doc
+    parent = _resolve(doc, tokens[:-1])
+    last = tokens[-1]
+    if isinstance(parent, dict):
+        if last not in parent:
+            raise ValueError(f"no member {last!r} to remove")
+        return doc, parent.pop(last)
+    if isinstance(parent, list):
+        return doc, parent.pop(_index(parent, last))
+    raise ValueError(f"cannot remove from {type(parent).__name__}")
+
+def apply_ops(doc: Any, ops: Iterable[Op]) -> Any:
+    """
+    Apply RFC 6902 ops in order; containers in doc are modified in place. Returns the
+    result (a new value when an op targets the root). Raises ValueError on a failed op.
+    """
+    for op in ops:
+        kind = op.get("op")
+        tokens = _tokens(op.get("path", ""))
+        if kind == "add":
+            doc = _add(doc, tokens, copy.deepcopy(op["value"]))
+        elif kind == "remove":
+            doc, _ = _remove(doc, tokens)
+        elif kind == "replace":
+            _resolve(doc, tokens)
+            if tokens:
+                doc, _ = _remove(doc, tokens)
+            doc = _add(doc, tokens, copy.deepcopy(op["value"]))
+        elif kind in ("move", "copy"):
+            src = _tokens(op["from"])
+            if kind == "move":
+                doc, value = _remove(doc, src)
+            else:
+                value = copy.deepcopy(_resolve(doc, src))
+            doc = _add(doc, tokens, value)
+        elif kind == "test":
+            value = _resolve(doc, tokens)
+            if value != op["value"] or type(value) is not type(op["value"]):
+                raise ValueError(f"test failed at {op.get('path')!r}")
+        else:
+            raise ValueError(f"unknown op {kind!r}")
+    return doc
+
+
+# ---------------------------------------------------------------------------
+# sections
+# ---------------------------------------------------------------------------
+
+def _uuid_of(el: Any) -> Optional[str]:
+    meta = el.get("meta") if isinstance(el, dict) else None
+    u = meta.get("uuid") if isinstance(meta, dict) else None
+    return u if isinstance(u, str) else None
+
+class _Keyer:
+    """
+    Key of each element of one section from its meta.uuid, called in document order
+    (see the header).
+    """
+
+    def __init__(self):
+        self._seen: Dict[str, int] = {}
+        self._unkeyed = 0
+
+    def __call__(self, u: Optional[str]) -> str:
+        if u is not None:
+            n = self._seen.get(u, 0) + 1
+            self._seen[u] = n
+            return u if n == 1 else f"{u}#{n}"
+        self._unkeyed += 1
+        return f"#{self._unkeyed}"
+
+def element_keys(elements: Iterable[Any]) -> List[str]:
+    key = _Keyer()
+    return [key(_uuid_of(el)) for el in elements]
+
+class _Section:
+    """
+    One section: a list of parsed elements, or a dss_store LazyElements plus the uuids from
+    its index (then raw() gives element bytes and nothing is parsed until needed).
+    """
+
+    def __init__(self, items: Sequence[Any], uuids: Optional[List[Optional[str]]] = None):
+        self.items = items
+        self._uuids = uuids
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, i: int) -> Any:
+        return self.items[i]
+
+    def raw(self, i: int) -> Optional[bytes]:
+        raw = getattr(self.items, "raw", None)
+        return raw(i) if raw is not None else None
+
+    def keys(self) -> List[str]:
+        if self._uuids is None:
+            return element_keys(self.items)
+        key = _Keyer()
+        return [key(u) for u in self._uuids]
+
+    @property
+    def parsed(self) -> bool:
+        return isinstance(self.items, list)
+
+def _diff_section(base: _Section, target: _Section) -> Dict[str, Any]:
+    index: Dict[str, int] = {}
+    for i, key in enumerate(base.keys()):
+        index[key] = i
+    modified: Dict[str, List[Op]] = {}
+    added: List[Dict[str, Any]] = []
+    order = target.keys()
+    reordered = False
+    last = -1
+    for j, key in enumerate(order):
+        i = index.pop(key, None)
+        if i is None:
+            added.append({"key": key, "after": order[j - 1] if j else None, "element": target[j]})
+            continue
+        reordered = reordered or i < last
+        last = i
+        raw = base.raw(i)
+        if raw is None or raw != target.raw(j):
+            ops = diff_value(base[i], target[j])
+            if ops:
+                modified[key] = ops
+    out: Dict[str, Any] = {}
+    if index:
+        out["removed"] = sorted(index, key=index.get)
+    if modified:
+        out["modified"] = modified
+    if added:
+        out["added"] = added
+    if reordered:
+        out["order"] = order
+    return out
+
+def _diff(base_members: Dict[str, Any], base_sections: Dict[str, _Section], base_order: List[str],
+          target_members: Dict[str, Any], target_sections: Dict[str, _Section],
+          target_order: List[str]) -> Dict[str, Any]:
+    members: Dict[str, List[Op]] = {}
+    for name in target_order:
+        if name in SECTIONS:
+            continue
+        if name not in base_members:
+            members[name] = [{"op": "add", "path": "", "value": target_members[name]}]
+        else:
+            ops = diff_value(base_members[name], target_members[name])
+            if ops:
+                members[name] = ops
+    for name in base_order:
+        if name not in SECTIONS and name not in target_members:
+            members[name] = [{"op": "remove", "path": ""}]
+    sections = {}
+    for s in SECTIONS:
+        if s in base_sections or s in target_sections:
+            d = _diff_section(base_sections.get(s, _Section([])), target_sections.get(s, _Section([])))
+            if d:
+                sections[s] = d
+    return {"format": DELTA_FORMAT,
+            "base": {"counts": {s: len(v) for s, v in base_sections.items()}},
+            "members": members, "member_order": target_order, "sections": sections}
+
+def diff_documents(base: Dict[str, Any], target: Dict[str, Any]) -> Dict[str, Any]:
+    def split(doc):
+        members = {k: v for k, v in doc.items() if k not in SECTIONS}
+        sections = {s: _Section(doc[s]) for s in SECTIONS if isinstance(doc.get(s), list)}
+        return members, sections, list(doc)
+    bm, bs, bo = split(base)
+    tm, ts, to = split(target)
+    return _diff(bm, bs, bo, tm, ts, to)
+
+class _MappedDocument:
+    """
+    Members and lazy sections of a file through its dss_store index (built on first use,
+    reused while the file is unchanged).
+    """
+
+    def __init__(self, path: PathLike):
+        from dss_store import open_store
+        self._st = open_store(path)
+        self.order = self._st.member_names
+        self.members = {k: self._st.member(k) for k in self.order if k not in SECTIONS}
+        self.sections = {s: _Section(self._st.sections[s], self._st.uuids(s)) for s in SECTIONS if s in self.order}
+
+    def __enter__(self) -> "_MappedDocument":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.sections = {}
+        self._st.close()
+
+def diff_files(base: PathLike, target: PathLike) -> Dict[str, Any]:
+    with _MappedDocument(base) as b, _MappedDocument(target) as t:
+        return _diff(b.members, b.sections, b.order, t.members, t.sections, t.order)
+
+
+# ---------------------------------------------------------------------------
+# apply
+# ---------------------------------------------------------------------------
+
+def _apply_section(base: _Section, d: Dict[str, Any], name: str) -> Iterator[Any]:
+    removed = set(d.get("removed", ()))
+    modified = d.get("modified", {})
+    added = d.get("added", [])
+    keys = base.keys()
+    known = set(keys)
+    for key in list(removed) + list(modified):
+        if key not in known:
+            raise ValueError(f"{name}: {key} is not in the base")
+
+    def element(i: int, key: str) -> Any:
+        el = base[i]
+        if base.parsed and key in modified:
+            el = copy.deepcopy(el)
+        return apply_ops(el, modified[key]) if key in modified else el
+
+    if "order" in d:
+        at = {k: i for i, k in enumerate(keys)}
+        new = {a["key"]: a["element"] for a in added}
+        for key in d["order"]:
+            if key in new:
+                yield new[key]
+            elif key in at and key not in removed:
+                yield element(at[key], key)
+            else:
+                raise ValueError(f"{name}: order names unknown element {key}")
+        return
+
+    after: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for a in added:
+        after.setdefault(a["after"], []).append(a)
+
+    def chain(anchor: Optional[str]) -> Iterator[Any]:
+        # added elements anchored at `anchor`, each followed by its own followers
+        stack = list(reversed(after.pop(anchor, [])))
+        while stack:
+            a = stack.pop()
+            yield a["element"]
+            stack.extend(reversed(after.pop(a["key"], [])))
+
+    yield from chain(None)
+    for i, key in enumerate(keys):
+        if key not in removed:
+            yield element(i, key)
+        # followers of a removed element stay where it was
+        yield from chain(key)
+    if after:
+        raise ValueError(f"{name}: added element anchored at unknown {next(iter(after))}")
+
+def _check_base(delta: Dict[str, Any], sections: Dict[str, _Section]) -> None:
+    if delta.get("format") != DELTA_FORMAT:
+        raise ValueError(f"unsupported delta format {delta.get('format')!r}")
+    for s, n in delta.get("base", {}).get("counts", {}).items():
+        have = len(sections[s]) if s in sections else 0
+        if have != n:
+            raise ValueError(f"{s}: base has {have} element(s), delta was made against {n}")
+
+def _applied(members: Dict[str, Any], sections: Dict[str, _Section], order: List[str],
+             delta: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+    _check_base(delta, sections)
+    ops = delta.get("members", {})
+    for name in delta.get("member_order", order):
+        if name in SECTIONS:
+            base = sections.get(name, _Section([]))
+            yield name, _apply_section(base, delta.get("sections", {}).get(name, {}), name)
+        elif name in ops or name in members:
+            value = copy.deepcopy(members[name]) if name in members else None
+            yield name, apply_ops(value, ops.get(name, []))
+
+def apply_delta(base: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    members = {k: v for k, v in base.items() if k not in SECTIONS}
+    sections = {s: _Section(base[s]) for s in SECTIONS if isinstance(base.get(s), list)}
+    return {name: list(v) if name in SECTIONS else v
+            for name, v in _applied(members, sections, list(base), delta)}
+
+def apply_file(base: PathLike, delta: Dict[str, Any], out: PathLike, pretty: bool = True) -> Dict[str, int]:
+    """
+    Stream base + delta into out; returns element counts per section.
+    """
+    counts: Dict[str, int] = {}
+    with _MappedDocument(base) as b, DocumentWriter(out, pretty=pretty, chunk_size=1000) as w:
+        for name, value in _applied(b.members, b.sections, b.order, delta):
+            if name in SECTIONS:
+                counts[name] = w.write_array(name, value)
+            else:
+                w.write_member(name, value)
+    return counts
+
+def summary(delta: Dict[str, Any]) -> str:
+    parts = []
+    for s, d in delta.get("sections", {}).items():
+        parts.append(f"{s}: +{len(d.get('added', []))} -{len(d.get('removed', []))} "
+                     f"~{len(d.get('modified', {}))}" + (" (reordered)" if "order" in d else ""))
+    if delta.get("members"):
+        parts.append("members: " + ", ".join(delta["members"]))
+    return "; ".join(parts) if parts else "no changes"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="command", required=True)
+    p_diff = sub.add_parser("diff", help="Write the delta from base to target")
+    p_diff.add_argument("base")
+    p_diff.add_argument("target")
+    p_diff.add_argument("-o", "--out", default=None, help="Delta JSON (default: stdout)")
+    p_diff.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    p_apply = sub.add_parser("apply", help="Apply a delta to base")
+    p_apply.add_argument("base")
+    p_apply.add_argument("delta")
+    p_apply.add_argument("out")
+    p_apply.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    args = ap.parse_args()
+
+    if args.command == "diff":
+        delta = diff_files(args.base, args.target)
+        text = json.dumps(delta, ensure_ascii=False, indent=None if args.compact else 2,
+                          separators=(",", ":") if args.compact else None)
+        if args.out:
+            Path(args.out).write_text(text, encoding="utf-8")
+            print(f"[write] {args.out}")
+        else:
+            sys.stdout.write(text + "\n")
+        print(f"[diff] {summary(delta)}", file=sys.stderr if not args.out else sys.stdout)
+        return 0
+
+    delta = json.loads(Path(args.delta).read_text(encoding="utf-8"))
+    try:
+        counts = apply_file(args.base, delta, args.out, pretty=not args.compact)
+    except ValueError as e:
+        raise SystemExit(f"[apply] FAILED: {e}")
+    print(f"[write] {args.out} (" + " ".join(f"{s}={n}" for s, n in counts.items()) + ")")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
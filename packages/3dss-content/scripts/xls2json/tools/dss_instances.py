@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# dss_instances.py
+# Instanced-draw precompute: point markers and line arrows grouped by style, with packed
+# per-instance transforms, so a viewer can issue one instanced draw per style group
+# instead of one mesh per element.
+#
+# Style signature (canonical JSON, sort_keys) of
+#   a point marker   appearance.marker without common.orientation / common.scale, plus
+#                    appearance.frames (points with visible: false or primitive "none"
+#                    draw nothing and are left out)
+#   a line arrow     arrow.primitive, the line's color / opacity (the arrow mesh uses the
+#                    line material) and frames
+# Groups are numbered in document order of their first member.
+#
+# Per instance (float32, 3 components each):
+#   position      point: appearance.position; arrow: tip - dir * height / 2 (cone center)
+#   orientation   point: common.orientation (yaw, pitch, roll in rad); arrow: unit direction
+#                 the cone's +Y axis is turned to ([0, 1, 0] when auto_orient is false)
+#   scale         point: common.scale; arrow: [radius, height, radius] of a unit cone
+#   element       uint32 index into points / lines
+# Arrow sizes and placement follow the viewer (renderer/context.js): unset height is
+# scene radius * 0.06 clamped to [0.05, line length / 2], unset radius is height / 4
+# (>= 0.03), a pyramid's base widens the radius, placement "both" gives two instances.
+# primitive / placement are trimmed and lower-cased; a missing or unknown placement is
+# end_a on lines whose signification.sense is "b_to_a", end_b otherwise.
+#
+#   <doc>.instances.bin    position | orientation | scale (M x 3 float32 each) | element
+#                          (M uint32), little-endian, instances sorted by group
+#   <doc>.instances.json   source size / mtime, byte layout of the .bin, groups (kind, style,
+#                          first, count) and the draw-call report
+#
+# Usage:
+#   python dss_instances.py scene.3dss.json [--out scene.3dss.json.instances.json]
+#
+# Usage (from a sibling script):
+#   from dss_instances import build_instances, load_instances
+#   table_path = build_instances("scene.3dss.json")
+#   table, arrays = load_instances(table_path)   # arrays["position"][g_first:g_first + g_count]
+#
+import os
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+INSTANCES_FORMAT = 1
+ARRAYS = (("position", "float32", 3), ("orientation", "float32", 3),
+          ("scale", "float32", 3), ("element", "uint32", 1))
+
+PathLike = Union[str, Path]
+
+
+def instances_path(doc: PathLike) -> Path:
+    p = Path(doc)
+    return p.with_name(p.name + ".instances.json")
+
+def _vec3(v: Any) -> Optional[List[float]]:
+    if isinstance(v, list) and len(v) == 3 and all(
+            isinstance(c, (int, float)) and not isinstance(c, bool) for c in v):
+        return v
+    return None
+
+def _number(v: Any) -> Optional[float]:
+    if isinstance(v, (int, float)) and not isinstance(v, bool) and np.isfinite(v) and v > 0:
+        return float(v)
+    return None
+
+def _keyword(v: Any) -> str:
+    # primitive / placement as the viewer reads them: trimmed, lower-case, "" if unset
+    return v.strip().lower() if isinstance(v, str) else ""
+
+def _signature(style: Dict[str, Any]) -> str:
+    return json.dumps(style, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def scene_radius(positions: np.ndarray) -> Optional[float]:
+    """
+    The viewer's scene radius: largest distance from the bounding box center to a point.
+    """
+    if not len(positions):
+        return None
+    center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+    r = float(np.sqrt(((positions - center) ** 2).sum(axis=1).max()))
+    return r if r > 0 else 1.0
+
+
+class _Groups:
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.groups: List[Dict[str, Any]] = []
+        # per instance, in document order
+        self.group: List[int] = []
+        self.position: List[Any] = []
+        self.orientation: List[Any] = []
+        self.scale: List[Any] = []
+        self.element: List[int] = []
+
+    def add(self, kind: str, style: Dict[str, Any], element: int, position: Any,
+            orientation: Any, scale: Any) -> None:
+        sig = kind + ":" + _signature(style)
+        g = self.index.get(sig)
+        if g is None:
+            g = self.index[sig] = len(self.groups)
+            self.groups.append({"kind": kind, "style": style})
+        self.group.append(g)
+        self.position.append(position)
+        self.orientation.append(orientation)
+        self.scale.append(scale)
+        self.element.append(element)
+
+
+def _point_instances(points: List[Any], out: _Groups) -> int:
+    drawn = 0
+    for i, el in enumerate(points):
+        app = el.get("appearance") if isinstance(el, dict) else None
+        if not isinstance(app, dict) or app.get("visible") is False:
+            continue
+        pos = _vec3(app.get("position"))
+        if pos is None:
+            continue
+        marker = app.get("marker") if isinstance(app.get("marker"), dict) else {}
+        if marker.get("primitive") == "none":
+            continue
+        common = marker.get("common") if isinstance(marker.get("common"), dict) else {}
+        style_common = {k: v for k, v in common.items() if k not in ("orientation", "scale")}
+        style = {k: v for k, v in marker.items() if k != "common"}
+        if style_common:
+            style["common"] = style_common
+        style = {"marker": style}
+        if "frames" in app:
+            style["frames"] = app["frames"]
+        out.add("point", style, i, pos, _vec3(common.get("orientation")) or [0, 0, 0],
+                _vec3(common.get("scale")) or [1, 1, 1])
+        drawn += 1
+    return drawn
+
+def _arrow_instances(lines: List[Any], where: Dict[str, List[float]], radius: Optional[float],
+                     out: _Groups) -> Tuple[int, int]:
+    drawn = skipped = 0
+    for i, el in enumerate(lines):
+        app = el.get("appearance") if isinstance(el, dict) else None
+        arrow = app.get("arrow") if isinstance(app, dict) else None
+        if not isinstance(arrow, dict) or app.get("visible") is False:
+            continue
+        prim = _keyword(arrow.get("primitive")) or "cone"
+        placement = _keyword(arrow.get("placement"))
+        if placement not in ("end_a", "end_b", "both", "none"):
+            # a b_to_a line points at end_a unless told otherwise
+            sig = el.get("signification")
+            placement = "end_a" if isinstance(sig, dict) and sig.get("sense") == "b_to_a" else "end_b"
+        if prim == "none" or placement == "none":
+            continue
+        ends = []
+        for name in ("end_a", "end_b"):
+            end = app.get(name) if isinstance(app.get(name), dict) else {}
+            ends.append(where.get(end["ref"]) if isinstance(end.get("ref"), str) else _vec3(end.get("coord")))
+        if ends[0] is None or ends[1] is None:
+            skipped += 1
+            continue
+        a, b = np.asarray(ends[0], dtype=np.float64), np.asarray(ends[1], dtype=np.float64)
+        length = max(1e-6, float(np.linalg.norm(b - a)))
+
+        h = _number(arrow.get("length") if prim == "line" else arrow.get("height"))
+        h = h if h is not None else (radius * 0.06 if radius is not None else length * 0.22)
+        h = max(0.05, min(h, length * 0.5))
+        t = _number(arrow.get("thickness"))
+        r = (t * 0.5 if t is not None else None) if prim == "line" else _number(arrow.get("radius"))
+        r = r if r is not None else max(0.03, h * 0.25)
+        base = arrow.get("base")
+        if prim == "pyramid" and isinstance(base, list) and len(base) >= 2:
+            bmax = max(_number(base[0]) or 0.0, _number(base[1]) or 0.0)
+            if bmax > 0:
+                r = max(r, bmax * 0.5)
+
+        style = {"arrow": prim, "color": app.get("color"), "opacity": app.get("opacity")}
+        if "frames" in app:
+            style["frames"] = app["frames"]
+        auto = bool(arrow["auto_orient"]) if "auto_orient" in arrow else True
+        tips = []
+        if placement in ("end_b", "both"):
+            tips.append((b, b - a))
+        if placement in ("end_a", "both"):
+            tips.append((a, a - b))
+        for tip, d in tips:
+            if np.linalg.norm(d) < 1e-6:
+                continue
+            d = d / np.linalg.norm(d)
+            out.add("arrow", style, i, (tip - d * h * 0.5).tolist(),
+                    d.tolist() if auto else [0, 1, 0], [r, h, r])
+            drawn += 1
+    return drawn, skipped
+
+def collect_instances(doc: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    (groups, arrays sorted by group, report) for a parsed document.
+    """
+    points = doc.get("points") if isinstance(doc.get("points"), list) else []
+    lines = doc.get("lines") if isinstance(doc.get("lines"), list) else []
+    where: Dict[str, List[float]] = {}
+    for el in points:
+        pos = _vec3(el.get("appearance", {}).get("position")) if isinstance(el, dict) else None
+        u = el.get("meta", {}).get("uuid") if isinstance(el, dict) else None
+        if pos is not None and isinstance(u, str):
+            where.setdefault(u, pos)
+
+    out = _Groups()
+    n_points = _point_instances(points, out)
+    radius = scene_radius(np.asarray(list(where.values()), dtype=np.float64).reshape(-1, 3))
+    n_arrows, skipped = _arrow_instances(lines, where, radius, out)
+
+    group = np.asarray(out.group, dtype=np.int64)
+    order = np.argsort(group, kind="stable")
+    counts = np.bincount(group, minlength=len(out.groups))
+    first = np.concatenate([[0], np.cumsum(counts)[:-1]]) if len(counts) else counts
+    groups = [dict(g, first=int(f), count=int(c)) for g, f, c in zip(out.groups, first, counts)]
+    arrays = {
+        "position": np.asarray(out.position, dtype=np.float32).reshape(-1, 3)[order],
+        "orientation": np.asarray(out.orientation, dtype=np.float32).reshape(-1, 3)[order],
+        "scale": np.asarray(out.scale, dtype=np.float32).reshape(-1, 3)[order],
+        "element": np.asarray(out.element, dtype=np.uint32)[order],
+    }
+    before = n_points + n_arrows
+    after = len(groups)
+    report = {
+        "point_instances": n_points,
+        "point_groups": sum(g["kind"] == "point" for g in groups),
+        "arrow_instances": n_arrows,
+        "arrow_groups": sum(g["kind"] == "arrow" for g in groups),
+        "arrows_skipped": skipped,
+        "draw_calls_before": before,
+        "draw_calls_after": after,
+        "reduction": round(1 - after / before, 4) if before else 0.0,
+    }
+    return groups, arrays, report
+
+def _source_stamp(doc: Path) -> Dict[str, Any]:
+    st = doc.stat()
+    return {"name": doc.name, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def build_instances(doc: PathLike, out: Optional[PathLike] = None) -> Path:
+    """
+    Write <doc>.instances.json / .bin (or out / its .bin sibling); returns the table path.
+    """
+    doc = Path(doc)
+    with open(doc, "r", encoding="utf-8-sig") as f:
+        parsed = json.load(f)
+    groups, arrays, report = collect_instances(parsed)
+
+    table_path = Path(out) if out else instances_path(doc)
+    bin_path = table_path.with_suffix(".bin")
+    layout: Dict[str, Any] = {}
+    offset = 0
+    tmp_bin = bin_path.with_name(bin_path.name + ".tmp")
+    with open(tmp_bin, "wb") as f:
+        for name, dtype, components in ARRAYS:
+            data = np.ascontiguousarray(arrays[name], dtype=np.dtype(dtype).newbyteorder("<"))
+            f.write(data.tobytes())
+            layout[name] = {"byteOffset": offset, "type": dtype, "components": components}
+            offset += data.nbytes
+    table = {"format": INSTANCES_FORMAT, "source": _source_stamp(doc), "buffer": bin_path.name,
+             "byteLength": offset, "count": int(len(arrays["element"])), "arrays": layout,
+             "groups": groups, "report": report}
+    tmp_table = table_path.with_name(table_path.name + ".tmp")
+    tmp_table.write_text(json.dumps(table, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp_bin, bin_path)
+    os.replace(tmp_table, table_path)
+    return table_path
+
+def load_instances(table_path: PathLike) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """
+    (style table, {array name: memory-mapped array}) of a written sidecar.
+    """
+    table_path = Path(table_path)
+    table = json.loads(table_path.read_text(encoding="utf-8"))
+    if table.get("format") != INSTANCES_FORMAT:
+        raise ValueError(f"unsupported instances format {table.get('format')!r}")
+    n = table["count"]
+    arrays = {}
+    for name, spec in table["arrays"].items():
+        shape = (n, spec["components"]) if spec["components"] > 1 else (n,)
+        arrays[name] = np.memmap(table_path.parent / table["buffer"], mode="r",
+                                 dtype=np.dtype(spec["type"]).newbyteorder("<"),
+                                 offset=spec["byteOffset"], shape=shape) if n else \
+            np.zeros(shape, dtype=spec["type"])
+    return table, arrays
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("json", help="Input .3dss.json")
+    ap.add_argument("--out", default=None, help="Style table path (default: <doc>.instances.json; "
+                                                "the buffer is written next to it as .bin)")
+    args = ap.parse_args()
+
+    table_path = build_instances(args.json, args.out)
+    table, _ = load_instances(table_path)
+    r = table["report"]
+    print(f"[write] {table_path} (+ {table['buffer']}, {table['byteLength']} bytes)")
+    print(f"[instances] points={r['point_instances']} in {r['point_groups']} group(s), "
+          f"arrows={r['arrow_instances']} in {r['arrow_groups']} group(s)"
+          + (f", {r['arrows_skipped']} arrow line(s) with unresolved ends skipped" if r["arrows_skipped"] else ""))
+    print(f"[instances] draw calls {r['draw_calls_before']} -> {r['draw_calls_after']} "
+          f"(-{r['reduction'] * 100:.1f}%)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
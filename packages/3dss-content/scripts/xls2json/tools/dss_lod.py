@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# dss_lod.py
+# Level-of-detail tiers for a .3dss.json: coarser documents built by grid clustering.
+#
+# Tier k (1..--levels) cuts space into cubic cells of size cell * factor**(k-1) (all tiers
+# share one origin, so with an integer factor the cells nest) and replaces every cell that
+# holds two or more points by one aggregate point:
+#   position        centroid of the members
+#   marker          sphere; common.color = mean member color, radius = mean member size
+#                   * cbrt(count) (volume grows with the count), where a member's size is its
+#                   marker radius (the viewer's default radius when it has none) * scale
+#   meta            uuid5 of (document, tier, cell), tags x:lod-cluster, x:lod-count=<count>
+# Points alone in their cell (and points without a position) are kept as they are.
+#
+# Lines are re-pointed at the aggregates and grouped by their (unordered) pair of ends; a
+# coord endpoint is grouped by the cell it falls in. Lines inside one aggregate disappear;
+# every other group of several lines, or a line touching an aggregate, becomes one straight
+# aggregate line: color = mean member color, opacity = mean member opacity * sqrt(count)
+# (capped at 1), tags x:lod-aggregate, x:lod-count=<count>; coord ends are the mean of the
+# members' coords. A line between two kept points, alone in its group, is kept unchanged,
+# as is any line with an unresolvable endpoint.
+#
+# Clustering, centroids, colors and line grouping are NumPy passes over per-element
+# columns parsed once, so all tiers of a typical library item take well under a second.
+#
+#   <stem>.lod<k>.3dss.json   tier k (document_meta and aux copied from the source)
+#   <stem>.lod.json           tier manifest: cell size and counts of every tier (tier 0 =
+#                             the source document itself)
+#
+# Usage:
+#   python dss_lod.py scene.3dss.json [--out-dir lod/] [--levels 3] [--cell C | --per-cell 8] [--factor 2]
+#
+# Usage (from a sibling script):
+#   from dss_lod import build_tiers
+#   tiers = build_tiers(doc, levels=3)        # [(cell, tier document, stats)]
+#
+import json
+import uuid
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from dss_writer import DocumentWriter
+from xls2json_core import document_namespace
+
+LOD_FORMAT = 1
+PER_CELL = 8
+FACTOR = 2.0
+POINT_COLOR = "#ffffff"
+LINE_COLOR = "#ffffff"
+# schema default of line appearance.opacity
+LINE_OPACITY = 0.4
+
+# end kinds of a line endpoint
+REF, COORD, LOOSE = 0, 1, 2
+
+
+# ---------------------------------------------------------------------------
+# columns
+# ---------------------------------------------------------------------------
+
+def _vec3(v: Any) -> Optional[List[float]]:
+    if isinstance(v, list) and len(v) == 3 and all(
+            isinstance(c, (int, float)) and not isinstance(c, bool) for c in v):
+        return v
+    return None
+
+def _rgb(value: Any, default: str) -> Tuple[float, float, float]:
+    s = value if isinstance(value, str) and len(value) == 7 and value[0] == "#" else default
+    try:
+        return int(s[1:3], 16), int(s[3:5], 16), int(s[5:7], 16)
+    except ValueError:
+        return _rgb(default, default)
+
+def _hex(rgb: Sequence[float]) -> str:
+    return "#" + "".join(f"{int(round(min(max(c, 0), 255))):02x}" for c in rgb)
+
+def _get(el: Any, *path: str) -> Any:
+    for key in path:
+        if not isinstance(el, dict):
+            return None
+        el = el.get(key)
+    return el
+
+class _Points:
+    def __init__(self, points: List[Any]):
+        n = len(points)
+        self.position = np.full((n, 3), np.nan)
+        self.rgb = np.empty((n, 3))
+        self.scale = np.ones(n)
+        self.radius = np.full(n, np.nan)
+        self.uuid: List[Optional[str]] = []
+        for i, el in enumerate(points):
+            pos = _vec3(_get(el, "appearance", "position"))
+            if pos is not None:
+                self.position[i] = pos
+            marker = _get(el, "appearance", "marker")
+            self.rgb[i] = _rgb(_get(marker, "common", "color"), POINT_COLOR)
+            sc = _vec3(_get(marker, "common", "scale"))
+            if sc is not None:
+                self.scale[i] = sum(sc) / 3
+            r = _get(marker, "radius")
+            if isinstance(r, (int, float)) and not isinstance(r, bool):
+                self.radius[i] = r
+            u = _get(el, "meta", "uuid")
+            self.uuid.append(u if isinstance(u, str) else None)
+        self.valid = ~np.isnan(self.position).any(axis=1)
+
+class _Lines:
+    def __init__(self, lines: List[Any], point_index: Dict[str, int]):
+        n = len(lines)
+        self.kind = np.full((n, 2), LOOSE, dtype=np.int64)
+        self.point = np.full((n, 2), -1, dtype=np.int64)
+        self.coord = np.full((n, 2, 3), np.nan)
+        self.rgb = np.empty((n, 3))
+        self.opacity = np.full(n, LINE_OPACITY)
+        for i, el in enumerate(lines):
+            for slot, name in enumerate(("end_a", "end_b")):
+                end = _get(el, "appearance", name)
+                ref = _get(end, "ref")
+                coord = _vec3(_get(end, "coord"))
+                if isinstance(ref, str) and ref in point_index:
+                    self.kind[i, slot] = REF
+                    self.point[i, slot] = point_index[ref]
+                elif not isinstance(ref, str) and coord is not None:
+                    self.kind[i, slot] = COORD
+                    self.coord[i, slot] = coord
+            self.rgb[i] = _rgb(_get(el, "appearance", "color"), LINE_COLOR)
+            op = _get(el, "appearance", "opacity")
+            if isinstance(op, (int, float)) and not isinstance(op, bool):
+                self.opacity[i] = op
+
+
+# ---------------------------------------------------------------------------
+# clustering
+# ---------------------------------------------------------------------------
+
+def _cells(xyz: np.ndarray, origin: np.ndarray, cell: float) -> np.ndarray:
+    return np.floor((xyz - origin) / cell).astype(np.int64)
+
+def _labels(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (label of every row, first row of every label) for int64[N,K] rows; labels are dense
+    and ordered by the rows' first occurrence.
+    """
+    if not len(rows):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    lo = rows.min(axis=0)
+    span = rows.max(axis=0) - lo + 1
+    if float(np.prod(span.astype(np.float64))) < 2.0 ** 62:
+        key = np.ravel_multi_index(tuple((rows - lo).T), tuple(span))
+        _, first, inv = np.unique(key, return_index=True, return_inverse=True)
+    else:
+        _, first, inv = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+    inv = np.asarray(inv).reshape(-1)
+    # renumber so labels follow document order
+    rank = np.empty(len(first), dtype=np.int64)
+    order = np.argsort(first, kind="stable")
+    rank[order] = np.arange(len(first))
+    return rank[inv], first[order]
+
+def _group_mean(labels: np.ndarray, values: np.ndarray, n: int) -> np.ndarray:
+    counts = np.bincount(labels, minlength=n).astype(np.float64)
+    if values.ndim == 1:
+        return np.bincount(labels, weights=values, minlength=n) / counts
+    return np.column_stack([np.bincount(labels, weights=values[:, j], minlength=n)
+                            for j in range(values.shape[1])]) / counts[:, None]
+
+def default_cell(positions: np.ndarray, per_cell: int = PER_CELL) -> float:
+    """
+    Cell size giving ~per_cell points per cell over the occupied extent (axes without
+    extent are ignored, so planar scenes are sized as 2D).
+    """
+    pos = positions[~np.isnan(positions).any(axis=1)]
+    if len(pos) < 2:
+        return 1.0
+    extent = pos.max(axis=0) - pos.min(axis=0)
+    live = extent[extent > 0]
+    if not len(live):
+        return 1.0
+    return float((np.prod(live) * per_cell / len(pos)) ** (1.0 / len(live)))
+
+
+# ---------------------------------------------------------------------------
+# tiers
+# ---------------------------------------------------------------------------
+
+def _tier(doc: Dict[str, Any], pts: _Points, lns: _Lines, origin: np.ndarray, cell: float,
+          level: int, ns: uuid.UUID, base_radius: float) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    points = doc.get("points") or []
+    lines = doc.get("lines") or []
+    n = len(points)
+    vidx = np.flatnonzero(pts.valid)
+    cells = _cells(pts.position[vidx], origin, cell)
+    lab, first = _labels(cells)
+    n_clusters = len(first)
+    counts = np.bincount(lab, minlength=n_clusters)
+
+    # cluster of every point; points without a position are singleton clusters after them
+    cluster = np.empty(n, dtype=np.int64)
+    cluster[vidx] = lab
+    loose = np.flatnonzero(~pts.valid)
+    cluster[loose] = n_clusters + np.arange(len(loose))
+    size = np.concatenate([counts, np.ones(len(loose), dtype=np.int64)])
+    member0 = np.concatenate([vidx[first], loose])
+    n_c = len(size)
+
+    centroid = _group_mean(lab, pts.position[vidx], n_clusters)
+    color = _group_mean(lab, pts.rgb[vidx], n_clusters)
+    radius = np.where(np.isnan(pts.radius[vidx]), base_radius, pts.radius[vidx]) * pts.scale[vidx]
+    radius = _group_mean(lab, radius, n_clusters) * np.cbrt(counts)
+
+    # uuid of every cluster: the point's own for singletons, uuid5 of the cell otherwise
+    ids: List[Optional[str]] = [pts.uuid[int(m)] for m in member0]
+    names = ["c" + ",".join(map(str, row)) for row in cells[first].tolist()]
+    for c in np.flatnonzero(size[:n_clusters] > 1):
+        ids[c] = str(uuid.uuid5(ns, f"lod{level}/point/{names[c]}"))
+
+    # points, each cluster where its first member was
+    out_points: List[Any] = []
+    for c in np.argsort(member0, kind="stable").tolist():
+        if size[c] == 1:
+            out_points.append(points[member0[c]])
+            continue
+        out_points.append({
+            "appearance": {"position": [round(v, 9) for v in centroid[c].tolist()],
+                           "marker": {"primitive": "sphere", "radius": round(float(radius[c]), 6),
+                                      "common": {"color": _hex(color[c])}}},
+            "meta": {"uuid": ids[c], "tags": ["x:lod-cluster", f"x:lod-count={int(size[c])}"]},
+        })
+
+    # line ends -> end keys: clusters 0..n_c-1, coord cells after them
+    end = np.full(lns.kind.shape, -1, dtype=np.int64)
+    is_ref = lns.kind == REF
+    end[is_ref] = cluster[lns.point[is_ref]]
+    is_coord = lns.kind == COORD
+    if is_coord.any():
+        ccells = _cells(lns.coord[is_coord], origin, cell)
+        clab, cfirst = _labels(ccells)
+        end[is_coord] = n_c + clab
+        names = names + ["p" + str(int(i)) for i in loose] + [
+            "x" + ",".join(map(str, row)) for row in ccells[cfirst].tolist()]
+    else:
+        names = names + ["p" + str(int(i)) for i in loose]
+    resolved = (lns.kind != LOOSE).all(axis=1)
+    swap = end[:, 0] > end[:, 1]
+    pair = np.where(swap[:, None], end[:, ::-1], end)
+    in_agg = np.zeros(lns.kind.shape, dtype=bool)
+    in_agg[is_ref] = size[cluster[lns.point[is_ref]]] > 1
+
+    li = np.flatnonzero(resolved)
+    glab, gfirst = _labels(pair[li])
+    n_g = len(gfirst)
+    gcount = np.bincount(glab, minlength=n_g)
+    touches = np.bincount(glab, weights=in_agg[li].any(axis=1), minlength=n_g) > 0
+    k0 = pair[li[gfirst], 0]
+    internal = k0 == pair[li[gfirst], 1]
+    # both ends on the same aggregate point: the lines vanish into it
+    collapsed = internal & (k0 < n_c)
+    collapsed[collapsed] = size[k0[collapsed]] > 1
+    keep_group = ((gcount == 1) & ~touches) | (internal & ~collapsed)
+    aggregate = ~keep_group & ~collapsed
+    keep_line = np.ones(len(lines), dtype=bool)
+    keep_line[li] = keep_group[glab]
+
+    gcolor = _group_mean(glab, lns.rgb[li], n_g)
+    gop = np.minimum(1.0, _group_mean(glab, lns.opacity[li], n_g) * np.sqrt(gcount))
+    # coord of each pair slot, as seen after the swap
+    slot_coord = np.where(swap[li, None, None], lns.coord[li, ::-1], lns.coord[li])
+    gcoord = [_group_mean(glab, np.nan_to_num(slot_coord[:, s]), n_g) for s in (0, 1)]
+
+    def end_json(k: int, g: int, s: int) -> Dict[str, Any]:
+        if k < n_c:
+            return {"ref": ids[k]}
+        return {"coord": [round(v, 9) for v in gcoord[s][g].tolist()]}
+
+    out_lines: List[Any] = []
+    emitted = np.zeros(n_g, dtype=bool)
+    group_of = np.full(len(lines), -1, dtype=np.int64)
+    group_of[li] = glab
+    for i in range(len(lines)):
+        if keep_line[i]:
+            if not resolved[i] and in_agg[i].any():
+                # the other end is dangling in the source; its ref end follows the point into the cluster
+                app = dict(lines[i]["appearance"])
+                for s, name in enumerate(("end_a", "end_b")):
+                    if in_agg[i, s]:
+                        app[name] = {**app[name], "ref": ids[int(end[i, s])]}
+                out_lines.append({**lines[i], "appearance": app})
+                continue
+            out_lines.append(lines[i])
+            continue
+        g = group_of[i]
+        if not aggregate[g] or emitted[g]:
+            continue
+        emitted[g] = True
+        a, b = int(pair[i, 0]), int(pair[i, 1])
+        out_lines.append({
+            "appearance": {"end_a": end_json(a, g, 0), "end_b": end_json(b, g, 1), "line_type": "straight",
+                           "color": _hex(gcolor[g]), "opacity": round(float(gop[g]), 4)},
+            "meta": {"uuid": str(uuid.uuid5(ns, f"lod{level}/line/{names[a]}/{names[b]}")),
+                     "tags": ["x:lod-aggregate", f"x:lod-count={int(gcount[g])}"]},
+        })
+
+    tier = {}
+    for k, v in doc.items():
+        tier[k] = out_points if k == "points" else out_lines if k == "lines" else v
+    stats = {"points": len(out_points), "lines": len(out_lines),
+             "clusters": int((counts > 1).sum()), "aggregated_lines": int(emitted.sum())}
+    return tier, stats
+
+def build_tiers(doc: Dict[str, Any], levels: int = 3, cell: Optional[float] = None,
+                per_cell: int = PER_CELL, factor: float = FACTOR,
+                name: str = "") -> List[Tuple[float, Dict[str, Any], Dict[str, int]]]:
+    """
+    [(cell size, tier document, stats)] for tiers 1..levels, finest first. Stops early once
+    a tier is a single cluster; empty when there are fewer than two positioned points.
+    """
+    points = doc.get("points") if isinstance(doc.get("points"), list) else []
+    lines = doc.get("lines") if isinstance(doc.get("lines"), list) else []
+    pts = _Points(points)
+    point_index: Dict[str, int] = {}
+    for i, u in enumerate(pts.uuid):
+        if u is not None:
+            point_index.setdefault(u, i)
+    lns = _Lines(lines, point_index)
+    ns = document_namespace(None, doc.get("document_meta"), name or "lod")
+    valid = pts.position[pts.valid]
+    origin = valid.min(axis=0) if len(valid) else np.zeros(3)
+    base = cell if cell is not None else default_cell(pts.position, per_cell)
+    # the viewer's marker radius for points without one (renderer/context.js)
+    scene_r = float(np.linalg.norm(valid.max(axis=0) - origin)) / 2 if len(valid) else 0.0
+    base_radius = min(2.5, max(0.15, scene_r * 0.02)) if scene_r > 0 else 0.6
+
+    out = []
+    if len(valid) < 2:
+        return out
+    for level in range(1, levels + 1):
+        c = base * factor ** (level - 1)
+        tier, stats = _tier(doc, pts, lns, origin, c, level, ns, base_radius)
+        out.append((c, tier, stats))
+        if stats["points"] - (len(points) - len(valid)) <= 1:
+            break
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("json", help="Input .3dss.json")
+    ap.add_argument("--out-dir", default=None, help="Directory for the tiers (default: next to the input)")
+    ap.add_argument("--levels", type=int, default=3, help="Number of coarser tiers")
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--cell", type=float, default=None, help="Cell size of tier 1 (world units)")
+    g.add_argument("--per-cell", type=int, default=PER_CELL, help="Size tier 1 cells for ~N points each")
+    ap.add_argument("--factor", type=float, default=FACTOR, help="Cell growth from one tier to the next")
+    ap.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    args = ap.parse_args()
+    if args.levels < 1:
+        ap.error("--levels must be >= 1")
+    if args.cell is not None and args.cell <= 0:
+        ap.error("--cell must be > 0")
+    if args.factor <= 1:
+        ap.error("--factor must be > 1")
+
+    src = Path(args.json)
+    with open(src, "r", encoding="utf-8-sig") as f:
+        doc = json.load(f)
+    stem = src.name[:-len(".3dss.json")] if src.name.endswith(".3dss.json") else src.stem
+    out_dir = Path(args.out_dir) if args.out_dir else src.parent
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    tiers = build_tiers(doc, args.levels, args.cell, args.per_cell, args.factor, name=src.name)
+    entries = [{"level": 0, "file": src.name if out_dir.resolve() == src.parent.resolve() else str(src),
+                "cell": 0, "points": len(doc.get("points") or []), "lines": len(doc.get("lines") or [])}]
+    for level, (cell, tier, stats) in enumerate(tiers, 1):
+        file = f"{stem}.lod{level}.3dss.json"
+        with DocumentWriter(out_dir / file, pretty=not args.compact, chunk_size=1000) as w:
+            for k, v in tier.items():
+                if isinstance(v, list):
+                    w.write_array(k, v)
+                else:
+                    w.write_member(k, v)
+        entries.append({"level": level, "file": file, "cell": cell, **stats})
+        print(f"[lod] {level}: cell={cell:g} points={stats['points']} lines={stats['lines']} "
+              f"(clusters={stats['clusters']} aggregated_lines={stats['aggregated_lines']})")
+    manifest = {"format": LOD_FORMAT, "source": src.name, "tiers": entries}
+    mpath = out_dir / f"{stem}.lod.json"
+    mpath.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"[write] {mpath}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# dss_merge.py
+# Merge N .3dss.json documents into one, streaming (parts / library items -> a scene).
+#
+# points / lines / aux of the inputs are concatenated in input order. A meta.uuid already
+# used by an earlier input is a collision: it is replaced by uuid5("<input>/<uuid>") in
+# that input, consistently (the element's meta.uuid and every end_a / end_b ref to it from
+# the same input), so each input keeps its own topology. Duplicates inside one input are
+# left to the ref check.
+#
+# --offset K=X,Y,Z moves input K (1-based): points' appearance.position, line coord
+# endpoints and line geometry (polyline / bezier / catmullrom points, arc_center). aux
+# elements (grids, axes, HUD) are scene furniture and are not moved; --aux first keeps only
+# the first input's aux.
+#
+# document_meta (--meta):
+#   first / last   that input's document_meta
+#   merge          the first's, with tags united in order, the earliest created_at, the
+#                  latest revised_at and document_uuid = uuid5 of the inputs' document_uuids
+# --meta-json FILE uses the object in FILE instead. Other top-level members are not copied.
+#
+# Each input is read through a memory map twice (dss_store scanner): the first pass only
+# collects its uuids, the second rewrites and writes its elements one at a time. What is
+# held in memory is the uuid set and the remap tables, not the element payload. The output
+# goes through the same ReferenceChecker pass as the converters (--no-ref-check to skip).
+#
+# Usage:
+#   python dss_merge.py a.3dss.json b.3dss.json ... --out scene.3dss.json [--offset 2=10,0,0]
+#                       [--meta first|last|merge | --meta-json meta.json] [--aux all|first|none]
+#                       [--report merge.json] [--compact]
+#
+# Usage (from a sibling script):
+#   from dss_merge import merge_files
+#   report = merge_files(["a.3dss.json", "b.3dss.json"], "scene.3dss.json", offsets={1: (10, 0, 0)})
+#
+import json
+import mmap
+import uuid
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from dss_writer import DocumentWriter
+from xls2json_core import DSS_UUID_NAMESPACE
+
+SECTIONS = ("points", "lines", "aux")
+ENDPOINTS = ("end_a", "end_b")
+GEOMETRY_LISTS = ("polyline_points", "bezier_controls", "catmullrom_points")
+META_POLICIES = ("first", "last", "merge")
+AUX_POLICIES = ("all", "first", "none")
+
+PathLike = Union[str, Path]
+Offset = Tuple[float, float, float]
+
+
+def _uuid_of(el: Any) -> Optional[str]:
+    meta = el.get("meta") if isinstance(el, dict) else None
+    u = meta.get("uuid") if isinstance(meta, dict) else None
+    return u if isinstance(u, str) else None
+
+def _is_vec3(v: Any) -> bool:
+    return isinstance(v, list) and len(v) == 3 and all(
+        isinstance(c, (int, float)) and not isinstance(c, bool) for c in v)
+
+def _moved(v: Any, offset: Offset) -> Any:
+    return [v[0] + offset[0], v[1] + offset[1], v[2] + offset[2]] if _is_vec3(v) else v
+
+
+class _Input:
+    """
+    One input document: a memory map and the element spans of its sections.
+    """
+
+    def __init__(self, path: PathLike):
+        from dss_store import scan
+        self.path = Path(path)
+        self._f = open(self.path, "rb")
+        size = self.path.stat().st_size
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        members, self._spans = scan(self._mm)
+        meta = members.get("document_meta")
+        self.document_meta = json.loads(self._mm[meta[0]:meta[1]]) if meta else None
+        self.remap: Dict[str, str] = {}
+
+    def count(self, section: str) -> int:
+        return len(self._spans.get(section, ())) // 2
+
+    def elements(self, section: str) -> Iterator[Any]:
+        flat = self._spans.get(section, ())
+        for k in range(0, len(flat), 2):
+            yield json.loads(self._mm[flat[k]:flat[k + 1]])
+
+    def close(self) -> None:
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._f.close()
+
+
+def _collect(inputs: List[_Input]) -> int:
+    """
+    Pass 1: uuid collisions of every input against the inputs before it; fills .remap.
+    Returns the number of remapped uuids.
+    """
+    seen: Set[str] = set()
+    remapped = 0
+    for k, inp in enumerate(inputs, 1):
+        local: Dict[str, None] = {}
+        for section in SECTIONS:
+            for el in inp.elements(section):
+                u = _uuid_of(el)
+                if u is not None:
+                    local.setdefault(u, None)
+        for u in local:
+            if u not in seen:
+                continue
+            new = str(uuid.uuid5(DSS_UUID_NAMESPACE, f"{k}/{u}"))
+            n = 1
+            while new in seen or new in local:
+                n += 1
+                new = str(uuid.uuid5(DSS_UUID_NAMESPACE, f"{k}/{u}#{n}"))
+            inp.remap[u] = new
+            seen.add(new)
+            remapped += 1
+        seen.update(local)
+    return remapped
+
+def _rewrite(section: str, el: Any, remap: Dict[str, str], offset: Optional[Offset]) -> Any:
+    if not isinstance(el, dict):
+        return el
+    meta = el.get("meta")
+    if remap and isinstance(meta, dict) and meta.get("uuid") in remap:
+        meta["uuid"] = remap[meta["uuid"]]
+    app = el.get("appearance")
+    if not isinstance(app, dict):
+        return el
+    if section == "points":
+        if offset is not None and "position" in app:
+            app["position"] = _moved(app["position"], offset)
+    elif section == "lines":
+        for name in ENDPOINTS:
+            end = app.get(name)
+            if not isinstance(end, dict):
+                continue
+            if remap and end.get("ref") in remap:
+                end["ref"] = remap[end["ref"]]
+            if offset is not None and "coord" in end:
+                end["coord"] = _moved(end["coord"], offset)
+        g = app.get("geometry")
+        if offset is not None and isinstance(g, dict):
+            for field in GEOMETRY_LISTS:
+                if isinstance(g.get(field), list):
+                    g[field] = [_moved(p, offset) for p in g[field]]
+            if "arc_center" in g:
+                g["arc_center"] = _moved(g["arc_center"], offset)
+    return el
+
+def merge_meta(metas: Sequence[Any], policy: str = "first") -> Any:
+    """
+    document_meta of the output from the inputs' document_meta (None where absent).
+    """
+    present = [m for m in metas if isinstance(m, dict)]
+    if not present:
+        return None
+    if policy == "first":
+        return present[0]
+    if policy == "last":
+        return present[-1]
+    if policy != "merge":
+        raise ValueError(f"unknown document_meta policy {policy!r}")
+    out = dict(present[0])
+    tags: Dict[str, None] = {}
+    for m in present:
+        for t in m.get("tags") or []:
+            tags.setdefault(t, None)
+    if tags:
+        out["tags"] = list(tags)
+    for key, pick in (("created_at", min), ("revised_at", max)):
+        values = [m[key] for m in present if isinstance(m.get(key), str)]
+        if values:
+            out[key] = pick(values)
+    ids = [m.get("document_uuid") for m in present if isinstance(m.get("document_uuid"), str)]
+    if len(ids) > 1:
+        out["document_uuid"] = str(uuid.uuid5(DSS_UUID_NAMESPACE, "merge/" + ",".join(ids)))
+    return out
+
+def merge_files(paths: Sequence[PathLike], out: PathLike, offsets: Optional[Dict[int, Offset]] = None,
+                meta_policy: str = "first", document_meta: Any = None, aux: str = "all",
+                pretty: bool = True, ref_check: bool = True) -> Dict[str, Any]:
+    """
+    Merge `paths` into `out`; offsets are keyed by 1-based input number. Returns the report
+    (counts, per-input remaps, and the RefReport as "refs" when ref_check).
+    """
+    if aux not in AUX_POLICIES:
+        raise ValueError(f"unknown aux policy {aux!r}")
+    offsets = offsets or {}
+    inputs = [_Input(p) for p in paths]
+    try:
+        remapped = _collect(inputs)
+        meta = document_meta if document_meta is not None else \
+            merge_meta([inp.document_meta for inp in inputs], meta_policy)
+
+        refs = None
+        if ref_check:
+            from dss_refcheck import ReferenceChecker
+            refs = ReferenceChecker()
+
+        def section_elements(section: str) -> Iterator[Any]:
+            for k, inp in enumerate(inputs, 1):
+                if section == "aux" and (aux == "none" or (aux == "first" and k > 1)):
+                    continue
+                for el in inp.elements(section):
+                    yield _rewrite(section, el, inp.remap, offsets.get(k))
+
+        counts: Dict[str, int] = {}
+        with DocumentWriter(out, pretty=pretty, chunk_size=1000) as w:
+            if meta is not None:
+                w.write_member("document_meta", meta)
+            for section in SECTIONS:
+                if not any(inp.count(section) for inp in inputs) and section != "points":
+                    continue
+                elements = section_elements(section)
+                counts[section] = w.write_array(section, refs.watch(section, elements) if refs else elements)
+        report: Dict[str, Any] = {
+            "inputs": [{"path": str(inp.path), "counts": {s: inp.count(s) for s in SECTIONS},
+                        "offset": list(offsets[k]) if k in offsets else None, "remap": inp.remap}
+                       for k, inp in enumerate(inputs, 1)],
+            "counts": counts,
+            "remapped": remapped,
+        }
+        if refs is not None:
+            report["refs"] = refs.finish()
+        return report
+    finally:
+        for inp in inputs:
+            inp.close()
+
+
+def _offset_arg(text: str) -> Tuple[int, Offset]:
+    try:
+        k, xyz = text.split("=", 1)
+        x, y, z = (float(c) for c in xyz.split(","))
+        return int(k), (x, y, z)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K=X,Y,Z, got {text!r}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("inputs", nargs="+", help="Input .3dss.json files, in output order")
+    ap.add_argument("--out", required=True, help="Output .3dss.json")
+    ap.add_argument("--offset", type=_offset_arg, action="append", default=[], metavar="K=X,Y,Z",
+                    help="Move input K (1-based) by (X, Y, Z); repeatable")
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--meta", choices=META_POLICIES, default="first", help="document_meta policy (default: first)")
+    g.add_argument("--meta-json", default=None, help="JSON file containing the output document_meta object")
+    ap.add_argument("--aux", choices=AUX_POLICIES, default="all", help="Which inputs' aux to keep (default: all)")
+    ap.add_argument("--report", default=None, help="Write counts and uuid remaps (JSON) here")
+    ap.add_argument("--no-ref-check", action="store_true",
+                    help="Skip the line endpoint ref / duplicate uuid check")
+    ap.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    args = ap.parse_args()
+
+    offsets = dict(args.offset)
+    bad = [k for k in offsets if not 1 <= k <= len(args.inputs)]
+    if bad:
+        ap.error(f"--offset input number out of range: {bad[0]}")
+    document_meta = None
+    if args.meta_json:
+        document_meta = json.loads(Path(args.meta_json).read_text(encoding="utf-8"))
+
+    report = merge_files(args.inputs, args.out, offsets, args.meta, document_meta, args.aux,
+                         pretty=not args.compact, ref_check=not args.no_ref_check)
+    print(f"[write] {args.out} (" + " ".join(f"{s}={n}" for s, n in report["counts"].items()) + ")")
+    print(f"[merge] inputs={len(args.inputs)} remapped uuids={report['remapped']}")
+    refs = report.pop("refs", None)
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"[write] {args.report}")
+    if refs is not None:
+        from dss_refcheck import exit_on_errors
+        exit_on_errors(refs)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# dss_refcheck.py
+# Reference integrity pass for 3DSS documents (what JSON Schema cannot check):
+#   - line endpoints: appearance.end_a.ref / end_b.ref must name a point's meta.uuid
+#   - meta.uuid must be unique across points, lines and aux
+#   - a line whose two endpoint refs are the same point is reported as a self-loop (warning)
+#
+# Elements are fed one at a time (ReferenceChecker.watch() wraps the converters' element
+# generators), so the pass is one O(n) sweep over a uuid -> (section, index) hash index and
+# never needs the whole document in memory. Refs seen before their point (lines listed
+# ahead of points) are resolved at finish().
+#
+# Optionally writes the resolved endpoint table as CSV: line,end_a,end_b (point indices,
+# -1 for coord endpoints and dangling refs).
+#
+# Usage:
+#   python dss_refcheck.py in.3dss.json [--table lines_resolved.csv] [--max-messages 50]
+#
+# Usage (from a sibling script):
+#   from dss_refcheck import ReferenceChecker
+#   rc = ReferenceChecker()
+#   write_document(out, meta, {"points": rc.watch("points", pts), "lines": rc.watch("lines", lns)})
+#   report = rc.finish()      # report.errors / report.warnings: [(json pointer, message)]
+#
+import csv
+import sys
+import json
+import mmap
+import argparse
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+ENDPOINTS = ("end_a", "end_b")
+
+Message = Tuple[str, str]
+
+
+class RefReport:
+    def __init__(self, counts: Dict[str, int], resolved: int, errors: List[Message],
+                 warnings: List[Message], table: Optional[array]):
+        self.counts = counts
+        self.resolved = resolved
+        self.errors = errors
+        self.warnings = warnings
+        self.table = table
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def summary(self) -> str:
+        return (f"points={self.counts.get('points', 0)} lines={self.counts.get('lines', 0)} "
+                f"resolved={self.resolved} errors={len(self.errors)} warnings={len(self.warnings)}")
+
+    def write_table(self, path: str) -> None:
+        if self.table is None:
+            raise ValueError("ReferenceChecker was created without table=True")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["line", "end_a", "end_b"])
+            t = self.table
+            for i in range(len(t) // 2):
+                w.writerow([i, t[2 * i], t[2 * i + 1]])
+
+
+class ReferenceChecker:
+    """
+    add() / watch() elements section by section, then finish() for the RefReport.
+    """
+
+    def __init__(self, table: bool = False):
+        # first occurrence of every meta.uuid
+        self._seen: Dict[str, Tuple[str, int]] = {}
+        self._counts: Dict[str, int] = {}
+        # (line index, endpoint slot, ref) whose point had not been seen yet
+        self._pending: List[Tuple[int, int, str]] = []
+        self._table = array("i") if table else None
+        self._resolved = 0
+        self.errors: List[Message] = []
+        self.warnings: List[Message] = []
+
+    def add(self, section: str, el: Any) -> None:
+        i = self._counts.get(section, 0)
+        self._counts[section] = i + 1
+        if not isinstance(el, dict):
+            if self._table is not None and section == "lines":
+                self._table.extend((-1, -1))
+            return
+        meta = el.get("meta")
+        u = meta.get("uuid") if isinstance(meta, dict) else None
+        if isinstance(u, str):
+            first = self._seen.setdefault(u, (section, i))
+            if first != (section, i):
+                self.errors.append((f"/{section}/{i}/meta/uuid",
+                                    f"duplicate uuid {u} (first used at /{first[0]}/{first[1]})"))
+        if section == "lines":
+            self._add_line(i, el)
+
+    def _add_line(self, i: int, el: Dict[str, Any]) -> None:
+        app = el.get("appearance")
+        refs: List[Optional[str]] = [None, None]
+        if isinstance(app, dict):
+            for slot, name in enumerate(ENDPOINTS):
+                end = app.get(name)
+                ref = end.get("ref") if isinstance(end, dict) else None
+                if isinstance(ref, str):
+                    refs[slot] = ref
+        idx = [-1, -1]
+        for slot, ref in enumerate(refs):
+            if ref is None:
+                continue
+            hit = self._seen.get(ref)
+            if hit is not None and hit[0] == "points":
+                idx[slot] = hit[1]
+                self._resolved += 1
+            else:
+                # the point may still come (lines listed before points); decided in finish()
+                self._pending.append((i, slot, ref))
+        if refs[0] is not None and refs[0] == refs[1]:
+            self.warnings.append((f"/lines/{i}/appearance", f"self-loop: end_a and end_b both ref {refs[0]}"))
+        if self._table is not None:
+            self._table.extend(idx)
+
+    def watch(self, section: str, elements: Iterable[Any]) -> Iterator[Any]:
+        """
+        Pass elements through unchanged while checking them.
+        """
+        for el in elements:
+            self.add(section, el)
+            yield el
+
+    def finish(self) -> RefReport:
+        for i, slot, ref in self._pending:
+            hit = self._seen.get(ref)
+            path = f"/lines/{i}/appearance/{ENDPOINTS[slot]}/ref"
+            if hit is None:
+                self.errors.append((path, f"dangling ref {ref}: no point has this uuid"))
+            elif hit[0] != "points":
+                self.errors.append((path, f"ref {ref} names /{hit[0]}/{hit[1]}, not a point"))
+            else:
+                self._resolved += 1
+                if self._table is not None:
+                    self._table[2 * i + slot] = hit[1]
+        self._pending = []
+        self.errors.sort(key=lambda m: _pointer_order(m[0]))
+        self.warnings.sort(key=lambda m: _pointer_order(m[0]))
+        return RefReport(dict(self._counts), self._resolved, self.errors, self.warnings, self._table)
+
+def _pointer_order(pointer: str):
+    # numeric segments compare as numbers so /lines/10 sorts after /lines/9
+    return [(0, int(p), "") if p.isdigit() else (1, 0, p) for p in pointer.split("/")[1:]]
+
+def check_document(doc: Dict[str, Any], table: bool = False) -> RefReport:
+    rc = ReferenceChecker(table=table)
+    for section in ("points", "lines", "aux"):
+        items = doc.get(section) if isinstance(doc, dict) else None
+        if isinstance(items, list):
+            for el in items:
+                rc.add(section, el)
+    return rc.finish()
+
+def check_file(path: str, table: bool = False) -> RefReport:
+    """
+    Stream a .3dss.json element by element (dss_store scanner over a memory map).
+    """
+    from dss_store import scan
+    rc = ReferenceChecker(table=table)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        _, spans = scan(mm)
+        for section in ("points", "lines", "aux"):
+            flat = spans.get(section)
+            if flat is None:
+                continue
+            for k in range(0, len(flat), 2):
+                rc.add(section, json.loads(mm[flat[k]:flat[k + 1]]))
+    return rc.finish()
+
+def print_report(report: RefReport, max_messages: int = 50, file=None) -> None:
+    file = file or sys.stdout
+    for kind, items in (("error", report.errors), ("warning", report.warnings)):
+        for path, msg in items[:max_messages]:
+            print(f"[refcheck] {kind} {path}: {msg}", file=file)
+        if len(items) > max_messages:
+            print(f"[refcheck] ... and {len(items) - max_messages} more {kind}s", file=file)
+
+def exit_on_errors(report: RefReport, max_messages: int = 20) -> None:
+    """
+    Converter epilogue: print the findings and stop like a failed [validate] would.
+    """
+    print_report(report, max_messages)
+    if not report.ok:
+        raise SystemExit(f"[refcheck] FAILED: {report.summary()}")
+    print(f"[refcheck] OK ({report.resolved} endpoint refs resolved)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("json", help="Input .3dss.json")
+    ap.add_argument("--table", default=None, help="Write the resolved endpoint index table (CSV) here")
+    ap.add_argument("--max-messages", type=int, default=50)
+    args = ap.parse_args()
+
+    report = check_file(args.json, table=bool(args.table))
+    print_report(report, args.max_messages)
+    if args.table:
+        report.write_table(args.table)
+        print(f"[write] {args.table}")
+    print(f"[refcheck] {'OK' if report.ok else 'FAILED'}: {report.summary()}")
+    return 0 if report.ok else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
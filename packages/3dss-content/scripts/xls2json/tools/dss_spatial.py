@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# dss_spatial.py
+# Spatial index over points[*].appearance.position: a uniform grid in CSR form.
+#
+# The bounding box of the positions (trimmed to the 0.5..99.5 percentiles, so a few far
+# outliers do not inflate every cell; they go to the border cells) is cut into cubic cells
+# sized for ~PER_CELL points each (axes with no extent are ignored when sizing, so planar
+# scenes still get a 2D grid).
+# Points are sorted by linear cell id (x fastest), so
+#
+#   order    int64[M]     point index of each sorted slot (points without a position are left out)
+#   points   float64[M,3] positions in that order
+#   starts   int64[C+1]   slots of cell c are starts[c]:starts[c+1]
+#
+# and the cells of one x-run of a query box are one contiguous slice. bbox / radius
+# queries gather those slices and test only the candidates; nearest() grows a radius
+# query until it holds k points.
+#
+# Persisted next to the document as <doc>.spatial.npz (plus the document's size / mtime;
+# a stale file is rebuilt by open_spatial()). Positions come from the dss_store index,
+# so building does not json.loads the whole document either.
+#
+# Usage:
+#   python dss_spatial.py build doc.3dss.json
+#   python dss_spatial.py bbox doc.3dss.json XMIN YMIN ZMIN XMAX YMAX ZMAX
+#   python dss_spatial.py radius doc.3dss.json X Y Z R
+#   python dss_spatial.py knn doc.3dss.json X Y Z K
+#
+# Usage (from a sibling script):
+#   from dss_spatial import open_spatial
+#   sp = open_spatial("scene.3dss.json")
+#   idx = sp.radius((0, 0, 0), 5.0)           # point indices, ascending
+#   idx, dist = sp.nearest((0, 0, 0), 10)     # nearest first
+#
+import os
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+SPATIAL_FORMAT = 1
+PER_CELL = 8
+
+PathLike = Union[str, Path]
+
+
+def spatial_path(doc: PathLike) -> Path:
+    p = Path(doc)
+    return p.with_name(p.name + ".spatial.npz")
+
+def positions_of(doc: Dict[str, Any]) -> np.ndarray:
+    """
+    float64[N,3] appearance.position of every point of a parsed document (NaN where absent).
+    """
+    points = doc.get("points") if isinstance(doc, dict) else None
+    points = points if isinstance(points, list) else []
+    out = np.full((len(points), 3), np.nan)
+    for i, el in enumerate(points):
+        app = el.get("appearance") if isinstance(el, dict) else None
+        pos = app.get("position") if isinstance(app, dict) else None
+        if isinstance(pos, list) and len(pos) == 3 and all(
+                isinstance(c, (int, float)) and not isinstance(c, bool) for c in pos):
+            out[i] = pos
+    return out
+
+def _cell_size(extent: np.ndarray, n: int, per_cell: int) -> float:
+    live = extent[extent > 0]
+    if n == 0 or len(live) == 0:
+        return 1.0
+    return float((np.prod(live) * per_cell / n) ** (1.0 / len(live)))
+
+
+class SpatialIndex:
+    def __init__(self, origin: np.ndarray, cell: float, dims: np.ndarray, starts: np.ndarray,
+                 order: np.ndarray, points: np.ndarray, count: int, bounds: np.ndarray):
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.cell = float(cell)
+        self.dims = np.asarray(dims, dtype=np.int64)
+        self.starts = starts
+        self.order = order
+        self.points = points
+        # number of points in the document, including those without a position
+        self.count = int(count)
+        # [min, max] of all indexed positions (outliers included)
+        self.bounds = np.asarray(bounds, dtype=np.float64).reshape(2, 3)
+
+    @classmethod
+    def build(cls, positions: np.ndarray, per_cell: int = PER_CELL) -> "SpatialIndex":
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        valid = np.nonzero(~np.isnan(positions).any(axis=1))[0]
+        pts = positions[valid]
+        m = len(pts)
+        bounds = np.array([pts.min(axis=0), pts.max(axis=0)]) if m else np.zeros((2, 3))
+        lo, hi = np.percentile(pts, [0.5, 99.5], axis=0) if m else bounds
+        cell = _cell_size(hi - lo, m, per_cell)
+        dims = np.floor((hi - lo) / cell).astype(np.int64) + 1
+        # rounding can still blow up the cell count (very uneven extents); keep it O(M)
+        while int(np.prod(dims)) > 4 * m + 64:
+            cell *= 1.25
+            dims = np.floor((hi - lo) / cell).astype(np.int64) + 1
+        ids = cls._cell_ids(pts, lo, cell, dims)
+        sort = np.argsort(ids, kind="stable")
+        counts = np.bincount(ids, minlength=int(np.prod(dims)))
+        starts = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=starts[1:])
+        return cls(lo, cell, dims, starts, valid[sort].astype(np.int64), np.ascontiguousarray(pts[sort]),
+                   len(positions), bounds)
+
+    @staticmethod
+    def _cell_ids(pts: np.ndarray, origin: np.ndarray, cell: float, dims: np.ndarray) -> np.ndarray:
+        c = np.clip(np.floor((pts - origin) / cell).astype(np.int64), 0, dims - 1)
+        return c[:, 0] + dims[0] * (c[:, 1] + dims[1] * c[:, 2])
+
+    # -----------------------------------------------------------------------
+    # queries
+    # -----------------------------------------------------------------------
+
+    def _candidates(self, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        """
+        Sorted slots of every cell overlapping [lo, hi] (a superset of the answer).
+        """
+        if len(self.order) == 0 or np.any(lo > hi) or np.any(hi < self.bounds[0]) or np.any(lo > self.bounds[1]):
+            return np.zeros(0, dtype=np.int64)
+        # border cells also hold everything beyond the grid, so clip instead of rejecting
+        c0 = np.floor((lo - self.origin) / self.cell)
+        c1 = np.floor((hi - self.origin) / self.cell)
+        c0 = np.clip(c0, 0, self.dims - 1).astype(np.int64)
+        c1 = np.clip(c1, 0, self.dims - 1).astype(np.int64)
+        nx, ny = int(self.dims[0]), int(self.dims[1])
+        iy = np.arange(c0[1], c1[1] + 1)
+        iz = np.arange(c0[2], c1[2] + 1)
+        # one contiguous run of slots per (y, z) row of cells
+        base = (nx * (iy[None, :] + ny * iz[:, None])).ravel()
+        s = self.starts[base + c0[0]]
+        e = self.starts[base + c1[0] + 1]
+        lens = e - s
+        total = int(lens.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        run_start = np.cumsum(lens) - lens
+        return np.repeat(s - run_start, lens) + np.arange(total, dtype=np.int64)
+
+    def bbox(self, lo: Sequence[float], hi: Sequence[float]) -> np.ndarray:
+        """
+        Indices of points whose position lies in the closed box [lo, hi], ascending.
+        """
+        lo = np.asarray(lo, dtype=np.float64)
+        hi = np.asarray(hi, dtype=np.float64)
+        cand = self._candidates(lo, hi)
+        p = self.points[cand]
+        inside = np.all((p >= lo) & (p <= hi), axis=1)
+        return np.sort(self.order[cand[inside]])
+
+    def _within(self, center: np.ndarray, r: float) -> Tuple[np.ndarray, np.ndarray]:
+        cand = self._candidates(center - r, center + r)
+        d2 = np.sum((self.points[cand] - center) ** 2, axis=1)
+        keep = d2 <= r * r
+        return cand[keep], d2[keep]
+
+    def radius(self, center: Sequence[float], r: float) -> np.ndarray:
+        """
+        Indices of points within distance r of center (inclusive), ascending.
+        """
+        slots, _ = self._within(np.asarray(center, dtype=np.float64), float(r))
+        return np.sort(self.order[slots])
+
+    def nearest(self, center: Sequence[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The k points closest to center: (indices, distances), nearest first.
+        """
+        center = np.asarray(center, dtype=np.float64)
+        m = len(self.order)
+        k = min(int(k), m)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        # every point lies within this radius of center
+        far = float(np.sqrt(np.sum(np.maximum(np.abs(center - self.bounds[0]),
+                                              np.abs(center - self.bounds[1])) ** 2)))
+        # start around the radius that would hold k points at the build density, measured
+        # from the nearest face of the bounds when center lies outside them
+        gap = float(np.linalg.norm(center - np.clip(center, self.bounds[0], self.bounds[1])))
+        r = gap + self.cell * max(1.0, (k / PER_CELL) ** (1.0 / 3.0))
+        while True:
+            slots, d2 = self._within(center, r)
+            if len(slots) >= k or r >= far:
+                break
+            r *= 2.0
+        take = np.argpartition(d2, k - 1)[:k] if len(slots) > k else np.arange(len(slots))
+        # ties broken by point index so results do not depend on cell layout
+        idx = self.order[slots[take]]
+        first = np.lexsort((idx, d2[take]))
+        return idx[first], np.sqrt(d2[take][first])
+
+    # -----------------------------------------------------------------------
+    # persistence
+    # -----------------------------------------------------------------------
+
+    def save(self, path: PathLike, source: Optional[Dict[str, int]] = None) -> None:
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        header = {"format": SPATIAL_FORMAT, "cell": self.cell, "count": self.count, "source": source}
+        np.savez(tmp, header=np.array(json.dumps(header)), origin=self.origin, bounds=self.bounds, dims=self.dims,
+                 starts=self.starts, order=self.order, points=self.points)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: PathLike) -> Tuple["SpatialIndex", Dict[str, Any]]:
+        with np.load(path) as z:
+            header = json.loads(str(z["header"]))
+            if header.get("format") != SPATIAL_FORMAT:
+                raise ValueError(f"{path}: unsupported spatial index format {header.get('format')}")
+            sp = cls(z["origin"], header["cell"], z["dims"], z["starts"], z["order"], z["points"],
+                     header["count"], z["bounds"])
+        return sp, header
+
+
+def _source_stamp(doc: Path) -> Dict[str, int]:
+    st = doc.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def build_spatial(doc: PathLike, out: Optional[PathLike] = None, per_cell: int = PER_CELL) -> Path:
+    """
+    Build and save the spatial index of a .3dss.json; returns the .spatial.npz path.
+    """
+    from dss_store import open_store
+    doc = Path(doc)
+    with open_store(doc) as st:
+        sp = SpatialIndex.build(np.array(st.positions), per_cell=per_cell)
+    out = Path(out) if out else spatial_path(doc)
+    sp.save(out, _source_stamp(doc))
+    return out
+
+def open_spatial(doc: PathLike, rebuild: bool = False) -> SpatialIndex:
+    """
+    The saved index of a document, rebuilt first if missing or older than the document.
+    """
+    doc = Path(doc)
+    path = spatial_path(doc)
+    if not rebuild and path.exists():
+        try:
+            sp, header = SpatialIndex.load(path)
+            if header.get("source") == _source_stamp(doc):
+                return sp
+        except (OSError, ValueError, KeyError):
+            pass
+    build_spatial(doc, path)
+    return SpatialIndex.load(path)[0]
+
+
+def _point_label(st, i: int) -> str:
+    el = st.points[i]
+    meta = el.get("meta") if isinstance(el, dict) else None
+    u = meta.get("uuid") if isinstance(meta, dict) else None
+    return u if isinstance(u, str) else f"points[{i}]"
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="(Re)build <doc>.spatial.npz")
+    p_build.add_argument("doc")
+    p_build.add_argument("--per-cell", type=int, default=PER_CELL, help="Target points per grid cell")
+    p_box = sub.add_parser("bbox", help="Points inside a box")
+    p_box.add_argument("doc")
+    p_box.add_argument("coords", nargs=6, type=float, metavar="C")
+    p_rad = sub.add_parser("radius", help="Points within R of (X, Y, Z)")
+    p_rad.add_argument("doc")
+    p_rad.add_argument("coords", nargs=4, type=float, metavar="C")
+    p_knn = sub.add_parser("knn", help="The K points nearest to (X, Y, Z)")
+    p_knn.add_argument("doc")
+    p_knn.add_argument("coords", nargs=3, type=float, metavar="C")
+    p_knn.add_argument("k", type=int)
+    args = ap.parse_args()
+
+    if args.command == "build":
+        out = build_spatial(args.doc, per_cell=args.per_cell)
+        sp, _ = SpatialIndex.load(out)
+        print(f"[spatial] {out} (points={len(sp.order)}/{sp.count} cells={int(np.prod(sp.dims))} "
+              f"cell={sp.cell:g})")
+        return 0
+
+    from dss_store import open_store
+    sp = open_spatial(args.doc)
+    with open_store(args.doc) as st:
+        if args.command == "knn":
+            idx, dist = sp.nearest(args.coords, args.k)
+            for i, d in zip(idx, dist):
+                print(f"{_point_label(st, int(i))}\t{d:g}")
+        else:
+            if args.command == "bbox":
+                idx = sp.bbox(args.coords[:3], args.coords[3:])
+            else:
+                idx = sp.radius(args.coords[:3], args.coords[3])
+            for i in idx:
+                print(_point_label(st, int(i)))
+        print(f"[{args.command}] {len(idx)} point(s)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# dss_store.py
+# Lazy, memory-mapped read access to a .3dss.json without json.loads of the whole file.
+#
+# A one-pass byte scanner records where document_meta and every points / lines / aux
+# element start and end in the file. That index is saved next to the document
+# (<doc>.index/, rebuilt when the document's size or mtime changes) together with
+# numeric columns:
+#
+#   meta.json                 format, source size/mtime, element counts, member spans
+#   <s>.offsets.npy           int64[N,2]  byte [start, end) of each element of section <s>
+#   points.position.npy       float64[N,3] appearance.position (NaN where absent)
+#   uuid.keys.npy             S<n>[U]     every meta.uuid, sorted
+#   uuid.section.npy          int8[U]     section of each key (index into SECTIONS)
+#   uuid.index.npy            int64[U]    element index of each key
+#
+# Opening a store only memory-maps the document and these arrays; elements are parsed
+# when accessed, and uuid lookups are a binary search over the mapped keys.
+#
+# Usage:
+#   python dss_store.py index doc.3dss.json
+#   python dss_store.py get doc.3dss.json UUID
+#   python dss_store.py bbox doc.3dss.json XMIN YMIN ZMIN XMAX YMAX ZMAX
+#
+# Usage (from a sibling script):
+#   from dss_store import open_store
+#   with open_store("scene.3dss.json") as st:
+#       el = st.points[123]             # one dict, parsed on access
+#       hit = st.get(uuid_str)          # (section, index, element) or None
+#       xyz = st.positions              # memory-mapped float64[N,3]
+#
+import os
+import re
+import json
+import mmap
+import shutil
+import argparse
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+INDEX_FORMAT = 1
+SECTIONS = ("points", "lines", "aux")
+
+PathLike = Union[str, Path]
+
+# strings (unrolled so long strings are one fast match) and the structural characters
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{},:]', re.DOTALL)
+_WS = b" \t\r\n"
+
+
+# ---------------------------------------------------------------------------
+# scanner
+# ---------------------------------------------------------------------------
+
+def _trim(buf, start: int, end: int) -> Tuple[int, int]:
+    while start < end and buf[start] in _WS:
+        start += 1
+    while end > start and buf[end - 1] in _WS:
+        end -= 1
+    return start, end
+
+def scan(buf, sections: Sequence[str] = SECTIONS) -> Tuple[Dict[str, Tuple[int, int]], Dict[str, array]]:
+    """
+    Byte spans of the top-level members of the JSON object in `buf` (bytes or mmap), and
+    for each member in `sections` that is an array, a flat array('q') of
+    [start0, end0, start1, end1, ...] element spans. Nothing is parsed.
+    """
+    members: Dict[str, Tuple[int, int]] = {}
+    spans: Dict[str, array] = {}
+    wanted = {s.encode("utf-8"): s for s in sections}
+    depth = 0
+    expect_key = False
+    key: Optional[str] = None
+    value_start = 0
+    current: Optional[array] = None       # element spans of the section array being scanned
+    elem_start = 0
+
+    for m in _TOKEN.finditer(buf):
+        tok = buf[m.start()]
+        if tok == 0x22:                   # string
+            if depth == 1 and expect_key:
+                raw = m.group()[1:-1]
+                key = wanted.get(raw) or json.loads(m.group())
+                expect_key = False
+            continue
+        if tok in (0x7B, 0x5B):           # { [
+            if depth == 1 and tok == 0x5B and key in wanted.values():
+                current = spans.setdefault(key, array("q"))
+                elem_start = m.end()
+            depth += 1
+            if depth == 1:
+                expect_key = True
+            continue
+        if tok == 0x3A:                   # :
+            if depth == 1:
+                value_start = m.end()
+            continue
+        if tok in (0x7D, 0x5D):           # } ]
+            if depth == 2 and current is not None and tok == 0x5D:
+                s, e = _trim(buf, elem_start, m.start())
+                if e > s:
+                    current.extend((s, e))
+                current = None
+            if depth == 1 and key is not None:
+                members[key] = _trim(buf, value_start, m.start())
+                key = None
+            depth -= 1
+            continue
+        # ,
+        if depth == 2 and current is not None:
+            s, e = _trim(buf, elem_start, m.start())
+            current.extend((s, e))
+            elem_start = m.end()
+        elif depth == 1:
+            if key is not None:
+                members[key] = _trim(buf, value_start, m.start())
+            key = None
+            expect_key = True
+    return members, spans
+
+def iter_raw_elements(path: PathLike, section: str) -> Iterator[bytes]:
+    """
+    Raw JSON bytes of each element of one top-level array, streamed from a memory map.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        _, spans = scan(mm, (section,))
+        flat = spans.get(section, array("q"))
+        for i in range(0, len(flat), 2):
+            yield mm[flat[i]:flat[i + 1]]
+
+
+# ---------------------------------------------------------------------------
+# index
+# ---------------------------------------------------------------------------
+
+def index_dir(path: PathLike) -> Path:
+    p = Path(path)
+    return p.with_name(p.name + ".index")
+
+def _source_stamp(path: Path) -> Dict[str, int]:
+    st = path.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def build_index(path: PathLike, out_dir: Optional[PathLike] = None) -> Path:
+    """
+    Scan `path` once and write its index directory; returns that directory.
+    """
+    path = Path(path)
+    out = Path(out_dir) if out_dir else index_dir(path)
+    tmp = out.with_name(out.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    keys: List[bytes] = []
+    key_section = array("b")
+    key_index = array("q")
+    counts: Dict[str, int] = {}
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        members, spans = scan(mm)
+        for si, section in enumerate(SECTIONS):
+            flat = spans.get(section, array("q"))
+            n = len(flat) // 2
+            counts[section] = n
+            offsets = np.frombuffer(flat, dtype=np.int64).reshape(n, 2) if n else np.zeros((0, 2), np.int64)
+            np.save(tmp / f"{section}.offsets.npy", offsets)
+            position = np.full((n, 3), np.nan) if section == "points" else None
+            for i in range(n):
+                el = json.loads(mm[flat[2 * i]:flat[2 * i + 1]])
+                if not isinstance(el, dict):
+                    continue
+                meta = el.get("meta")
+                u = meta.get("uuid") if isinstance(meta, dict) else None
+                if isinstance(u, str):
+                    keys.append(u.encode("utf-8"))
+                    key_section.append(si)
+                    key_index.append(i)
+                if position is not None:
+                    app = el.get("appearance")
+                    pos = app.get("position") if isinstance(app, dict) else None
+                    if isinstance(pos, list) and len(pos) == 3 and all(
+                            isinstance(c, (int, float)) and not isinstance(c, bool) for c in pos):
+                        position[i] = pos
+            if position is not None:
+                np.save(tmp / "points.position.npy", position)
+
+    key_arr = np.array(keys, dtype=f"S{max((len(k) for k in keys), default=1)}")
+    order = np.argsort(key_arr, kind="stable")
+    np.save(tmp / "uuid.keys.npy", key_arr[order])
+    np.save(tmp / "uuid.section.npy", np.frombuffer(key_section, dtype=np.int8)[order])
+    np.save(tmp / "uuid.index.npy", np.frombuffer(key_index, dtype=np.int64)[order])
+
+    meta = {"format": INDEX_FORMAT, "source": _source_stamp(path), "counts": counts,
+            "members": {k: list(v) for k, v in members.items()}}
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+    return out
+
+def _index_current(path: Path, idx: Path) -> bool:
+    try:
+        meta = json.loads((idx / "meta.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    return meta.get("format") == INDEX_FORMAT and meta.get("source") == _source_stamp(path)
+
+
+# ---------------------------------------------------------------------------
+# store
+# ---------------------------------------------------------------------------
+
+class LazyElements(Sequence):
+    """
+    points / lines / aux of a store: len() and indexing parse only what is accessed.
+    """
+
+    def __init__(self, buf, offsets: np.ndarray):
+        self._buf = buf
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def raw(self, i: int) -> bytes:
+        s, e = self._offsets[i]
+        return self._buf[int(s):int(e)]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return json.loads(self.raw(i))
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(len(self)):
+            yield json.loads(self.raw(i))
+
+
+class DocumentStore:
+    def __init__(self, path: PathLike, rebuild: bool = False):
+        self.path = Path(path)
+        idx = index_dir(self.path)
+        if rebuild or not _index_current(self.path, idx):
+            build_index(self.path, idx)
+        self._meta = json.loads((idx / "meta.json").read_text(encoding="utf-8"))
+        self._f = open(self.path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if self._meta["source"]["size"] else b""
+        load = lambda name: np.load(idx / name, mmap_mode="r")
+        self.sections = {s: LazyElements(self._mm, load(f"{s}.offsets.npy")) for s in SECTIONS}
+        self.positions = load("points.position.npy")
+        self._keys = load("uuid.keys.npy")
+        self._key_section = load("uuid.section.npy")
+        self._key_index = load("uuid.index.npy")
+
+    def __enter__(self) -> "DocumentStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.sections = {}
+        self.positions = self._keys = self._key_section = self._key_index = None
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._f.close()
+
+    @property
+    def points(self) -> LazyElements:
+        return self.sections["points"]
+
+    @property
+    def lines(self) -> LazyElements:
+        return self.sections["lines"]
+
+    @property
+    def aux(self) -> LazyElements:
+        return self.sections["aux"]
+
+    def member(self, name: str) -> Any:
+        """
+        Any top-level member (e.g. "document_meta"), parsed on request; None if absent.
+        """
+        span = self._meta["members"].get(name)
+        if span is None:
+            return None
+        return json.loads(self._mm[span[0]:span[1]])
+
+    @property
+    def member_names(self) -> List[str]:
+        """
+        Top-level member names in document order.
+        """
+        return list(self._meta["members"])
+
+    @property
+    def document_meta(self) -> Any:
+        return self.member("document_meta")
+
+    def find(self, uuid_str: str) -> Optional[Tuple[str, int]]:
+        """
+        (section, index) of the first element whose meta.uuid is uuid_str.
+        """
+        key = uuid_str.encode("utf-8")
+        if self._keys is None or len(self._keys) == 0 or len(key) > self._keys.dtype.itemsize:
+            return None
+        i = int(np.searchsorted(self._keys, key))
+        if i >= len(self._keys) or self._keys[i] != key:
+            return None
+        return SECTIONS[int(self._key_section[i])], int(self._key_index[i])
+
+    def uuids(self, section: str) -> List[Optional[str]]:
+        """
+        meta.uuid of every element of `section` (None where absent), from the index only.
+        """
+        out: List[Optional[str]] = [None] * len(self.sections[section])
+        mask = self._key_section == SECTIONS.index(section)
+        for key, i in zip(self._keys[mask].tolist(), self._key_index[mask].tolist()):
+            out[i] = key.decode("utf-8")
+        return out
+
+    def get(self, uuid_str: str) -> Optional[Tuple[str, int, Any]]:
+        hit = self.find(uuid_str)
+        if hit is None:
+            return None
+        section, i = hit
+        return section, i, self.sections[section][i]
+
+    def points_in_bbox(self, lo: Sequence[float], hi: Sequence[float]) -> np.ndarray:
+        """
+        Indices of points whose position lies in the closed box [lo, hi].
+        """
+        inside = np.ones(len(self.positions), dtype=bool)
+        # one axis at a time keeps temporaries at N booleans
+        for axis in range(3):
+            col = self.positions[:, axis]
+            inside &= (col >= lo[axis]) & (col <= hi[axis])
+        return np.nonzero(inside)[0]
+
+def open_store(path: PathLike, rebuild: bool = False) -> DocumentStore:
+    return DocumentStore(path, rebuild=rebuild)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="command", required=True)
+    p_idx = sub.add_parser("index", help="(Re)build the index of a document")
+    p_idx.add_argument("doc")
+    p_get = sub.add_parser("get", help="Print the element with this meta.uuid")
+    p_get.add_argument("doc")
+    p_get.add_argument("uuid")
+    p_box = sub.add_parser("bbox", help="Print the uuids of points inside a box")
+    p_box.add_argument("doc")
+    p_box.add_argument("coords", nargs=6, type=float, metavar="C")
+    args = ap.parse_args()
+
+    if args.command == "index":
+        out = build_index(args.doc)
+        meta = json.loads((out / "meta.json").read_text(encoding="utf-8"))
+        print(f"[index] {out} ({' '.join(f'{k}={v}' for k, v in meta['counts'].items())})")
+        return 0
+
+    with open_store(args.doc) as st:
+        if args.command == "get":
+            hit = st.get(args.uuid)
+            if hit is None:
+                print(f"[get] {args.uuid}: not found")
+                return 1
+            section, i, el = hit
+            print(f"[get] {section}[{i}]")
+            print(json.dumps(el, ensure_ascii=False, indent=2))
+        else:
+            idx = st.points_in_bbox(args.coords[:3], args.coords[3:])
+            for i in idx:
+                el = st.points[int(i)]
+                meta = el.get("meta") if isinstance(el, dict) else None
+                print(meta.get("uuid") if isinstance(meta, dict) else f"points[{i}]")
+            print(f"[bbox] {len(idx)} point(s)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# dss_tessellate.py
+# Precompute sample points for every curved line (line_type catmullrom / bezier / arc) of a
+# 3DSS document, with the same curve definitions as the viewer (renderer/context.js):
+#   bezier      quadratic end_a, c0, end_b or cubic end_a, c0, c1, end_b
+#   catmullrom  uniform Catmull-Rom (tension, default 0.5) through end_a, points..., end_b,
+#               end tangents from mirrored neighbours (THREE.CatmullRomCurve3 "catmullrom")
+#   arc         center + radius * (cos, sin, 0) from arc_angle_start over the signed sweep
+# geometry.dimension == 2 flattens z to 0. Lines whose endpoints do not resolve are skipped.
+#
+# Every curve is reduced to cubic Bezier spans (quadratics are degree-elevated, each
+# Catmull-Rom span becomes one cubic) or an arc, and each kind is evaluated for all lines
+# at once in NumPy. The segment count follows the curvature: per span, Wang's bound
+# n = ceil(sqrt(3/4 * max|P[i] - 2 P[i+1] + P[i+2]| / tol)); per arc, the count that keeps
+# the chord sagitta under tol. tol is --tolerance in world units, or by default
+# --rel-tolerance times the diagonal of the curve's own control points.
+#
+# Results are kept in a sidecar <doc>.tess.npz keyed by a sha256 of each curve's inputs
+# (line type, geometry, resolved endpoints) and the sampling parameters; reopening a
+# document only tessellates curves whose key is not in the sidecar, and the sidecar is
+# rewritten to hold exactly the current document's curves.
+#
+#   keys     S64[K]       geometry key of each entry
+#   offsets  int64[K+1]   samples of entry k are samples[offsets[k]:offsets[k+1]]
+#   samples  float64[M,3]
+#
+# Usage:
+#   python dss_tessellate.py doc.3dss.json [--tolerance T | --rel-tolerance R] [--max-segments N]
+#   python dss_tessellate.py doc.3dss.json --line UUID      # print one line's samples
+#
+# Usage (from a sibling script):
+#   from dss_tessellate import tessellate_document
+#   tess = tessellate_document(doc, sidecar="scene.3dss.json.tess.npz")
+#   xyz = tess.samples_of(line_index)       # float64[k,3] or None for straight / polyline
+#
+import os
+import json
+import math
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+TESS_FORMAT = 1
+CURVED = ("catmullrom", "bezier", "arc")
+DEFAULT_REL_TOLERANCE = 1e-3
+DEFAULT_TENSION = 0.5
+# segments per Bezier span / per arc
+MAX_SEGMENTS = 256
+# viewer's _near3 epsilon for collapsing repeated anchors
+NEAR_EPS = 1e-6
+
+PathLike = Union[str, Path]
+Vec3 = List[float]
+
+
+def tess_path(doc: PathLike) -> Path:
+    p = Path(doc)
+    return p.with_name(p.name + ".tess.npz")
+
+
+# ---------------------------------------------------------------------------
+# curve definitions
+# ---------------------------------------------------------------------------
+
+def _vec3(v: Any) -> Optional[Vec3]:
+    if isinstance(v, list) and len(v) >= 3 and all(
+            isinstance(c, (int, float)) and not isinstance(c, bool) for c in v[:3]):
+        return [float(c) for c in v[:3]]
+    return None
+
+def _vec3_list(raw: Any, dim: int) -> List[Vec3]:
+    out = []
+    for v in raw if isinstance(raw, list) else []:
+        p = _vec3(v)
+        if p is not None:
+            if dim == 2:
+                p[2] = 0.0
+            out.append(p)
+    return out
+
+def _near(a: Vec3, b: Vec3) -> bool:
+    return sum((x - y) ** 2 for x, y in zip(a, b)) <= NEAR_EPS * NEAR_EPS
+
+def _ensure_endpoints(points: List[Vec3], a: Vec3, b: Vec3) -> List[Vec3]:
+    if not points:
+        return [a, b]
+    out = list(points)
+    if not _near(out[0], a):
+        out.insert(0, a)
+    if not _near(out[-1], b):
+        out.append(b)
+    compact = [out[0]]
+    for p in out[1:]:
+        if not _near(p, compact[-1]):
+            compact.append(p)
+    return compact if len(compact) >= 2 else [a, b]
+
+def point_positions(doc: Dict[str, Any]) -> Dict[str, Vec3]:
+    out: Dict[str, Vec3] = {}
+    for el in doc.get("points") or []:
+        if not isinstance(el, dict):
+            continue
+        meta, app = el.get("meta"), el.get("appearance")
+        u = meta.get("uuid") if isinstance(meta, dict) else None
+        pos = _vec3(app.get("position")) if isinstance(app, dict) else None
+        if isinstance(u, str) and pos is not None:
+            out.setdefault(u, pos)
+    return out
+
+def _endpoint(end: Any, positions: Dict[str, Vec3]) -> Optional[Vec3]:
+    if not isinstance(end, dict):
+        return None
+    if isinstance(end.get("ref"), str):
+        p = positions.get(end["ref"])
+        return list(p) if p is not None else None
+    return _vec3(end.get("coord"))
+
+def curve_inputs(line: Any, positions: Dict[str, Vec3]) -> Optional[Tuple[str, Dict[str, Any], Vec3, Vec3]]:
+    """
+    (line_type, geometry, end_a, end_b) of a curved line with resolved endpoints, or None.
+    """
+    app = line.get("appearance") if isinstance(line, dict) else None
+    if not isinstance(app, dict) or app.get("line_type") not in CURVED:
+        return None
+    g = app.get("geometry") if isinstance(app.get("geometry"), dict) else {}
+    a, b = _endpoint(app.get("end_a"), positions), _endpoint(app.get("end_b"), positions)
+    if a is None or b is None:
+        return None
+    return app["line_type"], g, a, b
+
+def curve_spec(kind: str, g: Dict[str, Any], a: Vec3, b: Vec3) -> Optional[Dict[str, Any]]:
+    """
+    The resolved definition of a curve ({"type": "cubic", "spans": [[P0..P3], ...]} or
+    {"type": "arc", ...}), or None when the geometry does not describe one (the viewer
+    then draws a straight segment).
+    """
+    dim = 2 if g.get("dimension") == 2 else 3
+    a, b = list(a), list(b)
+    if dim == 2:
+        a[2] = b[2] = 0.0
+
+    if kind == "arc":
+        center = _vec3(g.get("arc_center"))
+        r, a0, a1 = (g.get(k) for k in ("arc_radius", "arc_angle_start", "arc_angle_end"))
+        nums = [x for x in (r, a0, a1) if isinstance(x, (int, float)) and not isinstance(x, bool)]
+        if center is None or len(nums) != 3 or not all(map(math.isfinite, nums)) or not r > 0:
+            return None
+        if dim == 2:
+            center[2] = 0.0
+        sweep = float(a1) - float(a0)
+        if g.get("arc_clockwise") is True:
+            if sweep > 0:
+                sweep -= 2 * math.pi
+        elif sweep < 0:
+            sweep += 2 * math.pi
+        return {"type": "arc", "center": center, "radius": float(r), "start": float(a0), "sweep": sweep}
+
+    if kind == "bezier":
+        cs = _vec3_list(g.get("bezier_controls"), dim)
+        if not cs:
+            return None
+        if len(cs) >= 2:
+            span = [a, cs[0], cs[1], b]
+        else:
+            # degree elevation: the same quadratic as a cubic
+            q = cs[0]
+            span = [a, [a[k] + 2.0 / 3.0 * (q[k] - a[k]) for k in range(3)],
+                    [b[k] + 2.0 / 3.0 * (q[k] - b[k]) for k in range(3)], b]
+        return {"type": "cubic", "spans": [span]}
+
+    pts = _ensure_endpoints(_vec3_list(g.get("catmullrom_points"), dim), a, b)
+    tension = g.get("catmullrom_tension")
+    if not (isinstance(tension, (int, float)) and not isinstance(tension, bool) and 0 <= tension <= 1):
+        tension = DEFAULT_TENSION
+    spans = []
+    n = len(pts)
+    for i in range(n - 1):
+        p1, p2 = pts[i], pts[i + 1]
+        p0 = pts[i - 1] if i > 0 else [2 * p1[k] - p2[k] for k in range(3)]
+        p3 = pts[i + 2] if i + 2 < n else [2 * p2[k] - p1[k] for k in range(3)]
+        # Hermite tangents tension * (p2 - p0), tension * (p3 - p1) as Bezier controls
+        spans.append([p1, [p1[k] + tension * (p2[k] - p0[k]) / 3.0 for k in range(3)],
+                      [p2[k] - tension * (p3[k] - p1[k]) / 3.0 for k in range(3)], p2])
+    return {"type": "cubic", "spans": spans}
+
+def _control_extent(spec: Dict[str, Any]) -> float:
+    if spec["type"] == "arc":
+        return 2.0 * spec["radius"]
+    pts = [p for span in spec["spans"] for p in span]
+    return math.sqrt(sum((max(p[k] for p in pts) - min(p[k] for p in pts)) ** 2 for k in range(3)))
+
+def curve_tolerance(spec: Dict[str, Any], tolerance: Optional[float], rel_tolerance: float) -> float:
+    if tolerance is not None:
+        return float(tolerance)
+    extent = _control_extent(spec)
+    return rel_tolerance * extent if extent > 0 else 1.0
+
+def geometry_key(kind: str, g: Dict[str, Any], a: Vec3, b: Vec3, params: Sequence[Any]) -> bytes:
+    """
+    sha256 of the curve inputs (line type, geometry, resolved endpoints) and the sampling
+    parameters; the samples are a pure function of these.
+    """
+    blob = json.dumps([TESS_FORMAT, kind, g, a, b, list(params)], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest().encode("ascii")
+
+
+# ---------------------------------------------------------------------------
+# batched evaluation
+# ---------------------------------------------------------------------------
+
+def _ragged(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (owner, k): for each of sum(counts) slots, its group and its 0-based rank in the group.
+    """
+    owner = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    return owner, np.arange(int(counts.sum()), dtype=np.int64) - starts[owner]
+
+def _cubic_samples(spans: np.ndarray, tol: np.ndarray, first: np.ndarray,
+                   max_segments: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    spans float64[S,4,3], per-span tol, first[s] True where span s starts a curve.
+    Returns (per-span sample counts, samples); a span emits t = 1/n .. 1, plus t = 0
+    when it starts a curve, so consecutive spans of one curve join without repeats.
+    """
+    dd = spans[:, :2] - 2 * spans[:, 1:3] + spans[:, 2:]
+    m = np.linalg.norm(dd, axis=2).max(axis=1)
+    n = np.ceil(np.sqrt(0.75 * m / np.maximum(tol, 1e-300)))
+    n = np.clip(np.nan_to_num(n, nan=1.0, posinf=max_segments), 1, max_segments).astype(np.int64)
+    counts = n + first
+    owner, k = _ragged(counts)
+    t = (k - first[owner] + 1) / n[owner]
+    u = 1.0 - t
+    c = spans[owner]
+    w = np.stack([u * u * u, 3 * u * u * t, 3 * u * t * t, t * t * t], axis=1)
+    return counts, np.einsum("sk,skd->sd", w, c)
+
+def _arc_samples(center: np.ndarray, radius: np.ndarray, start: np.ndarray, sweep: np.ndarray,
+                 tol: np.ndarray, max_segments: int) -> Tuple[np.ndarray, np.ndarray]:
+    # largest angle step whose chord stays within tol of the circle
+    step = 2 * np.arccos(np.clip(1 - tol / radius, -1.0, 1.0))
+    n = np.ceil(np.abs(sweep) / np.maximum(step, 1e-12))
+    n = np.clip(np.nan_to_num(n, nan=1.0), 1, max_segments).astype(np.int64)
+    owner, k = _ragged(n + 1)
+    th = start[owner] + sweep[owner] * (k / n[owner])
+    out = np.empty((len(owner), 3))
+    out[:, 0] = center[owner, 0] + radius[owner] * np.cos(th)
+    out[:, 1] = center[owner, 1] + radius[owner] * np.sin(th)
+    out[:, 2] = center[owner, 2]
+    return n + 1, out
+
+def tessellate_specs(specs: Sequence[Dict[str, Any]], tols: Sequence[float],
+                     max_segments: int = MAX_SEGMENTS) -> List[np.ndarray]:
+    """
+    Sample every spec; one vectorized batch per curve kind. Returns float64[k,3] per spec.
+    """
+    out: List[Optional[np.ndarray]] = [None] * len(specs)
+    cubic = [i for i, s in enumerate(specs) if s["type"] == "cubic"]
+    arcs = [i for i, s in enumerate(specs) if s["type"] == "arc"]
+
+    if cubic:
+        span_list, span_tol, first = [], [], []
+        for i in cubic:
+            spans = specs[i]["spans"]
+            span_list.extend(spans)
+            span_tol.extend([tols[i]] * len(spans))
+            first.extend([1] + [0] * (len(spans) - 1))
+        counts, samples = _cubic_samples(np.asarray(span_list, dtype=np.float64),
+                                         np.asarray(span_tol, dtype=np.float64),
+                                         np.asarray(first, dtype=np.int64), max_segments)
+        per_curve = np.add.reduceat(counts, np.flatnonzero(first))
+        for i, part in zip(cubic, np.split(samples, np.cumsum(per_curve)[:-1])):
+            out[i] = part
+
+    if arcs:
+        sel = [specs[i] for i in arcs]
+        counts, samples = _arc_samples(
+            np.asarray([s["center"] for s in sel], dtype=np.float64),
+            np.asarray([s["radius"] for s in sel], dtype=np.float64),
+            np.asarray([s["start"] for s in sel], dtype=np.float64),
+            np.asarray([s["sweep"] for s in sel], dtype=np.float64),
+            np.asarray([tols[i] for i in arcs], dtype=np.float64), max_segments)
+        for i, part in zip(arcs, np.split(samples, np.cumsum(counts)[:-1])):
+            out[i] = part
+    return out
+
+
+# ---------------------------------------------------------------------------
+# sidecar
+# ---------------------------------------------------------------------------
+
+class Tessellation:
+    def __init__(self, line_entry: np.ndarray, keys: np.ndarray, offsets: np.ndarray,
+                 samples: np.ndarray, stats: Dict[str, int]):
+        # entry index of each document line, -1 where the line is not tessellated
+        self.line_entry = line_entry
+        self.keys = keys
+        self.offsets = offsets
+        self.samples = samples
+        self.stats = stats
+
+    def samples_of(self, line_index: int) -> Optional[np.ndarray]:
+        k = int(self.line_entry[line_index])
+        if k < 0:
+            return None
+        return self.samples[self.offsets[k]:self.offsets[k + 1]]
+
+def load_sidecar(path: PathLike) -> Dict[bytes, np.ndarray]:
+    """
+    key -> samples of a sidecar; empty if missing, unreadable or of another format.
+    """
+    try:
+        with np.load(path) as z:
+            if int(z["format"]) != TESS_FORMAT:
+                return {}
+            keys, offsets, samples = z["keys"], z["offsets"], z["samples"]
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {bytes(k): samples[offsets[i]:offsets[i + 1]] for i, k in enumerate(keys)}
+
+def _write_sidecar(path: Path, keys: np.ndarray, offsets: np.ndarray, samples: np.ndarray) -> None:
+    tmp = path.with_name(path.name + ".tmp.npz")
+    np.savez(tmp, format=np.array(TESS_FORMAT), keys=keys, offsets=offsets, samples=samples)
+    os.replace(tmp, path)
+
+def tessellate_document(doc: Dict[str, Any], sidecar: Optional[PathLike] = None,
+                        tolerance: Optional[float] = None,
+                        rel_tolerance: float = DEFAULT_REL_TOLERANCE,
+                        max_segments: int = MAX_SEGMENTS) -> Tessellation:
+    """
+    Samples of every curved line of `doc`. With a sidecar path, cached curves are reused
+    and the sidecar is rewritten when the set of curves changed.
+    """
+    lines = doc.get("lines") if isinstance(doc.get("lines"), list) else []
+    positions = point_positions(doc)
+    params = (tolerance, rel_tolerance, max_segments)
+    line_key: List[Optional[bytes]] = []
+    inputs: Dict[bytes, Tuple[str, Dict[str, Any], Vec3, Vec3]] = {}
+    for el in lines:
+        got = curve_inputs(el, positions)
+        key = geometry_key(*got, params) if got is not None else None
+        line_key.append(key)
+        if key is not None:
+            inputs.setdefault(key, got)
+
+    cached = load_sidecar(sidecar) if sidecar else {}
+    specs: Dict[bytes, Dict[str, Any]] = {}
+    for key, got in inputs.items():
+        if key not in cached:
+            spec = curve_spec(*got)
+            if spec is not None:
+                specs[key] = spec
+    missing = list(specs)
+    fresh = tessellate_specs([specs[k] for k in missing],
+                             [curve_tolerance(specs[k], tolerance, rel_tolerance) for k in missing],
+                             max_segments)
+    found = dict(zip(missing, fresh))
+
+    # entries in first-use order
+    entry: Dict[bytes, int] = {}
+    parts: List[np.ndarray] = []
+    line_entry = np.full(len(lines), -1, dtype=np.int64)
+    for i, key in enumerate(line_key):
+        if key is None or (key not in cached and key not in found):
+            continue
+        if key not in entry:
+            entry[key] = len(parts)
+            parts.append(cached[key] if key in cached else found[key])
+        line_entry[i] = entry[key]
+    keys = np.array(list(entry), dtype="S64")
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in parts], out=offsets[1:])
+    samples = np.concatenate(parts) if parts else np.zeros((0, 3))
+
+    stats = {"lines": len(lines), "curved": int((line_entry >= 0).sum()), "entries": len(parts),
+             "cached": len(parts) - len(missing), "tessellated": len(missing), "samples": len(samples)}
+    if sidecar and (missing or len(cached) != len(parts)):
+        _write_sidecar(Path(sidecar), keys, offsets, samples)
+        stats["written"] = 1
+    return Tessellation(line_entry, keys, offsets, samples, stats)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("json", help="Input .3dss.json")
+    tol = ap.add_mutually_exclusive_group()
+    tol.add_argument("--tolerance", type=float, default=None, help="Max chord error in world units")
+    tol.add_argument("--rel-tolerance", type=float, default=DEFAULT_REL_TOLERANCE,
+                     help=f"Max chord error relative to each curve's control extent (default: {DEFAULT_REL_TOLERANCE:g})")
+    ap.add_argument("--max-segments", type=int, default=MAX_SEGMENTS, help="Cap per Bezier span / arc")
+    ap.add_argument("--sidecar", default=None, help="Sample cache path (default: <doc>.tess.npz)")
+    ap.add_argument("--no-cache", action="store_true", help="Tessellate everything and write no sidecar")
+    ap.add_argument("--line", default=None, metavar="UUID", help="Print the samples of this line as JSON")
+    args = ap.parse_args()
+    if args.tolerance is not None and not args.tolerance > 0:
+        ap.error("--tolerance must be > 0")
+    if args.max_segments < 1:
+        ap.error("--max-segments must be >= 1")
+
+    with open(args.json, "r", encoding="utf-8-sig") as f:
+        doc = json.load(f)
+    sidecar = None if args.no_cache else (args.sidecar or tess_path(args.json))
+    tess = tessellate_document(doc, sidecar, args.tolerance, args.rel_tolerance, args.max_segments)
+
+    if args.line:
+        for i, el in enumerate(doc.get("lines") or []):
+            meta = el.get("meta") if isinstance(el, dict) else None
+            if isinstance(meta, dict) and meta.get("uuid") == args.line:
+                pts = tess.samples_of(i)
+                print(json.dumps(pts.tolist() if pts is not None else None))
+                break
+        else:
+            print(f"[tess] {args.line}: no such line")
+            return 1
+    if tess.stats.get("written"):
+        print(f"[write] {sidecar}")
+    print("[tess] " + " ".join(f"{k}={v}" for k, v in tess.stats.items() if k != "written"))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# dss_tile.py
+# Octree tiling of a .3dss.json for streamed loading, and the matching reassembler.
+#
+# split: the points are partitioned by appearance.position into an octree over the
+# bounding cube of the scene. A node is split into its 8 octants while it holds more than
+# --max-elements elements, where each point counts 1 plus the lines anchored on it (the
+# point its end_a ref names, else end_b), up to --max-depth (coincident points stop there).
+# Every leaf becomes one tile. A line goes to the tile whose leaf holds both of its
+# endpoints (ref -> the point's leaf, coord -> the leaf containing it); a line whose
+# endpoints fall in different leaves goes to the boundary tile of their lowest common
+# octree node. The root tile also holds aux, points without a position and lines with an
+# unresolvable endpoint.
+#
+# Tile ids are the octant path from the root ("r", "r3", "r35", ...; octant digit =
+# 4*x + 2*y + z half), so a tile's ancestors are the prefixes of its id. Each tile is
+# written as <id>.3dss.json, a standalone 3DSS document (the source document_meta plus the
+# points / lines / aux it holds); line refs to points of other tiles are listed in the
+# manifest as "refs".
+#
+#   manifest.json   format, source members / counts / per-section digests, octree cube,
+#                   tiles: id, file, kind (leaf / node), cube, bounds (of the positions
+#                   and line endpoints it holds), counts, refs, order
+#
+# "order" holds, per section, the source indices of the tile's elements as [start, length]
+# runs; join puts every element back at its index, so the reassembled document has the
+# source's element set, order and top-level members. The per-section digests (sha256 over
+# the canonical JSON of each element) are re-checked by join.
+#
+# Usage:
+#   python dss_tile.py split scene.3dss.json tiles/ [--max-elements 5000] [--max-depth 16] [--compact]
+#   python dss_tile.py join tiles/manifest.json scene.joined.3dss.json
+#
+# Usage (from a sibling script):
+#   from dss_tile import split_document, join_tiles
+#   manifest = split_document("scene.3dss.json", "tiles", max_elements=5000)
+#   join_tiles("tiles/manifest.json", "scene.joined.3dss.json")
+#
+import os
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from dss_writer import DocumentWriter
+
+TILE_FORMAT = 1
+SECTIONS = ("points", "lines", "aux")
+ENDPOINTS = ("end_a", "end_b")
+MAX_ELEMENTS = 5000
+MAX_DEPTH = 16
+# three axes of node coordinates packed in one int64 key
+DEPTH_LIMIT = 20
+
+PathLike = Union[str, Path]
+
+
+# ---------------------------------------------------------------------------
+# octree
+# ---------------------------------------------------------------------------
+
+def _path(depth: int, cell: Sequence[int]) -> str:
+    x, y, z = (int(c) for c in cell)
+    return "".join(str(((x >> s) & 1) * 4 + ((y >> s) & 1) * 2 + ((z >> s) & 1))
+                   for s in range(depth - 1, -1, -1))
+
+
+class Octree:
+    """
+    Leaves of an octree over the cube [origin, origin + size]. leaf_of[i] is the index into
+    `leaves` (octant path strings) of point i, -1 for points without a position.
+    """
+
+    def __init__(self, origin: np.ndarray, size: float, max_depth: int,
+                 leaves: List[str], leaf_of: np.ndarray):
+        self.origin = origin
+        self.size = size
+        self.max_depth = max_depth
+        self.leaves = leaves
+        self.leaf_of = leaf_of
+        self._leaf_set = set(leaves)
+        self._nodes = {p[:d] for p in leaves for d in range(len(p))}
+
+    @classmethod
+    def build(cls, positions: np.ndarray, weights: np.ndarray, max_elements: int,
+              max_depth: int = MAX_DEPTH) -> "Octree":
+        if not 0 <= max_depth <= DEPTH_LIMIT:
+            raise ValueError(f"max_depth must be in 0..{DEPTH_LIMIT}")
+        valid = ~np.isnan(positions).any(axis=1)
+        pos = positions[valid]
+        if len(pos):
+            origin = pos.min(axis=0)
+            size = float((pos.max(axis=0) - origin).max())
+        else:
+            origin = np.zeros(3)
+            size = 0.0
+        size = size if size > 0 else 1.0
+        q = _grid(pos, origin, size, max_depth)
+        w = weights[valid]
+
+        depth = np.full(len(pos), -1, dtype=np.int64)
+        open_ = np.arange(len(pos))
+        for d in range(max_depth + 1):
+            if not len(open_):
+                break
+            cell = q[open_] >> (max_depth - d)
+            key = (cell[:, 0] << (2 * d)) | (cell[:, 1] << d) | cell[:, 2]
+            _, inv = np.unique(key, return_inverse=True)
+            done = np.bincount(inv, weights=w[open_]) <= max_elements
+            if d == max_depth:
+                done[:] = True
+            depth[open_[done[inv]]] = d
+            open_ = open_[~done[inv]]
+
+        cells = np.column_stack([depth, q >> (max_depth - depth)[:, None]])
+        rows, inv = np.unique(cells, axis=0, return_inverse=True) if len(cells) else (cells, cells[:, 0])
+        leaves = [_path(int(r[0]), r[1:]) for r in rows]
+        leaf_of = np.full(len(positions), -1, dtype=np.int64)
+        leaf_of[valid] = np.asarray(inv).reshape(-1)
+        return cls(origin, size, max_depth, leaves, leaf_of)
+
+    def is_leaf(self, path: str) -> bool:
+        return path in self._leaf_set
+
+    def locate(self, xyz: Sequence[float]) -> str:
+        """
+        Path of the leaf containing xyz, or of the deepest node containing it when it lies
+        in an empty octant; "" (the root) outside the cube.
+        """
+        p = np.asarray(xyz, dtype=np.float64)
+        if not (np.all(p >= self.origin) and np.all(p <= self.origin + self.size)):
+            return ""
+        full = _path(self.max_depth, _grid(p[None, :], self.origin, self.size, self.max_depth)[0])
+        for d in range(len(full) + 1):
+            if full[:d] in self._leaf_set:
+                return full[:d]
+            if full[:d] not in self._nodes:
+                # no points at all: not even the root is a node
+                return full[:max(d - 1, 0)]
+        return full
+
+    def cube(self, path: str) -> Tuple[List[float], List[float]]:
+        lo = self.origin.copy()
+        half = self.size
+        for digit in path:
+            half /= 2
+            o = int(digit)
+            lo += half * np.array([(o >> 2) & 1, (o >> 1) & 1, o & 1])
+        return lo.tolist(), (lo + half).tolist()
+
+def _grid(pos: np.ndarray, origin: np.ndarray, size: float, max_depth: int) -> np.ndarray:
+    n = 1 << max_depth
+    return np.clip(np.floor((pos - origin) / size * n), 0, n - 1).astype(np.int64)
+
+
+# ---------------------------------------------------------------------------
+# split
+# ---------------------------------------------------------------------------
+
+def _vec3(v: Any) -> Optional[List[float]]:
+    if isinstance(v, list) and len(v) == 3 and all(
+            isinstance(c, (int, float)) and not isinstance(c, bool) for c in v):
+        return v
+    return None
+
+def _endpoints(el: Any) -> List[Tuple[str, Any]]:
+    """
+    [("ref", uuid) | ("coord", xyz) | ("none", None)] for end_a, end_b.
+    """
+    app = el.get("appearance") if isinstance(el, dict) else None
+    out = []
+    for name in ENDPOINTS:
+        end = app.get(name) if isinstance(app, dict) else None
+        end = end if isinstance(end, dict) else {}
+        if isinstance(end.get("ref"), str):
+            out.append(("ref", end["ref"]))
+        elif _vec3(end.get("coord")) is not None:
+            out.append(("coord", end["coord"]))
+        else:
+            out.append(("none", None))
+    return out
+
+def _canonical_hash(el: Any) -> bytes:
+    return hashlib.sha256(json.dumps(el, sort_keys=True, separators=(",", ":"),
+                                     ensure_ascii=False).encode("utf-8")).digest()
+
+def _runs(idx: np.ndarray) -> List[int]:
+    if not len(idx):
+        return []
+    brk = np.flatnonzero(np.diff(idx) != 1) + 1
+    starts = np.concatenate([[0], brk])
+    lengths = np.diff(np.concatenate([starts, [len(idx)]]))
+    return np.column_stack([idx[starts], lengths]).reshape(-1).tolist()
+
+def _unruns(runs: Sequence[int]) -> np.ndarray:
+    if not runs:
+        return np.zeros(0, dtype=np.int64)
+    r = np.asarray(runs, dtype=np.int64).reshape(-1, 2)
+    return np.concatenate([np.arange(s, s + n) for s, n in r])
+
+def _bounds(xyz: List[Any]) -> Optional[List[List[float]]]:
+    if not xyz:
+        return None
+    a = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    return [a.min(axis=0).tolist(), a.max(axis=0).tolist()]
+
+def split_document(doc: PathLike, out_dir: PathLike, max_elements: int = MAX_ELEMENTS,
+                   max_depth: int = MAX_DEPTH, pretty: bool = True) -> Dict[str, Any]:
+    """
+    Write the tiles and manifest.json of `doc` into out_dir; returns the manifest.
+    """
+    from dss_store import open_store
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    with open_store(doc) as st:
+        positions = np.asarray(st.positions)
+        n_points = len(positions)
+        valid = ~np.isnan(positions).any(axis=1)
+
+        # endpoints of every line: point index (-1 coord / unresolved) or coord
+        ends: List[List[Tuple[int, Optional[List[float]]]]] = []
+        anchor = np.full(len(st.lines), -1, dtype=np.int64)
+        for i, el in enumerate(st.lines):
+            row = []
+            for kind, v in _endpoints(el):
+                if kind == "ref":
+                    hit = st.find(v)
+                    row.append((hit[1], None) if hit is not None and hit[0] == "points" else (-1, None))
+                else:
+                    row.append((-1, v))
+            ends.append(row)
+            for p, _ in row:
+                if p >= 0 and valid[p]:
+                    anchor[i] = p
+                    break
+        weights = 1.0 + np.bincount(anchor[anchor >= 0], minlength=n_points)
+        tree = Octree.build(positions, weights, max_elements, max_depth)
+        leaf_path = np.array(tree.leaves + [""], dtype=object)[tree.leaf_of]
+
+        # tile path of every element; None = root (unplaceable)
+        members: Dict[str, Dict[str, List[int]]] = {}
+        refs: Dict[str, Set[str]] = {}
+        extent: Dict[str, List[Any]] = {}
+        for i in range(n_points):
+            t = leaf_path[i] if valid[i] else ""
+            members.setdefault(t, {}).setdefault("points", []).append(i)
+            if valid[i]:
+                extent.setdefault(t, []).append(positions[i])
+        for i, row in enumerate(ends):
+            paths: List[Optional[str]] = []
+            xyz = []
+            for p, coord in row:
+                if p >= 0:
+                    paths.append(leaf_path[p] if valid[p] else "")
+                    if valid[p]:
+                        xyz.append(positions[p])
+                elif coord is not None:
+                    paths.append(tree.locate(coord))
+                    xyz.append(coord)
+                else:
+                    paths.append(None)
+            t = "" if None in paths else os.path.commonprefix(paths)
+            members.setdefault(t, {}).setdefault("lines", []).append(i)
+            extent.setdefault(t, []).extend(xyz)
+            for (p, _), pt in zip(row, paths):
+                if p >= 0 and pt != t:
+                    refs.setdefault(t, set()).add(pt)
+        members.setdefault("", {})["aux"] = list(range(len(st.aux)))
+
+        names = st.member_names
+        sections = [s for s in SECTIONS if s in names]
+        meta = st.document_meta
+        hashes = {s: [b""] * len(st.sections[s]) for s in sections}
+        tiles = []
+        for path in sorted(members, key=lambda p: (len(p), p)):
+            tid = "r" + path
+            file = f"{tid}.3dss.json"
+            order: Dict[str, List[int]] = {}
+            counts: Dict[str, int] = {}
+            with DocumentWriter(out / file, pretty=pretty, chunk_size=1000) as w:
+                w.write_member("document_meta", meta)
+                for s in sections:
+                    idx = np.asarray(members[path].get(s, []), dtype=np.int64)
+                    items = st.sections[s]
+
+                    def elements(idx=idx, items=items, h=hashes[s]):
+                        for i in idx:
+                            el = items[int(i)]
+                            h[i] = _canonical_hash(el)
+                            yield el
+                    counts[s] = w.write_array(s, elements())
+                    order[s] = _runs(idx)
+            lo, hi = tree.cube(path)
+            tiles.append({"id": tid, "file": file,
+                          "kind": "leaf" if tree.is_leaf(path) else "node",
+                          "cube": [lo, hi], "bounds": _bounds(extent.get(path, [])),
+                          "counts": counts, "refs": sorted("r" + r for r in refs.get(path, ())),
+                          "order": order})
+
+        manifest = {
+            "format": TILE_FORMAT,
+            "source": Path(doc).name,
+            "max_elements": max_elements,
+            "max_depth": max_depth,
+            "cube": {"origin": tree.origin.tolist(), "size": tree.size},
+            "members": names,
+            "document": {k: st.member(k) for k in names if k not in SECTIONS},
+            "counts": {s: len(st.sections[s]) for s in sections},
+            "digest": {s: hashlib.sha256(b"".join(hashes[s])).hexdigest() for s in sections},
+            "tiles": tiles,
+        }
+    tmp = out / "manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, out / "manifest.json")
+    return manifest
+
+
+# ---------------------------------------------------------------------------
+# join
+# ---------------------------------------------------------------------------
+
+def join_tiles(manifest_path: PathLike, out: PathLike, pretty: bool = True) -> Dict[str, int]:
+    """
+    Reassemble the source document from a manifest and its tiles; returns element counts.
+    Raises ValueError if a tile is inconsistent with the manifest or a digest differs.
+    """
+    manifest_path = Path(manifest_path)
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    if manifest.get("format") != TILE_FORMAT:
+        raise ValueError(f"unsupported tile manifest format {manifest.get('format')!r}")
+    counts = manifest["counts"]
+    sections: Dict[str, List[Any]] = {s: [None] * n for s, n in counts.items()}
+    filled = {s: np.zeros(n, dtype=bool) for s, n in counts.items()}
+    for tile in manifest["tiles"]:
+        with open(manifest_path.parent / tile["file"], "r", encoding="utf-8") as f:
+            frag = json.load(f)
+        for s, runs in tile["order"].items():
+            idx = _unruns(runs)
+            items = frag.get(s, [])
+            if len(items) != len(idx):
+                raise ValueError(f"{tile['file']}: {len(items)} {s}, manifest lists {len(idx)}")
+            if filled[s][idx].any():
+                raise ValueError(f"{tile['file']}: {s} placed twice")
+            filled[s][idx] = True
+            for i, el in zip(idx, items):
+                sections[s][int(i)] = el
+    for s, n in counts.items():
+        if not filled[s].all():
+            raise ValueError(f"{s}: {int((~filled[s]).sum())} of {n} element(s) in no tile")
+        digest = hashlib.sha256(b"".join(_canonical_hash(el) for el in sections[s])).hexdigest()
+        if digest != manifest["digest"][s]:
+            raise ValueError(f"{s}: digest mismatch after reassembly")
+
+    with DocumentWriter(out, pretty=pretty, chunk_size=1000) as w:
+        for name in manifest["members"]:
+            if name in sections:
+                w.write_array(name, sections[name])
+            else:
+                w.write_member(name, manifest["document"][name])
+    return {s: len(v) for s, v in sections.items()}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="command", required=True)
+    p_split = sub.add_parser("split", help="Write octree tiles + manifest.json")
+    p_split.add_argument("json", help="Input .3dss.json")
+    p_split.add_argument("out_dir", help="Output directory")
+    p_split.add_argument("--max-elements", type=int, default=MAX_ELEMENTS,
+                         help="Split a node while it holds more (points + their anchored lines)")
+    p_split.add_argument("--max-depth", type=int, default=MAX_DEPTH, help=f"Octree depth limit (<= {DEPTH_LIMIT})")
+    p_split.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    p_join = sub.add_parser("join", help="Reassemble a document from manifest.json")
+    p_join.add_argument("manifest", help="manifest.json written by split")
+    p_join.add_argument("out", help="Output .3dss.json")
+    p_join.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    args = ap.parse_args()
+
+    if args.command == "split":
+        if args.max_elements < 1:
+            ap.error("--max-elements must be >= 1")
+        if not 0 <= args.max_depth <= DEPTH_LIMIT:
+            ap.error(f"--max-depth must be in 0..{DEPTH_LIMIT}")
+        m = split_document(args.json, args.out_dir, args.max_elements, args.max_depth, pretty=not args.compact)
+        leaves = sum(t["kind"] == "leaf" for t in m["tiles"])
+        largest = max(sum(t["counts"].values()) for t in m["tiles"])
+        print(f"[tile] {args.out_dir}: {len(m['tiles'])} tile(s) ({leaves} leaf, "
+              f"{len(m['tiles']) - leaves} boundary), largest={largest} "
+              + " ".join(f"{s}={n}" for s, n in m["counts"].items()))
+        return 0
+
+    try:
+        counts = join_tiles(args.manifest, args.out, pretty=not args.compact)
+    except ValueError as e:
+        raise SystemExit(f"[tile] FAILED: {e}")
+    print(f"[write] {args.out} (" + " ".join(f"{s}={n}" for s, n in counts.items()) + ")")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
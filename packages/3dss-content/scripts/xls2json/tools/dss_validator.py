@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# dss_validator.py
+# Validator factory shared by the xls2json tools (validate_3dss_json.py and the converters).
+#
+# 3DSS.schema.json is compiled once per schema content: every local "$ref" is resolved
+# and inlined so validation follows direct dict lookups instead of going through the
+# reference resolver on each $ref, and the schema is meta-checked only on that first
+# compile. The compiled form is pickled to an on-disk cache keyed by the schema's
+# sha256, and memoized per process.
+#
+# incremental_errors() validates document_meta and every point / line / aux entry on its
+# own against its $defs sub-schema, and the document skeleton (arrays emptied) against
+# the top-level rules. Per-element results are cached on disk by the sha256 of the
+# element's canonical JSON, so revalidating an edited document only runs the schema on
+# elements whose content changed. Its errors are exactly those of sorted_errors().
+#
+# StreamValidator does the same checks on elements as they are streamed to the output file
+# (watch() around each element array, finish() with document_meta), so a converter can
+# validate what it writes without reading the document back.
+#
+# partitioned_errors() validates the same parts with the element arrays split into chunks
+# on a process pool, and can stop as soon as the first N errors (in sorted order) are known.
+#
+# Cache directory: $DSS_CACHE_DIR, else ~/.cache/3dss
+#
+# Usage (from a sibling script):
+#   from dss_validator import load_validator, sorted_errors
+#   v = load_validator("3DSS.schema.json")
+#   errors = sorted_errors(v, doc)
+#
+#   from dss_validator import incremental_errors
+#   errors, stats = incremental_errors(doc, "3DSS.schema.json")   # [(path, message)]
+#
+#   from dss_validator import StreamValidator
+#   sv = StreamValidator("3DSS.schema.json")
+#   write_document(out, meta, {"points": sv.watch("points", points), ...})
+#   errors = sv.finish(meta)                                        # [(path, message)]
+#
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+from multiprocessing import Pool
+from pathlib import Path
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from jsonschema import Draft202012Validator
+from jsonschema.exceptions import ValidationError
+
+# bump when the compiled form changes
+COMPILED_FORMAT = 1
+
+DEFAULT_SCHEMA = Path(__file__).resolve().parent.parent / "3DSS.schema.json"
+
+# top-level arrays validated element by element, and the $defs entry for their items
+ELEMENT_SECTIONS = {"points": "point", "lines": "line", "aux": "aux"}
+# element cache is rewritten from scratch (dropping entries not used by this run) past this size
+ELEMENT_CACHE_MAX = 1_000_000
+
+# keywords that never take part in validation; a $ref whose siblings are only these
+# can be replaced by its target outright
+ANNOTATIONS = {"default", "description", "title", "examples", "$comment", "deprecated", "readOnly", "writeOnly"}
+# keywords whose values are data, not subschemas
+DATA_KEYWORDS = {"const", "enum", "default", "examples"}
+
+
+def default_cache_dir() -> Path:
+    env = os.environ.get("DSS_CACHE_DIR")
+    if env:
+        return Path(env)
+    return Path.home() / ".cache" / "3dss"
+
+def schema_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def _pointer(schema: Dict[str, Any], ref: str) -> Any:
+    cur: Any = schema
+    for part in ref[1:].split("/"):
+        if not part:
+            continue
+        cur = cur[part.replace("~1", "/").replace("~0", "~")]
+    return cur
+
+def inline_refs(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return a copy of `schema` with every local "#/..." $ref replaced by its (inlined)
+    target. Targets are shared, not copied, so the result stays the size of the source.
+    A $ref with validating siblings becomes {"allOf": [target], ...siblings}; a $ref on
+    a reference cycle is left in place (the validator still resolves it from $defs).
+    """
+    done: Dict[str, Any] = {}
+    active: Set[str] = set()
+
+    def resolve(ref: str) -> Optional[Any]:
+        if ref in done:
+            return done[ref]
+        if ref in active:
+            return None
+        active.add(ref)
+        target = walk(_pointer(schema, ref))
+        active.discard(ref)
+        done[ref] = target
+        return target
+
+    def walk(node: Any) -> Any:
+        if isinstance(node, list):
+            return [walk(v) for v in node]
+        if not isinstance(node, dict):
+            return node
+        out = {k: (v if k in DATA_KEYWORDS else walk(v)) for k, v in node.items() if k != "$ref"}
+        ref = node.get("$ref")
+        if ref is None:
+            return out
+        target = resolve(ref) if isinstance(ref, str) and ref.startswith("#") else None
+        if target is None:
+            out["$ref"] = ref
+            return out
+        if set(out) <= ANNOTATIONS:
+            return target
+        out["allOf"] = [target] + list(out.get("allOf", []))
+        return out
+
+    return walk(schema)
+
+def _cache_path(cache_dir: Path, sha: str) -> Path:
+    return cache_dir / "validator" / f"3DSS.v{COMPILED_FORMAT}.{sha}.pickle"
+
+def _store(path: Path, compiled: Dict[str, Any]) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        # a read-only cache only costs a recompile next time
+        pass
+
+@lru_cache(maxsize=8)
+def _compiled_validator(sha: str, data: bytes, cache_dir: str) -> Draft202012Validator:
+    path = _cache_path(Path(cache_dir), sha)
+    compiled = None
+    if path.exists():
+        try:
+            with path.open("rb") as f:
+                compiled = pickle.load(f)
+        except Exception:
+            compiled = None
+    if compiled is None:
+        schema = json.loads(data.decode("utf-8-sig"))
+        Draft202012Validator.check_schema(schema)
+        compiled = inline_refs(schema)
+        _store(path, compiled)
+    return Draft202012Validator(compiled)
+
+def load_validator(schema_path: Union[str, Path, None] = None,
+                   cache_dir: Union[str, Path, None] = None) -> Draft202012Validator:
+    """
+    Compiled Draft 2020-12 validator for the schema file (default: xls2json/3DSS.schema.json).
+    """
+    data = Path(schema_path or DEFAULT_SCHEMA).read_bytes()
+    cdir = Path(cache_dir) if cache_dir else default_cache_dir()
+    return _compiled_validator(schema_hash(data), data, str(cdir))
+
+def error_pointer(e: ValidationError) -> str:
+    return "/" + "/".join(str(p) for p in e.absolute_path)
+
+def sorted_errors(validator: Draft202012Validator, doc: Any) -> List[ValidationError]:
+    """
+    All errors, in the order validate_3dss_json.py reports them.
+    """
+    return sorted(validator.iter_errors(doc), key=lambda e: (list(e.path), e.message))
+
+
+# ---------------------------------------------------------------------------
+# element-level incremental validation
+# ---------------------------------------------------------------------------
+
+ErrorItem = Tuple[Tuple[Union[str, int], ...], str]
+
+def _sub_schema(compiled: Dict[str, Any], target: Any) -> Any:
+    # keep $defs reachable for the $refs left on reference cycles
+    if isinstance(target, dict) and "$defs" not in target:
+        return dict(target, **{"$defs": compiled.get("$defs", {})})
+    return target
+
+@lru_cache(maxsize=8)
+def _element_validators(sha: str, data: bytes, cache_dir: str) -> Dict[str, Draft202012Validator]:
+    """
+    "document" (the top-level rules with element arrays and document_meta left open),
+    "document_meta", "points", "lines" and "aux" validators for one compiled schema.
+    """
+    compiled = _compiled_validator(sha, data, cache_dir).schema
+    props = compiled.get("properties", {})
+    skeleton = dict(compiled)
+    skeleton["properties"] = {
+        k: (True if k == "document_meta"
+            else {kk: vv for kk, vv in v.items() if kk != "items"} if k in ELEMENT_SECTIONS and isinstance(v, dict)
+            else v)
+        for k, v in props.items()
+    }
+    out = {"document": Draft202012Validator(skeleton)}
+    if "document_meta" in props:
+        out["document_meta"] = Draft202012Validator(_sub_schema(compiled, props["document_meta"]))
+    for section in ELEMENT_SECTIONS:
+        items = props.get(section, {}).get("items") if isinstance(props.get(section), dict) else None
+        if items is not None:
+            out[section] = Draft202012Validator(_sub_schema(compiled, items))
+    return out
+
+def element_key(section: str, element: Any) -> bytes:
+    canon = json.dumps(element, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{section}\n{canon}".encode("utf-8")).digest()
+
+class ElementCache:
+    """
+    {element_key: ((relative path, message), ...)} for one schema, pickled to
+    <cache_dir>/elements/3DSS.v<N>.<schema sha>.pickle. Most entries are () (valid).
+    """
+
+    def __init__(self, cache_dir: Path, sha: str):
+        self.path = cache_dir / "elements" / f"3DSS.v{COMPILED_FORMAT}.{sha}.pickle"
+        self.entries: Dict[bytes, Tuple[ErrorItem, ...]] = {}
+        self.used: Set[bytes] = set()
+        self.dirty = False
+        if self.path.exists():
+            try:
+                with self.path.open("rb") as f:
+                    self.entries = pickle.load(f)
+            except Exception:
+                self.entries = {}
+
+    def get(self, key: bytes) -> Optional[Tuple[ErrorItem, ...]]:
+        hit = self.entries.get(key)
+        if hit is not None:
+            self.used.add(key)
+        return hit
+
+    def put(self, key: bytes, errors: Tuple[ErrorItem, ...]) -> None:
+        self.entries[key] = errors
+        self.used.add(key)
+        self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        if len(self.entries) > ELEMENT_CACHE_MAX:
+            self.entries = {k: self.entries[k] for k in self.used}
+        _store(self.path, self.entries)
+        self.dirty = False
+
+def _relative_errors(validator: Draft202012Validator, value: Any) -> Tuple[ErrorItem, ...]:
+    return tuple((tuple(e.path), e.message) for e in validator.iter_errors(value))
+
+def _schema_validators(schema_path: Union[str, Path, None],
+                       cache_dir: Union[str, Path, None]) -> Tuple[str, Path, Dict[str, Draft202012Validator]]:
+    data = Path(schema_path or DEFAULT_SCHEMA).read_bytes()
+    cdir = Path(cache_dir) if cache_dir else default_cache_dir()
+    sha = schema_hash(data)
+    return sha, cdir, _element_validators(sha, data, str(cdir))
+
+def _skeleton(doc: Dict[str, Any], validators: Dict[str, Draft202012Validator]) -> Dict[str, Any]:
+    # the document with element arrays emptied and document_meta stubbed out
+    skeleton = {k: ([] if k in validators and k in ELEMENT_SECTIONS and isinstance(v, list) else v)
+                for k, v in doc.items() if k != "document_meta"}
+    if "document_meta" in doc:
+        skeleton["document_meta"] = None
+    return skeleton
+
+def _error_order(item: ErrorItem):
+    return (list(item[0]), item[1])
+
+def incremental_errors(doc: Any, schema_path: Union[str, Path, None] = None,
+                       cache_dir: Union[str, Path, None] = None) -> Tuple[List[ErrorItem], Dict[str, int]]:
+    """
+    Errors as (absolute path, message), in sorted_errors() order, plus
+    {"elements", "cached", "validated"} counts. Only elements not already in the
+    element cache are run through the schema.
+    """
+    sha, cdir, validators = _schema_validators(schema_path, cache_dir)
+    cache = ElementCache(cdir, sha)
+    stats = {"elements": 0, "cached": 0, "validated": 0}
+
+    def check(section: str, prefix: Tuple[Union[str, int], ...], value: Any) -> List[ErrorItem]:
+        key = element_key(section, value)
+        stats["elements"] += 1
+        rel = cache.get(key)
+        if rel is None:
+            rel = _relative_errors(validators[section], value)
+            cache.put(key, rel)
+            stats["validated"] += 1
+        else:
+            stats["cached"] += 1
+        return [(prefix + p, m) for p, m in rel]
+
+    errors: List[ErrorItem] = []
+    if not isinstance(doc, dict):
+        errors.extend(_relative_errors(validators["document"], doc))
+    else:
+        errors.extend(_relative_errors(validators["document"], _skeleton(doc, validators)))
+        if "document_meta" in doc and "document_meta" in validators:
+            errors.extend(check("document_meta", ("document_meta",), doc["document_meta"]))
+        for section in ELEMENT_SECTIONS:
+            items = doc.get(section)
+            if section in validators and isinstance(items, list):
+                for i, el in enumerate(items):
+                    errors.extend(check(section, (section, i), el))
+    cache.save()
+    errors.sort(key=_error_order)
+    return errors, stats
+
+class StreamValidator:
+    """
+    Validation of a document while it is written: watch() each element array on its way
+    to the writer, then finish(document_meta) for the errors as (absolute path, message),
+    in sorted_errors() order. Only the errors are kept, never the elements. With
+    use_cache, per-element results go through the same cache as incremental_errors().
+    """
+
+    def __init__(self, schema_path: Union[str, Path, None] = None,
+                 cache_dir: Union[str, Path, None] = None, use_cache: bool = False):
+        sha, cdir, self._validators = _schema_validators(schema_path, cache_dir)
+        self._cache = ElementCache(cdir, sha) if use_cache else None
+        self._sections: List[str] = []
+        self.errors: List[ErrorItem] = []
+        self.stats = {"elements": 0, "cached": 0, "validated": 0}
+
+    def _check(self, section: str, value: Any) -> Tuple[ErrorItem, ...]:
+        self.stats["elements"] += 1
+        if self._cache is None:
+            self.stats["validated"] += 1
+            return _relative_errors(self._validators[section], value)
+        key = element_key(section, value)
+        rel = self._cache.get(key)
+        if rel is None:
+            rel = _relative_errors(self._validators[section], value)
+            self._cache.put(key, rel)
+            self.stats["validated"] += 1
+        else:
+            self.stats["cached"] += 1
+        return rel
+
+    def watch(self, section: str, elements: Iterable[Any]) -> Iterator[Any]:
+        self._sections.append(section)
+        checked = section in self._validators
+        for i, el in enumerate(elements):
+            if checked:
+                self.errors.extend(((section, i) + p, m) for p, m in self._check(section, el))
+            yield el
+
+    def finish(self, document_meta: Any = None) -> List[ErrorItem]:
+        skeleton: Dict[str, Any] = {section: [] for section in self._sections}
+        if document_meta is not None:
+            skeleton["document_meta"] = None
+        errors = self.errors + list(_relative_errors(self._validators["document"], skeleton))
+        if document_meta is not None and "document_meta" in self._validators:
+            errors.extend((("document_meta",) + p, m) for p, m in self._check("document_meta", document_meta))
+        if self._cache is not None:
+            self._cache.save()
+        errors.sort(key=_error_order)
+        return errors
+
+
+# ---------------------------------------------------------------------------
+# partitioned (multi-process) validation of one document
+# ---------------------------------------------------------------------------
+
+_worker_validators: Dict[str, Draft202012Validator] = {}
+
+def _init_partition_worker(schema_path: Optional[str], cache_dir: Optional[str]) -> None:
+    global _worker_validators
+    _worker_validators = _schema_validators(schema_path, cache_dir)[2]
+
+def _validate_partition(task) -> List[ErrorItem]:
+    section, start, elements = task
+    v = _worker_validators[section]
+    out: List[ErrorItem] = []
+    for i, el in enumerate(elements, start):
+        out.extend(((section, i) + tuple(e.path), e.message) for e in v.iter_errors(el))
+    out.sort(key=_error_order)
+    return out
+
+def partitioned_errors(doc: Any, schema_path: Union[str, Path, None] = None,
+                       cache_dir: Union[str, Path, None] = None, jobs: int = 1,
+                       chunk_size: int = 2000,
+                       max_errors: Optional[int] = None) -> Tuple[List[ErrorItem], bool]:
+    """
+    Errors as (absolute path, message) in sorted_errors() order, with the points /
+    lines / aux arrays validated in chunks of `chunk_size` elements on `jobs` processes.
+
+    With max_errors, returns the first max_errors errors of the full sorted list and
+    stops validating as soon as they are known; the flag is True if anything was cut.
+    """
+    schema_arg = str(schema_path) if schema_path else None
+    cache_arg = str(cache_dir) if cache_dir else None
+    _init_partition_worker(schema_arg, cache_arg)
+    validators = _worker_validators
+
+    # document-level rules and document_meta are cheap; do them here
+    errors: List[ErrorItem] = []
+    tasks = []
+    if not isinstance(doc, dict):
+        errors.extend(_relative_errors(validators["document"], doc))
+    else:
+        errors.extend(_relative_errors(validators["document"], _skeleton(doc, validators)))
+        if "document_meta" in doc and "document_meta" in validators:
+            errors.extend((("document_meta",) + p, m) for p, m in
+                          _relative_errors(validators["document_meta"], doc["document_meta"]))
+        # tasks in sorted path order, so any finished prefix of results sorts before the rest
+        for section in sorted(ELEMENT_SECTIONS):
+            items = doc.get(section)
+            if section in validators and isinstance(items, list):
+                step = max(1, chunk_size)
+                tasks.extend((section, i, items[i:i + step]) for i in range(0, len(items), step))
+
+    found: List[ErrorItem] = []
+    truncated = False
+
+    def consume(results) -> bool:
+        for part in results:
+            found.extend(part)
+            if max_errors is not None and len(found) >= max_errors:
+                return True
+        return False
+
+    if jobs <= 1 or len(tasks) <= 1:
+        truncated = consume(_validate_partition(t) for t in tasks)
+    else:
+        pool = Pool(min(jobs, len(tasks)), initializer=_init_partition_worker,
+                    initargs=(schema_arg, cache_arg))
+        try:
+            truncated = consume(pool.imap(_validate_partition, tasks))
+        finally:
+            # cancels whatever is still queued once max_errors is reached
+            pool.terminate()
+            pool.join()
+
+    errors.extend(found)
+    errors.sort(key=_error_order)
+    if max_errors is not None and len(errors) > max_errors:
+        errors = errors[:max_errors]
+        truncated = True
+    return errors, truncated
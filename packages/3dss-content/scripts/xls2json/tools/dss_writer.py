@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# dss_writer.py
+# Incremental 3DSS.json writer: document_meta first, then points / lines / aux one element
+# at a time as the readers yield them. Neither the element lists nor the serialized
+# document are ever held in memory as a whole.
+#
+# Pretty mode is byte-for-byte identical to
+#   json.dumps(doc, ensure_ascii=False, indent=2)
+# and compact mode to json.dumps(doc, ensure_ascii=False, separators=(",", ":")).
+# Output goes to a temp file next to the target and is renamed into place on success.
+#
+# Usage (from a sibling script):
+#   from dss_writer import DocumentWriter
+#   with DocumentWriter(out_path) as w:
+#       w.write_member("document_meta", document_meta)
+#       n_points = w.write_array("points", iter_points())
+#       n_lines = w.write_array("lines", iter_lines())
+#
+import os
+import json
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Union
+
+INDENT = 2
+
+
+def _current_umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+class DocumentWriter:
+    """
+    Streams a top-level JSON object member by member into `path`.
+
+    write_member() emits a whole value, write_array() emits an array element by
+    element and returns how many elements were written; with chunk_size > 1 the
+    serialized elements are flushed to the file in batches of that many. The file
+    only appears at `path` once the writer is closed without error.
+    """
+
+    def __init__(self, path: Union[str, Path], pretty: bool = True, chunk_size: int = 1):
+        self.path = Path(path)
+        self.pretty = pretty
+        self.chunk_size = max(1, chunk_size)
+        self._members = 0
+        self._tmp: Optional[str] = None
+        self._f = None
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def __enter__(self) -> "DocumentWriter":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self) -> None:
+        fd, self._tmp = tempfile.mkstemp(
+            dir=str(self.path.parent), prefix=f".{self.path.name}.", suffix=".tmp")
+        self._f = os.fdopen(fd, "w", encoding="utf-8")
+        self._f.write("{")
+
+    def close(self) -> None:
+        if self._f is None:
+            return
+        if self._members and self.pretty:
+            self._f.write("\n")
+        self._f.write("}")
+        self._f.close()
+        self._f = None
+        # mkstemp creates 0600; give the output the usual permissions
+        os.chmod(self._tmp, 0o666 & ~_current_umask())
+        os.replace(self._tmp, self.path)
+        self._tmp = None
+
+    def abort(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        if self._tmp is not None:
+            try:
+                os.unlink(self._tmp)
+            except OSError:
+                pass
+            self._tmp = None
+
+    # -- serialization -----------------------------------------------------
+
+    def _dumps(self, value: Any, depth: int) -> str:
+        if not self.pretty:
+            return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        s = json.dumps(value, ensure_ascii=False, indent=INDENT)
+        # JSON strings never contain a raw newline, so re-indenting is safe
+        return s.replace("\n", "\n" + " " * (INDENT * depth))
+
+    def _key(self, name: str) -> None:
+        sep = "," if self._members else ""
+        key = json.dumps(name, ensure_ascii=False)
+        if self.pretty:
+            self._f.write(f"{sep}\n{' ' * INDENT}{key}: ")
+        else:
+            self._f.write(f"{sep}{key}:")
+        self._members += 1
+
+    def write_member(self, name: str, value: Any) -> None:
+        self._key(name)
+        self._f.write(self._dumps(value, 1))
+
+    def write_array(self, name: str, elements: Iterable[Any]) -> int:
+        self._key(name)
+        f = self._f
+        if self.pretty:
+            first = "[\n" + " " * (INDENT * 2)
+            sep = ",\n" + " " * (INDENT * 2)
+            end = "\n" + " " * INDENT + "]"
+        else:
+            first, sep, end = "[", ",", "]"
+
+        n = 0
+        buf = []
+        for el in elements:
+            buf.append(first if n == 0 else sep)
+            buf.append(self._dumps(el, 2))
+            n += 1
+            if len(buf) >= 2 * self.chunk_size:
+                f.write("".join(buf))
+                buf.clear()
+        if buf:
+            f.write("".join(buf))
+        f.write(end if n else "[]")
+        return n
+
+
+def write_document(path: Union[str, Path], document_meta: Any,
+                   sections: Dict[str, Iterable[Any]], pretty: bool = True,
+                   chunk_size: int = 1) -> Dict[str, int]:
+    """
+    Write {"document_meta": ..., <name>: [...], ...} and return element counts per section.
+    """
+    counts: Dict[str, int] = {}
+    with DocumentWriter(path, pretty=pretty, chunk_size=chunk_size) as w:
+        w.write_member("document_meta", document_meta)
+        for name, elements in sections.items():
+            counts[name] = w.write_array(name, elements)
+    return counts
@@ -3,48 +3,25 @@
 # Convert 3DSS.json -> Excel workbook using an existing template workbook (preferred),
 # preserving styles/validations. Also writes a "document_meta" sheet for round-tripping.
 #
+# --bulk streams rows into a write-only workbook instead: the template's three header
+# rows (values and styles), column widths, freeze panes, auto filter and data validations
+# are copied, then element rows are appended with no row cap and flat memory.
+#
 # Usage:
 #   python json_to_xlsx.py --json INPUT.3dss.json --template 3DSS_points_lines_template.xlsx --out OUT.xlsx
+#   python json_to_xlsx.py --json INPUT.3dss.json --template 3DSS_template.xlsx --out OUT.xlsx --bulk
 #
 import json
-import re
 import argparse
+from copy import copy
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List
 
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 
-ARRAY_IDX_RE = re.compile(r"^(?P<name>[^\[\]]+)(?:\[(?P<idx>\d+)\])?$")
-
-def _parse_steps(key: str) -> List[Tuple[str, Optional[int]]]:
-    steps: List[Tuple[str, Optional[int]]] = []
-    for seg in key.split("."):
-        m = ARRAY_IDX_RE.match(seg)
-        if not m:
-            steps.append((seg, None))
-            continue
-        name = m.group("name")
-        idx = m.group("idx")
-        steps.append((name, int(idx)) if idx is not None else (name, None))
-    return steps
-
-def _get_path(obj: Any, key: str) -> Any:
-    steps = _parse_steps(key)
-    cur: Any = obj
-    for name, idx in steps:
-        if not isinstance(cur, dict):
-            return None
-        if name not in cur:
-            return None
-        cur = cur[name]
-        if idx is not None:
-            if not isinstance(cur, list):
-                return None
-            if idx < 0 or idx >= len(cur):
-                return None
-            cur = cur[idx]
-    return cur
+from xls2json_core import compile_getters
 
 def _to_cell_value(v: Any, key: str) -> Any:
     if v is None:
@@ -72,16 +49,9 @@ def _clear_data_rows(ws, start_row: int = 4, max_rows: int = 5000):
             ws.cell(row=r, column=c).value = None
 
 def _write_elements(ws, elements: List[Dict[str, Any]], start_row: int = 4, max_rows: int = 5000):
-    # Column keys are in row 1
+    # Column keys are in row 1; compile each into a getter once
     keys = [ws.cell(row=1, column=c).value for c in range(1, ws.max_column + 1)]
-    col_keys: List[Tuple[int, str]] = []
-    for c, k in enumerate(keys, start=1):
-        if k is None:
-            continue
-        ks = str(k).strip()
-        if not ks:
-            continue
-        col_keys.append((c, ks))
+    col_getters = compile_getters(keys)
 
     _clear_data_rows(ws, start_row=start_row, max_rows=max_rows)
 
@@ -89,9 +59,8 @@ def _write_elements(ws, elements: List[Dict[str, Any]], start_row: int = 4, max_
     for el in elements:
         if r > max_rows:
             raise SystemExit(f"Too many rows; exceeded max_rows={max_rows}")
-        for c, ks in col_keys:
-            v = _get_path(el, ks)
-            ws.cell(row=r, column=c).value = _to_cell_value(v, ks)
+        for idx, ks, get in col_getters:
+            ws.cell(row=r, column=idx + 1).value = _to_cell_value(get(el), ks)
         r += 1
 
 def _write_document_meta(wb, document_meta: Dict[str, Any]):
@@ -118,12 +87,102 @@ def _write_document_meta(wb, document_meta: Dict[str, Any]):
             ws.cell(row=r, column=2, value=v)
         r += 1
 
+# ---------------------------------------------------------------------------
+# --bulk: write-only workbook
+# ---------------------------------------------------------------------------
+
+HEADER_ROWS = 3
+
+def _copy_cell(ws_out, src) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws_out, value=src.value)
+    if src.has_style:
+        cell.font = copy(src.font)
+        cell.fill = copy(src.fill)
+        cell.border = copy(src.border)
+        cell.alignment = copy(src.alignment)
+        cell.protection = copy(src.protection)
+        cell.number_format = src.number_format
+    return cell
+
+def _copy_layout(ws_out, ws_tpl, max_row: int) -> None:
+    # everything a write-only sheet needs before its first row is appended
+    for key, dim in ws_tpl.column_dimensions.items():
+        if dim.width:
+            ws_out.column_dimensions[key].width = dim.width
+        if dim.hidden:
+            ws_out.column_dimensions[key].hidden = True
+    for r in range(1, max_row + 1):
+        dim = ws_tpl.row_dimensions.get(r)
+        if dim is not None and dim.height:
+            ws_out.row_dimensions[r].height = dim.height
+    ws_out.freeze_panes = ws_tpl.freeze_panes
+    if ws_tpl.auto_filter.ref:
+        ws_out.auto_filter.ref = ws_tpl.auto_filter.ref
+    for dv in ws_tpl.data_validations.dataValidation:
+        ws_out.data_validations.append(copy(dv))
+    ws_out.conditional_formatting = ws_tpl.conditional_formatting
+
+def _copy_rows(ws_out, ws_tpl, max_row: int) -> None:
+    for row in ws_tpl.iter_rows(min_row=1, max_row=max_row):
+        ws_out.append([_copy_cell(ws_out, c) for c in row])
+
+def _stream_elements(wb_out, ws_tpl, elements: Iterable[Dict[str, Any]]) -> int:
+    ws = wb_out.create_sheet(ws_tpl.title)
+    _copy_layout(ws, ws_tpl, HEADER_ROWS)
+    _copy_rows(ws, ws_tpl, HEADER_ROWS)
+
+    keys = [ws_tpl.cell(row=1, column=c).value for c in range(1, ws_tpl.max_column + 1)]
+    col_getters = compile_getters(keys)
+    width = len(keys)
+    n = 0
+    for el in elements:
+        row: List[Any] = [None] * width
+        for idx, ks, get in col_getters:
+            row[idx] = _to_cell_value(get(el), ks)
+        ws.append(row)
+        n += 1
+    return n
+
+def _stream_document_meta(wb_out, document_meta: Dict[str, Any]) -> None:
+    ws = wb_out.create_sheet("document_meta")
+    ws.append(["key", "value"])
+    for k in sorted(document_meta.keys()):
+        v = document_meta[k]
+        ws.append([k, json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v])
+
+def _write_bulk(template: str, out: str, sections: Dict[str, List[Dict[str, Any]]],
+                document_meta: Dict[str, Any]) -> None:
+    tpl = load_workbook(template)
+    for name in sections:
+        if name not in tpl.sheetnames:
+            raise SystemExit(f"Template missing sheet: {name}")
+
+    wb = Workbook(write_only=True)
+    for ws_tpl in tpl.worksheets:
+        if ws_tpl.title in sections:
+            _stream_elements(wb, ws_tpl, sections[ws_tpl.title])
+        elif ws_tpl.title == "document_meta":
+            _stream_document_meta(wb, document_meta)
+        else:
+            # other template sheets are carried over as they are
+            ws = wb.create_sheet(ws_tpl.title)
+            _copy_layout(ws, ws_tpl, ws_tpl.max_row)
+            _copy_rows(ws, ws_tpl, ws_tpl.max_row)
+    if "document_meta" not in tpl.sheetnames:
+        _stream_document_meta(wb, document_meta)
+    tpl.close()
+
+    Path(out).parent.mkdir(parents=True, exist_ok=True)
+    wb.save(out)
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--json", required=True, help="Input 3DSS.json")
     ap.add_argument("--template", required=True, help="Template .xlsx (must contain points/lines sheets)")
     ap.add_argument("--out", required=True, help="Output .xlsx")
     ap.add_argument("--max-rows", type=int, default=5000, help="Max rows per sheet to write")
+    ap.add_argument("--bulk", action="store_true",
+                    help="Stream rows into a write-only workbook (no row cap; --max-rows is ignored)")
     args = ap.parse_args()
 
     doc = json.loads(Path(args.json).read_text(encoding="utf-8"))
@@ -131,6 +190,11 @@ def main():
     lines = doc.get("lines", []) or []
     document_meta = doc.get("document_meta", {}) or {}
 
+    if args.bulk:
+        _write_bulk(args.template, args.out, {"points": points, "lines": lines}, document_meta)
+        print(f"[write] {args.out} (points={len(points)} lines={len(lines)})")
+        return
+
     wb = load_workbook(args.template)
     if "points" in wb.sheetnames:
         _write_elements(wb["points"], points, max_rows=args.max_rows)
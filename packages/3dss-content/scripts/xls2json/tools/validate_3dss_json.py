@@ -1,33 +1,161 @@
 #!/usr/bin/env python3
 # Validate 3DSS json against 3DSS.schema.json (Draft 2020-12)
 # Usage:
-#   python validate_3dss_json.py in.3dss.json 3DSS.schema.json
-import json, sys
-from jsonschema import Draft202012Validator
+#   python validate_3dss_json.py in.3dss.json 3DSS.schema.json [--incremental]
+#   python validate_3dss_json.py in.3dss.json 3DSS.schema.json --jobs 16 [--chunk-size 2000] [--max-errors N]
+#   python validate_3dss_json.py --batch [--schema 3DSS.schema.json] [--jobs N] DIR_OR_GLOB...
+#
+# The schema is compiled once and cached on disk (see dss_validator.py).
+# --incremental validates element by element and only re-runs the schema on elements whose
+# content is not in the element cache (same errors as the full run).
+# --jobs splits points / lines / aux into chunks validated on a process pool; --max-errors
+# prints the first N errors of the sorted list and stops validating once they are known.
+#
+# --batch validates every *.3dss.json under the given directories / globs on a process
+# pool (each worker loads the one compiled schema), prints one JSON line per file as it
+# finishes plus a final summary line, and exits 0 only if every file met its expectation:
+# files under an "invalid" directory or named "invalid_*" must fail, all others must pass.
+# Each file also gets the reference check from dss_refcheck.py (dangling end_a/end_b refs,
+# duplicate uuids), counted in "ref_errors" and "errors"; --no-ref-check skips it.
+import os, sys, json, glob, argparse
+from pathlib import Path
+from multiprocessing import Pool
+from typing import Any, Dict, List
+from dss_validator import (DEFAULT_SCHEMA, load_validator, sorted_errors, error_pointer,
+                           incremental_errors, partitioned_errors)
+from dss_refcheck import check_document
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python validate_3dss_json.py <3dss.json> [schema.json]")
+_validator = None
+
+def _init_worker(schema_path: str) -> None:
+    global _validator
+    _validator = load_validator(schema_path)
+
+def _expectation(path: Path) -> str:
+    if "invalid" in path.parts[:-1] or path.name.startswith("invalid_"):
+        return "invalid"
+    return "valid"
+
+def _collect(patterns: List[str]) -> List[Path]:
+    seen: Dict[str, Path] = {}
+    for pat in patterns:
+        p = Path(pat)
+        if p.is_dir():
+            found = sorted(p.rglob("*.3dss.json"))
+        elif glob.has_magic(pat):
+            found = [Path(m) for m in sorted(glob.glob(pat, recursive=True)) if Path(m).is_file()]
+        else:
+            found = [p]
+        for f in found:
+            seen.setdefault(os.path.normpath(str(f)), f)
+    return list(seen.values())
+
+def _validate_file(job) -> Dict[str, Any]:
+    path, expect, max_messages, ref_check = job
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            doc = json.load(f)
+    except (OSError, ValueError) as e:
+        return {"path": path, "expect": expect, "pass": False, "valid": False,
+                "errors": 1, "messages": [f"/: cannot load: {e}"]}
+    messages = [f"{error_pointer(e)}: {e.message}" for e in sorted_errors(_validator, doc)]
+    n_schema = len(messages)
+    if ref_check:
+        messages += [f"{pointer}: {msg}" for pointer, msg in check_document(doc).errors]
+    n = len(messages)
+    res = {"path": path, "expect": expect, "pass": (n == 0) == (expect == "valid"),
+           "valid": n == 0, "errors": n, "messages": messages[:max_messages]}
+    if ref_check:
+        res["ref_errors"] = n - n_schema
+    return res
+
+def batch(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(prog="validate_3dss_json.py --batch")
+    ap.add_argument("paths", nargs="+", help="Directories (searched for *.3dss.json), globs or files")
+    ap.add_argument("--schema", default=str(DEFAULT_SCHEMA))
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--max-messages", type=int, default=5, help="Error messages kept per file")
+    ap.add_argument("--no-ref-check", action="store_true", help="Schema validation only")
+    args = ap.parse_args(argv)
+
+    files = _collect(args.paths)
+    if not files:
+        print("[batch] no files matched", file=sys.stderr)
         return 2
-    json_path = sys.argv[1]
-    schema_path = sys.argv[2] if len(sys.argv) >= 3 else "3DSS.schema.json"
+    # largest first so one big scene does not end up last on a single worker
+    files.sort(key=lambda p: p.stat().st_size if p.exists() else 0, reverse=True)
+    jobs = [(str(p), _expectation(p), args.max_messages, not args.no_ref_check) for p in files]
 
-    with open(schema_path, "r", encoding="utf-8-sig") as f:
-        schema = json.load(f)
-    with open(json_path, "r", encoding="utf-8-sig") as f:
+    # compile (or load from the disk cache) once up front; workers then only unpickle
+    _init_worker(args.schema)
+    n_jobs = max(1, min(args.jobs, len(jobs)))
+
+    summary = {"files": len(jobs), "passed": 0, "failed": 0, "valid": 0, "invalid": 0}
+    def report(res: Dict[str, Any]) -> None:
+        summary["passed" if res["pass"] else "failed"] += 1
+        summary["valid" if res["valid"] else "invalid"] += 1
+        print(json.dumps(res, ensure_ascii=False), flush=True)
+
+    if n_jobs == 1:
+        for job in jobs:
+            report(_validate_file(job))
+    else:
+        with Pool(n_jobs, initializer=_init_worker, initargs=(args.schema,)) as pool:
+            for res in pool.imap_unordered(_validate_file, jobs):
+                report(res)
+
+    print(json.dumps({"summary": summary}), flush=True)
+    return 0 if summary["failed"] == 0 else 1
+
+def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "--batch":
+        return batch(sys.argv[2:])
+    ap = argparse.ArgumentParser(
+        usage="python validate_3dss_json.py <3dss.json> [schema.json] [--incremental]\n"
+              "       python validate_3dss_json.py <3dss.json> [schema.json] --jobs N [--max-errors N]\n"
+              "       python validate_3dss_json.py --batch [--schema S] [--jobs N] DIR_OR_GLOB...")
+    ap.add_argument("json_path")
+    ap.add_argument("schema_path", nargs="?", default="3DSS.schema.json")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Validate element by element, reusing cached results for unchanged elements")
+    ap.add_argument("--cache-dir", default=None, help="Cache directory (default: $DSS_CACHE_DIR or ~/.cache/3dss)")
+    ap.add_argument("--jobs", type=int, default=1, help="Validate points/lines/aux chunks on N processes")
+    ap.add_argument("--chunk-size", type=int, default=2000, help="Elements per chunk with --jobs / --max-errors")
+    ap.add_argument("--max-errors", type=int, default=None, help="Stop once the first N errors are known")
+    args = ap.parse_args()
+    if args.incremental and (args.jobs > 1 or args.max_errors is not None):
+        ap.error("--incremental cannot be combined with --jobs / --max-errors")
+
+    truncated = False
+    with open(args.json_path, "r", encoding="utf-8-sig") as f:
         doc = json.load(f)
 
-    v = Draft202012Validator(schema)
-    errors = sorted(v.iter_errors(doc), key=lambda e: (list(e.path), e.message))
+    if args.incremental:
+        items, stats = incremental_errors(doc, args.schema_path, args.cache_dir)
+        errors = [("/" + "/".join(str(p) for p in path), msg) for path, msg in items]
+        print(f"[incremental] elements={stats['elements']} cached={stats['cached']} "
+              f"validated={stats['validated']}", file=sys.stderr)
+    elif args.jobs > 1 or args.max_errors is not None:
+        items, truncated = partitioned_errors(doc, args.schema_path, args.cache_dir, jobs=args.jobs,
+                                              chunk_size=args.chunk_size, max_errors=args.max_errors)
+        errors = [("/" + "/".join(str(p) for p in path), msg) for path, msg in items]
+    else:
+        v = load_validator(args.schema_path, args.cache_dir)
+        errors = [("/" + "/".join(str(p) for p in e.path), e.message) for e in sorted_errors(v, doc)]
 
     if not errors:
         print("OK: schema-valid")
         return 0
 
+    if truncated:
+        print(f"NG: {len(errors)}+ error(s) (stopped at --max-errors {args.max_errors})")
+        for path, msg in errors:
+            print(f"- {path}: {msg}")
+        return 1
+
     print(f"NG: {len(errors)} error(s)")
-    for e in errors[:50]:
-        path = "/" + "/".join(str(p) for p in e.path)
-        print(f"- {path}: {e.message}")
+    for path, msg in errors[:50]:
+        print(f"- {path}: {msg}")
     if len(errors) > 50:
         print(f"... and {len(errors)-50} more")
     return 1
@@ -0,0 +1,772 @@
+#!/usr/bin/env python3
+# xls2json_core.py
+# Shared core of the xls2json converters (xlsx_to_3dss, xlsx_to_3dss_v2, csv_to_3dss, json_to_xlsx).
+#
+# A header row is compiled once into a ColumnPlan: each column key ("a.b[2].c") is parsed
+# into steps, a coercer is chosen for its type, and the containers created along the path
+# are fixed. Per-row work then only executes the plan (no regex, no step rebuilding).
+#
+# Usage (from a sibling script):
+#   from xls2json_core import compile_xlsx_plan
+#   plan = compile_xlsx_plan(keys_row, types_row)
+#   obj = plan.build(values_row)   # -> trimmed dict, or None for an empty row
+#
+#   from xls2json_core import OutputStages, add_output_arguments, check_output_arguments
+#   add_output_arguments(ap, cache=True); args = ap.parse_args(); check_output_arguments(ap, args)
+#   stages = OutputStages(args)
+#   write_document(out, meta, {"points": stages.watch("points", points), ...})
+#   stages.finish(meta)            # exits on ref / schema errors
+#
+import os
+import json
+import math
+import re
+import uuid
+import datetime
+import argparse
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+ARRAY_IDX_RE = re.compile(r"^(?P<name>[^\[\]]+)(?:\[(?P<idx>\d+)\])?$")
+INT_RE = re.compile(r"[+-]?\d+")
+FLOAT_RE = re.compile(r"[+-]?\d+(\.\d+)?([eE][+-]?\d+)?")
+
+Step = Tuple[str, Optional[int]]
+Setter = Callable[[Dict[str, Any], Any], None]
+Getter = Callable[[Any], Any]
+Coercer = Callable[[Any], Any]
+
+
+# ---------------------------------------------------------------------------
+# paths
+# ---------------------------------------------------------------------------
+
+def parse_steps(key: str) -> List[Step]:
+    """
+    "a.b[2].c" -> [("a", None), ("b", 2), ("c", None)]
+    """
+    steps: List[Step] = []
+    for seg in key.split("."):
+        m = ARRAY_IDX_RE.match(seg)
+        if not m:
+            # fallback: treat as raw key
+            steps.append((seg, None))
+            continue
+        name = m.group("name")
+        idx = m.group("idx")
+        steps.append((name, int(idx)) if idx is not None else (name, None))
+    return steps
+
+def compile_setter(key: str) -> Setter:
+    """
+    Compile a dot/[idx] path into setter(obj, value).
+
+    Every step is addressed by name, so the container created for the next step is
+    always a dict (a list only ever appears as the named member holding [idx]).
+    """
+    steps = tuple(parse_steps(key))
+    head = steps[:-1]
+    last_name, last_idx = steps[-1]
+
+    def setter(obj: Dict[str, Any], value: Any) -> None:
+        cur: Any = obj
+        for name, idx in head:
+            if idx is None:
+                nxt = cur.get(name)
+                if not isinstance(nxt, (dict, list)):
+                    nxt = cur[name] = {}
+            else:
+                lst = cur.get(name)
+                if not isinstance(lst, list):
+                    lst = cur[name] = []
+                if len(lst) <= idx:
+                    lst.extend([None] * (idx + 1 - len(lst)))
+                nxt = lst[idx]
+                if not isinstance(nxt, (dict, list)):
+                    nxt = lst[idx] = {}
+            cur = nxt
+
+        if last_idx is None:
+            cur[last_name] = value
+            return
+        lst = cur.get(last_name)
+        if not isinstance(lst, list):
+            lst = cur[last_name] = []
+        if len(lst) <= last_idx:
+            lst.extend([None] * (last_idx + 1 - len(lst)))
+        lst[last_idx] = value
+
+    return setter
+
+def compile_getter(key: str) -> Getter:
+    """
+    Compile a dot/[idx] path into getter(obj); missing steps yield None.
+    """
+    steps = tuple(parse_steps(key))
+
+    def getter(obj: Any) -> Any:
+        cur: Any = obj
+        for name, idx in steps:
+            if not isinstance(cur, dict):
+                return None
+            if name not in cur:
+                return None
+            cur = cur[name]
+            if idx is not None:
+                if not isinstance(cur, list):
+                    return None
+                if idx >= len(cur):
+                    return None
+                cur = cur[idx]
+        return cur
+
+    return getter
+
+def set_path(obj: Dict[str, Any], key: str, value: Any) -> None:
+    """
+    One-off form of compile_setter(key)(obj, value). Prefer a ColumnPlan in row loops.
+    """
+    compile_setter(key)(obj, value)
+
+def get_path(obj: Any, key: str) -> Any:
+    """
+    One-off form of compile_getter(key)(obj).
+    """
+    return compile_getter(key)(obj)
+
+def trim(obj: Any) -> Any:
+    """
+    Remove empty dict/list and trailing None in lists.
+    Keep falsy values like 0/False.
+    """
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            v2 = trim(v)
+            if v2 is None:
+                continue
+            if isinstance(v2, dict) and not v2:
+                continue
+            if isinstance(v2, list) and len(v2) == 0:
+                continue
+            out[k] = v2
+        return out
+    if isinstance(obj, list):
+        out = [trim(v) for v in obj]
+        # keep internal Nones to preserve index meaning, but trim trailing Nones
+        while out and out[-1] is None:
+            out.pop()
+        # if list becomes all Nones, treat as empty
+        if all(v is None for v in out):
+            return []
+        return out
+    return obj
+
+
+# ---------------------------------------------------------------------------
+# coercion (xlsx: typed by header row 2)
+# ---------------------------------------------------------------------------
+
+def base_type(type_cell: Any) -> str:
+    if type_cell is None:
+        return "any"
+    s = str(type_cell).strip()
+    if not s:
+        return "any"
+    # e.g. "string (default=...)" -> "string"
+    return s.split()[0].lower()
+
+def _coerce_json(val: Any) -> Any:
+    if val is None:
+        return None
+    # openpyxl returns datetime/date objects as is; keep ISO string
+    if isinstance(val, (datetime.datetime, datetime.date)):
+        return val.isoformat()
+    if isinstance(val, (dict, list)):
+        return val
+    s = str(val).strip()
+    if not s:
+        return None
+    try:
+        return json.loads(s)
+    except Exception:
+        # as-is if not valid json
+        return s
+
+def _coerce_boolean(val: Any) -> Any:
+    if val is None:
+        return None
+    if isinstance(val, (datetime.datetime, datetime.date)):
+        return val.isoformat()
+    if isinstance(val, bool):
+        return val
+    s = str(val).strip().lower()
+    if s in ("true", "1", "yes", "y", "on"):
+        return True
+    if s in ("false", "0", "no", "n", "off"):
+        return False
+    return None
+
+def _coerce_integer(val: Any) -> Any:
+    if val is None:
+        return None
+    if isinstance(val, (datetime.datetime, datetime.date)):
+        return val.isoformat()
+    if isinstance(val, int) and not isinstance(val, bool):
+        return val
+    if isinstance(val, float):
+        return int(val)
+    s = str(val).strip()
+    if not s:
+        return None
+    try:
+        return int(float(s))
+    except Exception:
+        return None
+
+def _coerce_number(val: Any) -> Any:
+    if val is None:
+        return None
+    if isinstance(val, (datetime.datetime, datetime.date)):
+        return val.isoformat()
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return float(val)
+    s = str(val).strip()
+    if not s:
+        return None
+    try:
+        return float(s)
+    except Exception:
+        return None
+
+def _coerce_string(val: Any) -> Any:
+    if val is None:
+        return None
+    if isinstance(val, (datetime.datetime, datetime.date)):
+        return val.isoformat()
+    if isinstance(val, str):
+        s = val.strip()
+        return s if s != "" else None
+    return val
+
+XLSX_COERCERS: Dict[str, Coercer] = {
+    "json": _coerce_json,
+    "boolean": _coerce_boolean,
+    "integer": _coerce_integer,
+    "number": _coerce_number,
+}
+
+def xlsx_coercer(base_t: str, key: str) -> Coercer:
+    if base_t == "json" or key.endswith("_json"):
+        return _coerce_json
+    return XLSX_COERCERS.get(base_t, _coerce_string)
+
+def coerce(val: Any, base_t: str, key: str) -> Any:
+    return xlsx_coercer(base_t, key)(val)
+
+
+# ---------------------------------------------------------------------------
+# coercion (csv: inferred from the text)
+# ---------------------------------------------------------------------------
+
+def _csv_json(s: Optional[str]) -> Any:
+    if s is None:
+        return None
+    s = s.strip()
+    if s == "":
+        return None
+    try:
+        return json.loads(s)
+    except Exception:
+        return s
+
+def _csv_infer(s: Optional[str]) -> Any:
+    if s is None:
+        return None
+    s = s.strip()
+    if s == "":
+        return None
+    ls = s.lower()
+    if ls in ("true", "false"):
+        return ls == "true"
+    if INT_RE.fullmatch(s):
+        return int(s)
+    if FLOAT_RE.fullmatch(s):
+        return float(s)
+    return s
+
+def csv_coercer(key: str) -> Coercer:
+    return _csv_json if key.endswith("_json") else _csv_infer
+
+def coerce_csv(s: Optional[str], key: str) -> Any:
+    return csv_coercer(key)(s)
+
+
+# ---------------------------------------------------------------------------
+# coercion (csv: one fixed type per column, resolved from the schema)
+# ---------------------------------------------------------------------------
+# Text that does not parse as the column type is kept as a string, so schema
+# validation still reports it instead of it silently disappearing.
+
+def _csv_string(s: Optional[str]) -> Any:
+    if s is None:
+        return None
+    s = s.strip()
+    return s if s != "" else None
+
+def _digits(s: str) -> bool:
+    # what int() accepts: str.isdigit() is also true for "²" / "①", which int() rejects
+    return s.isdecimal()
+
+def _csv_number(s: Optional[str]) -> Any:
+    if s is None:
+        return None
+    s = s.strip()
+    if s == "":
+        return None
+    if _digits(s):
+        return int(s)
+    if "_" in s:
+        # float() accepts "1_000"; a spreadsheet cell does not mean that
+        return s
+    try:
+        v = float(s)
+    except ValueError:
+        return s
+    # "nan" / "inf" are not JSON numbers
+    if not math.isfinite(v):
+        return s
+    if s[0] in "+-" and _digits(s[1:]):
+        return int(s)
+    return v
+
+def _csv_integer(s: Optional[str]) -> Any:
+    if s is None:
+        return None
+    s = s.strip()
+    if s == "":
+        return None
+    if _digits(s) or (s[0] in "+-" and _digits(s[1:])):
+        return int(s)
+    if "_" in s:
+        return s
+    try:
+        v = float(s)
+    except ValueError:
+        return s
+    return int(v) if v.is_integer() else s
+
+def _csv_boolean(s: Optional[str]) -> Any:
+    if s is None:
+        return None
+    s = s.strip()
+    if s == "":
+        return None
+    ls = s.lower()
+    if ls in ("true", "1", "yes", "y", "on"):
+        return True
+    if ls in ("false", "0", "no", "n", "off"):
+        return False
+    return s
+
+CSV_TYPED_COERCERS: Dict[str, Coercer] = {
+    "json": _csv_json,
+    "string": _csv_string,
+    "number": _csv_number,
+    "integer": _csv_integer,
+    "boolean": _csv_boolean,
+}
+
+def csv_typed_coercer(base_t: str, key: str) -> Coercer:
+    if key.endswith("_json"):
+        return _csv_json
+    # "any": the schema does not pin a single scalar type, infer per cell
+    return CSV_TYPED_COERCERS.get(base_t, _csv_infer)
+
+
+# ---------------------------------------------------------------------------
+# schema-driven column types
+# ---------------------------------------------------------------------------
+
+ELEMENT_DEFS = {
+    "points": "#/$defs/point/node",
+    "lines": "#/$defs/line/node",
+    "aux": "#/$defs/aux/node",
+}
+
+def resolve_ref(schema: Dict[str, Any], ref: str) -> Any:
+    """
+    Resolve a local "#/a/b" JSON pointer against the root schema.
+    """
+    if not ref.startswith("#"):
+        raise ValueError(f"only local $ref is supported: {ref}")
+    cur: Any = schema
+    for part in ref[1:].split("/"):
+        if not part:
+            continue
+        cur = cur[part.replace("~1", "/").replace("~0", "~")]
+    return cur
+
+def _alternatives(schema: Dict[str, Any], node: Any, depth: int = 0) -> List[Dict[str, Any]]:
+    # Flatten $ref / allOf / anyOf / oneOf into the concrete subschemas a value may match.
+    if not isinstance(node, dict) or depth > 32:
+        return []
+    out = [node]
+    if "$ref" in node:
+        out.extend(_alternatives(schema, resolve_ref(schema, node["$ref"]), depth + 1))
+    for kw in ("allOf", "anyOf", "oneOf"):
+        for sub in node.get(kw, ()):
+            out.extend(_alternatives(schema, sub, depth + 1))
+    return out
+
+def _scalar_types(node: Dict[str, Any]) -> List[str]:
+    t = node.get("type")
+    if isinstance(t, str):
+        return [t]
+    if isinstance(t, list):
+        return list(t)
+    values = node.get("enum") or ([node["const"]] if "const" in node else [])
+    out = []
+    for v in values:
+        if isinstance(v, bool):
+            out.append("boolean")
+        elif isinstance(v, int):
+            out.append("integer")
+        elif isinstance(v, float):
+            out.append("number")
+        elif isinstance(v, str):
+            out.append("string")
+    return out
+
+def schema_column_type(schema: Dict[str, Any], element_ref: str, key: str) -> str:
+    """
+    Resolve a column key ("appearance.position[0]") against an element definition
+    (e.g. "#/$defs/point/node") and return the coercion type for its cells:
+    "string" / "number" / "integer" / "boolean" / "json", or "any" when the schema
+    does not pin a single scalar type.
+    """
+    if key.endswith("_json"):
+        return "json"
+    nodes = [resolve_ref(schema, element_ref)]
+    for name, idx in parse_steps(key):
+        nxt = []
+        for alt in (a for n in nodes for a in _alternatives(schema, n)):
+            prop = alt.get("properties", {}).get(name)
+            if prop is not None:
+                nxt.append(prop)
+        if idx is not None:
+            items = []
+            for alt in (a for n in nxt for a in _alternatives(schema, n)):
+                prefix = alt.get("prefixItems")
+                if isinstance(prefix, list) and idx < len(prefix):
+                    items.append(prefix[idx])
+                elif isinstance(alt.get("items"), dict):
+                    items.append(alt["items"])
+            nxt = items
+        if not nxt:
+            return "any"
+        nodes = nxt
+
+    types = set()
+    for alt in (a for n in nodes for a in _alternatives(schema, n)):
+        types.update(_scalar_types(alt))
+    # a scalar cell cannot hold an object/array alternative (that needs a deeper path
+    # or a *_json column), e.g. localized_string = string | {ja, en} -> string
+    scalar = types - {"object", "array", "null"}
+    if scalar == {"integer", "number"}:
+        return "number"
+    if len(scalar) == 1:
+        return scalar.pop()
+    return "any"
+
+def schema_column_types(schema: Dict[str, Any], element_ref: str, keys: Sequence[Any]) -> List[str]:
+    """
+    Column types for a whole header row (aligned with `keys`; empty keys -> "any").
+    """
+    out = ["any"] * len(keys)
+    for idx, key_s in _header_keys(keys):
+        out[idx] = schema_column_type(schema, element_ref, key_s)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# column plans
+# ---------------------------------------------------------------------------
+
+class Column:
+    __slots__ = ("index", "key", "coerce", "set")
+
+    def __init__(self, index: int, key: str, coerce_fn: Coercer):
+        self.index = index
+        self.key = key
+        self.coerce = coerce_fn
+        self.set = compile_setter(key)
+
+class ColumnPlan:
+    """
+    Compiled header row. build(values) turns one row of raw cell values into a
+    trimmed element dict, or None if no column produced a value.
+    """
+
+    def __init__(self, columns: List[Column]):
+        self.columns = columns
+        self._ops = tuple((c.index, c.coerce, c.set) for c in columns)
+
+    @property
+    def keys(self) -> List[str]:
+        return [c.key for c in self.columns]
+
+    def assemble(self, values: Sequence[Any]) -> Optional[Dict[str, Any]]:
+        """
+        Coerce each cell and set it at its path; None if no column produced a value.
+        The result is not trimmed yet.
+        """
+        obj: Dict[str, Any] = {}
+        any_value = False
+        width = len(values)
+        for idx, coerce_fn, setter in self._ops:
+            if idx >= width:
+                continue
+            v = coerce_fn(values[idx])
+            if v is None:
+                continue
+            any_value = True
+            setter(obj, v)
+        return obj if any_value else None
+
+    def build(self, values: Sequence[Any]) -> Optional[Dict[str, Any]]:
+        obj = self.assemble(values)
+        if obj is None:
+            return None
+        return trim(obj)
+
+def _header_keys(keys: Iterable[Any]) -> List[Tuple[int, str]]:
+    # normalize: drop columns with empty key
+    out: List[Tuple[int, str]] = []
+    for idx, key in enumerate(keys):
+        if key is None:
+            continue
+        key_s = str(key).strip()
+        if not key_s:
+            continue
+        out.append((idx, key_s))
+    return out
+
+def compile_xlsx_plan(keys: Sequence[Any], types: Sequence[Any]) -> ColumnPlan:
+    columns = []
+    for idx, key_s in _header_keys(keys):
+        base_t = base_type(types[idx] if idx < len(types) else None)
+        columns.append(Column(idx, key_s, xlsx_coercer(base_t, key_s)))
+    return ColumnPlan(columns)
+
+def compile_csv_plan(keys: Sequence[Any], types: Optional[Sequence[str]] = None) -> ColumnPlan:
+    """
+    Without `types` every cell's type is inferred from its text. With `types` (see
+    schema_column_types) each column gets one fixed coercer.
+    """
+    if types is None:
+        return ColumnPlan([Column(idx, key_s, csv_coercer(key_s)) for idx, key_s in _header_keys(keys)])
+    return ColumnPlan([Column(idx, key_s, csv_typed_coercer(types[idx], key_s))
+                       for idx, key_s in _header_keys(keys)])
+
+def compile_getters(keys: Sequence[Any]) -> List[Tuple[int, str, Getter]]:
+    """
+    Header row -> [(column_index, key, getter)] for writing elements back to a sheet.
+    """
+    return [(idx, key_s, compile_getter(key_s)) for idx, key_s in _header_keys(keys)]
+
+
+# ---------------------------------------------------------------------------
+# elements / document_meta
+# ---------------------------------------------------------------------------
+
+def ensure_uuid(obj: Dict[str, Any]) -> Dict[str, Any]:
+    # if meta.uuid is missing, auto-generate (schema requires meta.uuid)
+    meta = obj.get("meta")
+    if isinstance(meta, dict) and not meta.get("uuid"):
+        meta["uuid"] = str(uuid.uuid4())
+    elif meta is None:
+        obj["meta"] = {"uuid": str(uuid.uuid4())}
+    return obj
+
+def default_document_meta(schema: Optional[Dict[str, Any]] = None, document_uuid: Optional[str] = None,
+                          revised_at: Optional[str] = None) -> Dict[str, Any]:
+    schema_uri = "https://3dsl.jp/schemas/release/v1.1.4/3DSS.schema.json#v1.1.4"
+    if schema and isinstance(schema, dict):
+        sid = schema.get("$id") or ""
+        anch = schema.get("$anchor") or ""
+        if sid:
+            base = sid[:-1] if sid.endswith("#") else sid
+            schema_uri = f"{base}#{anch}" if anch else base
+
+    return {
+        "document_title": "Untitled",
+        "document_uuid": document_uuid or str(uuid.uuid4()),
+        "schema_uri": schema_uri,
+        "author": "unknown",
+        "version": "1.0.0",
+        # optional but handy
+        "revised_at": revised_at or datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+    }
+
+
+# ---------------------------------------------------------------------------
+# deterministic mode (--deterministic): reproducible ids and timestamps
+# ---------------------------------------------------------------------------
+
+# root namespace for ids derived by the converters
+DSS_UUID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://3dsl.jp/3dss/xls2json")
+
+def pinned_timestamp(value: Optional[str] = None) -> str:
+    """
+    Timestamp for reproducible output: `value` (ISO 8601 or epoch seconds), else
+    $SOURCE_DATE_EPOCH, else the epoch. Always "YYYY-MM-DDTHH:MM:SSZ".
+    """
+    raw = value if value else os.environ.get("SOURCE_DATE_EPOCH", "0")
+    raw = str(raw).strip()
+    if INT_RE.fullmatch(raw):
+        dt = datetime.datetime.fromtimestamp(int(raw), tz=datetime.timezone.utc)
+    else:
+        dt = datetime.datetime.fromisoformat(raw.replace("Z", "+00:00"))
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(datetime.timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def document_namespace(value: Optional[str], document_meta: Optional[Dict[str, Any]],
+                       fallback: str) -> uuid.UUID:
+    """
+    Namespace for element ids: --uuid-namespace (a UUID, or any text hashed into one),
+    else a real document_meta.document_uuid, else a name derived from `fallback`.
+    """
+    if value:
+        try:
+            return uuid.UUID(value)
+        except ValueError:
+            return uuid.uuid5(DSS_UUID_NAMESPACE, value)
+    du = document_meta.get("document_uuid") if isinstance(document_meta, dict) else None
+    if isinstance(du, str):
+        try:
+            return uuid.UUID(du)
+        except ValueError:
+            pass
+    return uuid.uuid5(DSS_UUID_NAMESPACE, fallback)
+
+class DeterministicIds:
+    """
+    Fills a missing meta.uuid with uuid5(namespace, "<sheet>\\n<canonical row JSON>").
+    Ids follow the row content, not its position, so inserting or moving rows leaves the
+    other ids alone; the n-th repeat of an identical row gets "#n" appended. Ids passed to
+    reserve() (taken elsewhere, e.g. by rows an incremental rebuild reuses) are skipped.
+    """
+
+    def __init__(self, namespace: uuid.UUID):
+        self.namespace = namespace
+        self._seen: Dict[str, int] = {}
+        self._reserved: Set[str] = set()
+
+    def reserve(self, ids: Iterable[str]) -> None:
+        self._reserved.update(ids)
+
+    def element_uuid(self, sheet: str, obj: Dict[str, Any]) -> str:
+        name = sheet + "\n" + json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        n = self._seen.get(name, 0)
+        while True:
+            u = str(uuid.uuid5(self.namespace, f"{name}#{n}" if n else name))
+            n += 1
+            if u not in self._reserved:
+                break
+        self._seen[name] = n
+        return u
+
+    def ensure_uuid(self, sheet: str, obj: Dict[str, Any]) -> Dict[str, Any]:
+        # same contract as ensure_uuid()
+        meta = obj.get("meta")
+        if isinstance(meta, dict) and not meta.get("uuid"):
+            meta["uuid"] = self.element_uuid(sheet, obj)
+        elif meta is None:
+            obj["meta"] = {"uuid": self.element_uuid(sheet, obj)}
+        return obj
+
+
+# ---------------------------------------------------------------------------
+# output stages (every converter, on the way to the writer)
+# ---------------------------------------------------------------------------
+# --decimate TOL   lines go through dss_decimate (Douglas-Peucker on polyline_points /
+#                  catmullrom_points, endpoints kept); the only stage that needs numpy
+# ref check        dss_refcheck.ReferenceChecker: a dangling end_a/end_b ref or a duplicate
+#                  meta.uuid fails the run after writing (self-loops are warnings);
+#                  --no-ref-check skips it
+# --schema         dss_validator.StreamValidator checks each element as it passes, so the
+#                  output is never read back; --no-validate skips it
+# --cache / --cache-dir (converters that take cache=True) look the conversion up in the
+# content-addressed conversion cache (input + schema + converter hashes and options, see
+# conversion_cache.py) and copy the stored output on a hit instead of converting.
+
+def add_output_arguments(ap: argparse.ArgumentParser, cache: bool = False) -> None:
+    ap.add_argument("--no-validate", action="store_true", help="Skip schema validation even if --schema is given")
+    ap.add_argument("--no-ref-check", action="store_true",
+                    help="Skip the line endpoint ref / duplicate uuid check")
+    ap.add_argument("--decimate", type=float, default=None, metavar="TOL",
+                    help="Douglas-Peucker decimate polyline_points / catmullrom_points to TOL world units")
+    ap.add_argument("--decimate-max-vertices", type=int, default=None, metavar="N",
+                    help="With --decimate: cap each vertex list at N vertices")
+    if cache:
+        from conversion_cache import DEFAULT_MAX_MB
+        ap.add_argument("--cache", action="store_true",
+                        help="Reuse a previous conversion of identical inputs/options (see conversion_cache.py)")
+        ap.add_argument("--cache-dir", default=None, help="Conversion cache directory (implies --cache)")
+        ap.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_MB, help="Conversion cache size bound")
+
+def check_output_arguments(ap: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    if args.decimate is not None and args.decimate < 0:
+        ap.error("--decimate must be >= 0")
+    if args.decimate_max_vertices is not None:
+        if args.decimate is None:
+            ap.error("--decimate-max-vertices requires --decimate")
+        if args.decimate_max_vertices < 2:
+            ap.error("--decimate-max-vertices must be >= 2")
+
+class OutputStages:
+    """
+    The stages above for one run: watch() each element array on its way to the writer,
+    then finish(document_meta) reports and exits on ref / schema errors.
+    """
+
+    def __init__(self, args: argparse.Namespace, validation_cache: bool = False):
+        self.decimator = None
+        if args.decimate is not None:
+            from dss_decimate import Decimator
+            self.decimator = Decimator(args.decimate, args.decimate_max_vertices)
+        self.refs = None
+        if not args.no_ref_check:
+            from dss_refcheck import ReferenceChecker
+            self.refs = ReferenceChecker()
+        self.validator = None
+        if getattr(args, "schema", None) and not args.no_validate:
+            try:
+                from dss_validator import StreamValidator
+            except Exception:
+                StreamValidator = None
+            if StreamValidator is not None:
+                self.validator = StreamValidator(args.schema, use_cache=validation_cache)
+
+    def watch(self, section: str, elements: Iterable[Any]) -> Iterator[Any]:
+        if section == "lines" and self.decimator is not None:
+            elements = self.decimator.watch(elements)
+        if self.refs is not None:
+            elements = self.refs.watch(section, elements)
+        if self.validator is not None:
+            elements = self.validator.watch(section, elements)
+        return iter(elements)
+
+    def finish(self, document_meta: Any = None) -> None:
+        if self.decimator is not None:
+            print(f"[decimate] {self.decimator.summary()}")
+        if self.refs is not None:
+            from dss_refcheck import exit_on_errors
+            exit_on_errors(self.refs.finish())
+        if self.validator is not None:
+            errors = self.validator.finish(document_meta)
+            if errors:
+                path, msg = errors[0]
+                raise SystemExit(f"[validate] FAILED: /{'/'.join(str(p) for p in path)}: {msg}")
+            print("[validate] OK")
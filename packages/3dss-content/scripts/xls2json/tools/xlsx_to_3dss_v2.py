@@ -14,197 +14,167 @@
 #
 # Usage:
 #   python xlsx_to_3dss_v2.py --xlsx INPUT.xlsx --schema 3DSS.schema.json --out OUT.3dss.json
+#   python xlsx_to_3dss_v2.py --xlsx INPUT.xlsx --out NEW.3dss.json --incremental OUT.3dss.json
+#
+# Sheets are streamed row by row from a read-only workbook (values only), so memory stays
+# flat in row count. Pass --full-load to fall back to loading the whole workbook.
+#
+# --deterministic makes the output a pure function of the input: missing meta.uuid values
+# become UUIDv5 ids derived from the document namespace, sheet name and row content, and
+# a generated document_meta gets a pinned revised_at (--timestamp / $SOURCE_DATE_EPOCH).
+#
+# On the way to the file the elements go through the output stages shared with the other
+# converters (xls2json_core.OutputStages: --decimate, the ref check, --schema validation
+# while streaming); --cache looks the conversion up in conversion_cache.py first.
+#
+# --row-index also writes OUT.rows.json (a hash of each data row's raw cell tuple, aligned
+# with the emitted elements). --incremental PREV reads PREV and PREV.rows.json and reuses
+# the previous element (including its meta.uuid) for every row whose cells are unchanged;
+# the index also records the options that shape elements (--deterministic, --decimate, ...)
+# and a run with other values rebuilds every row. Only edited or new rows go through the
+# column plan, and validation reuses the element-level cache (see
+# dss_validator.incremental_errors / StreamValidator).
 #
 import json
-import re
 import uuid
+import hashlib
 import datetime
 import argparse
+from collections import deque
 from pathlib import Path
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
 
 from openpyxl import load_workbook
 
-try:
-    import jsonschema
-except Exception:
-    jsonschema = None
-
-ARRAY_IDX_RE = re.compile(r"^(?P<name>[^\[\]]+)(?:\[(?P<idx>\d+)\])?$")
-
-def _parse_steps(key: str) -> List[Tuple[Optional[str], Optional[int]]]:
-    steps: List[Tuple[Optional[str], Optional[int]]] = []
-    for seg in key.split("."):
-        m = ARRAY_IDX_RE.match(seg)
-        if not m:
-            steps.append((seg, None))
-            continue
-        name = m.group("name")
-        idx = m.group("idx")
-        steps.append((name, int(idx)) if idx is not None else (name, None))
-    return steps
-
-def _ensure_list_len(lst: List[Any], n: int) -> None:
-    if len(lst) < n:
-        lst.extend([None] * (n - len(lst)))
-
-def _set_path(obj: Dict[str, Any], key: str, value: Any) -> None:
-    steps = _parse_steps(key)
-    cur: Any = obj
-    for i, (name, idx) in enumerate(steps):
-        is_last = (i == len(steps) - 1)
-        if name is None:
-            return
-
-        if idx is None:
-            if is_last:
-                cur[name] = value
-                return
-            if name not in cur or not isinstance(cur[name], (dict, list)):
-                nxt_name, nxt_idx = steps[i + 1]
-                cur[name] = [] if nxt_idx is not None else {}
-            cur = cur[name]
-        else:
-            if name not in cur or not isinstance(cur[name], list):
-                cur[name] = []
-            lst = cur[name]
-            _ensure_list_len(lst, idx + 1)
-            if is_last:
-                lst[idx] = value
-                return
-            if lst[idx] is None or not isinstance(lst[idx], (dict, list)):
-                nxt_name, nxt_idx = steps[i + 1]
-                lst[idx] = [] if nxt_idx is not None else {}
-            cur = lst[idx]
-
-def _trim(obj: Any) -> Any:
-    if isinstance(obj, dict):
-        out = {}
-        for k, v in obj.items():
-            v2 = _trim(v)
-            if v2 is None:
-                continue
-            if isinstance(v2, dict) and not v2:
-                continue
-            if isinstance(v2, list) and len(v2) == 0:
-                continue
-            out[k] = v2
-        return out
-    if isinstance(obj, list):
-        out = [_trim(v) for v in obj]
-        while out and out[-1] is None:
-            out.pop()
-        if all(v is None for v in out):
-            return []
-        return out
-    return obj
-
-def _base_type(type_cell: Any) -> str:
-    if type_cell is None:
-        return "any"
-    s = str(type_cell).strip()
-    if not s:
-        return "any"
-    return s.split()[0].lower()
-
-def _coerce(val: Any, base_type: str, key: str) -> Any:
-    if val is None:
-        return None
-
-    if isinstance(val, (datetime.datetime, datetime.date)):
-        return val.isoformat()
-
-    if base_type == "json" or key.endswith("_json"):
-        if isinstance(val, (dict, list)):
-            return val
-        s = str(val).strip()
-        if not s:
-            return None
-        try:
-            return json.loads(s)
-        except Exception:
-            return s
-
-    if base_type == "boolean":
-        if isinstance(val, bool):
-            return val
-        s = str(val).strip().lower()
-        if s in ("true", "1", "yes", "y", "on"):
-            return True
-        if s in ("false", "0", "no", "n", "off"):
-            return False
-        return None
-
-    if base_type == "integer":
-        if isinstance(val, int) and not isinstance(val, bool):
-            return val
-        if isinstance(val, float):
-            return int(val)
-        s = str(val).strip()
-        if not s:
-            return None
-        try:
-            return int(float(s))
-        except Exception:
+from conversion_cache import ConversionCache, cache_options, converter_sources, file_hash
+from dss_writer import write_document
+from xls2json_core import (DeterministicIds, OutputStages, add_output_arguments, check_output_arguments,
+                           compile_xlsx_plan, default_document_meta, document_namespace, ensure_uuid,
+                           pinned_timestamp)
+
+ROW_INDEX_FORMAT = 1
+# options that never change the element built from a row (everything else is recorded in
+# the row index, and a run with different values rebuilds every row)
+ROW_INDEX_IGNORED = ("incremental", "row_index", "no_validate", "no_ref_check", "compact", "full_load")
+
+def _open_workbook(path: str, full_load: bool = False):
+    if full_load:
+        return load_workbook(path, data_only=True)
+    return load_workbook(path, read_only=True, data_only=True)
+
+def _iter_values(ws):
+    # read-only sheets: ignore a stale <dimension> and scan to the last stored row
+    if hasattr(ws, "reset_dimensions"):
+        ws.reset_dimensions()
+    return ws.iter_rows(values_only=True)
+
+def _row_hash(values: Any) -> str:
+    # raw cell tuple as read (values only); repr is exact for floats and covers datetimes
+    return hashlib.blake2b(repr(tuple(values)).encode("utf-8"), digest_size=16).hexdigest()
+
+class _SheetReuse:
+    """
+    Elements of the previous output keyed by the hash of the row they were built from.
+    take() hands out the previous element for an unchanged row (each one once).
+    uuids() are the ids those elements keep, reserved so a rebuilt row never takes one.
+    """
+
+    def __init__(self, header: str, hashes: List[str], elements: List[Dict[str, Any]]):
+        self.header = header
+        self.pool: Dict[str, Deque[Dict[str, Any]]] = {}
+        for h, el in zip(hashes, elements):
+            self.pool.setdefault(h, deque()).append(el)
+        self.reused = 0
+        self.rebuilt = 0
+
+    def take(self, h: str) -> Optional[Dict[str, Any]]:
+        q = self.pool.get(h)
+        if not q:
             return None
-
-    if base_type == "number":
-        if isinstance(val, (int, float)) and not isinstance(val, bool):
-            return float(val)
-        s = str(val).strip()
-        if not s:
-            return None
-        try:
-            return float(s)
-        except Exception:
-            return None
-
-    if isinstance(val, str):
-        s = val.strip()
-        return s if s != "" else None
-    return val
-
-def _read_sheet(wb, sheet_name: str) -> List[Dict[str, Any]]:
+        self.reused += 1
+        return q.popleft()
+
+    def uuids(self) -> Iterator[str]:
+        for q in self.pool.values():
+            for el in q:
+                meta = el.get("meta") if isinstance(el, dict) else None
+                u = meta.get("uuid") if isinstance(meta, dict) else None
+                if isinstance(u, str):
+                    yield u
+
+def _iter_sheet(wb, sheet_name: str, ids: Optional[DeterministicIds] = None,
+                row_index: Optional[Dict[str, Any]] = None,
+                reuse: Optional[_SheetReuse] = None) -> Iterator[Dict[str, Any]]:
     if sheet_name not in wb.sheetnames:
-        return []
-    ws = wb[sheet_name]
-    keys = [c.value for c in ws[1]]
-    types = [c.value for c in ws[2]]
+        return
 
-    col_map = []
-    for idx, key in enumerate(keys):
-        if key is None:
-            continue
-        key_s = str(key).strip()
-        if not key_s:
-            continue
-        col_map.append((idx + 1, key_s, _base_type(types[idx] if idx < len(types) else None)))
-
-    rows: List[Dict[str, Any]] = []
-    for r in range(4, ws.max_row + 1):
-        obj: Dict[str, Any] = {}
-        any_value = False
-        for col_idx, key_s, base_t in col_map:
-            cell = ws.cell(row=r, column=col_idx)
-            v = _coerce(cell.value, base_t, key_s)
-            if v is None:
+    ws = wb[sheet_name]
+    # stream rows as value tuples; never touches the cell DOM
+    it = _iter_values(ws)
+    # headers (row 3 is description)
+    keys = next(it, ())
+    types = next(it, ())
+    next(it, None)
+    plan = compile_xlsx_plan(keys, types)
+
+    hashes: Optional[List[str]] = None
+    if row_index is not None:
+        header = _row_hash((tuple(keys), tuple(types)))
+        hashes = []
+        row_index[sheet_name] = {"header": header, "rows": hashes}
+        if reuse is not None and reuse.header != header:
+            print(f"[incremental] {sheet_name}: header changed, rebuilding every row")
+            reuse = None
+    if reuse is not None and ids:
+        ids.reserve(reuse.uuids())
+
+    for values in it:
+        h = _row_hash(values) if hashes is not None else None
+        obj = reuse.take(h) if reuse is not None else None
+        if obj is None:
+            obj = plan.build(values)
+            if obj is None:
                 continue
-            any_value = True
-            _set_path(obj, key_s, v)
-
-        if not any_value:
-            continue
-
-        obj = _trim(obj)
-        if isinstance(obj, dict):
-            meta = obj.get("meta")
-            if isinstance(meta, dict) and not meta.get("uuid"):
-                meta["uuid"] = str(uuid.uuid4())
-            elif meta is None:
-                obj["meta"] = {"uuid": str(uuid.uuid4())}
-        rows.append(obj)
-
-    return rows
+            if reuse is not None:
+                reuse.rebuilt += 1
+            obj = ids.ensure_uuid(sheet_name, obj) if ids else ensure_uuid(obj)
+        if hashes is not None:
+            hashes.append(h)
+        yield obj
+
+def _row_index_path(out: str) -> Path:
+    p = Path(out)
+    stem = p.name[:-len(".json")] if p.name.endswith(".json") else p.name
+    return p.with_name(stem + ".rows.json")
+
+def _index_options(args: argparse.Namespace) -> Dict[str, Any]:
+    opts = cache_options(args, ("xlsx",))
+    return {k: v for k, v in opts.items() if k not in ROW_INDEX_IGNORED}
+
+def _load_previous(prev: str, options: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Dict[str, _SheetReuse]]:
+    """
+    Previous output and the reusable elements per sheet; (None, {}) if PREV or its row
+    index is missing or the index was not written for this exact PREV, and no reusable
+    elements if PREV was built with other element-shaping options.
+    """
+    index_path = _row_index_path(prev)
+    if not Path(prev).exists() or not index_path.exists():
+        print(f"[incremental] {prev} or {index_path.name} missing, converting from scratch")
+        return None, {}
+    index = json.loads(index_path.read_text(encoding="utf-8"))
+    if index.get("format") != ROW_INDEX_FORMAT or index.get("output_sha256") != file_hash(prev):
+        print(f"[incremental] {index_path.name} does not match {prev}, converting from scratch")
+        return None, {}
+    doc = json.loads(Path(prev).read_text(encoding="utf-8-sig"))
+    if index.get("options") != options:
+        print(f"[incremental] options changed since {prev}, rebuilding every row")
+        return doc, {}
+    reuse: Dict[str, _SheetReuse] = {}
+    for name, sheet in index.get("sheets", {}).items():
+        elements = doc.get(name) or []
+        if len(elements) == len(sheet["rows"]):
+            reuse[name] = _SheetReuse(sheet["header"], sheet["rows"], elements)
+    return doc, reuse
 
 def _parse_meta_value(v: Any) -> Any:
     if v is None:
@@ -228,79 +198,104 @@ def _read_document_meta(wb) -> Optional[Dict[str, Any]]:
     ws = wb["document_meta"]
     # header in row 1: key, value
     meta: Dict[str, Any] = {}
-    for r in range(2, ws.max_row + 1):
-        k = ws.cell(row=r, column=1).value
+    it = _iter_values(ws)
+    next(it, None)
+    for values in it:
+        k = values[0] if len(values) >= 1 else None
         if k is None:
             continue
         ks = str(k).strip()
         if not ks:
             continue
-        v = ws.cell(row=r, column=2).value
+        v = values[1] if len(values) >= 2 else None
         meta[ks] = _parse_meta_value(v)
     return meta if meta else None
 
-def _default_document_meta(schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    schema_uri = "https://3dsl.jp/schemas/release/v1.1.4/3DSS.schema.json#v1.1.4"
-    if schema and isinstance(schema, dict):
-        sid = schema.get("$id") or ""
-        anch = schema.get("$anchor") or ""
-        if sid:
-            base = sid[:-1] if sid.endswith("#") else sid
-            if anch:
-                schema_uri = f"{base}#{anch}"
-            else:
-                schema_uri = base
-
-    return {
-        "document_title": "Untitled",
-        "document_uuid": str(uuid.uuid4()),
-        "schema_uri": schema_uri,
-        "author": "unknown",
-        "version": "1.0.0",
-        "revised_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
-    }
-
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--xlsx", required=True, help="Input .xlsx (sheets: points, lines)")
     ap.add_argument("--out", required=True, help="Output .json path")
     ap.add_argument("--schema", default=None, help="Optional 3DSS.schema.json to validate output")
-    ap.add_argument("--no-validate", action="store_true", help="Skip schema validation even if --schema is given")
+    ap.add_argument("--full-load", action="store_true", help="Load the whole workbook DOM instead of streaming rows (legacy path)")
+    ap.add_argument("--compact", action="store_true", help="Write compact JSON instead of indent=2")
+    ap.add_argument("--deterministic", action="store_true",
+                    help="Reproducible output: UUIDv5 element ids from row content, pinned timestamps")
+    ap.add_argument("--uuid-namespace", default=None,
+                    help="Namespace for --deterministic ids (UUID or any text; default: document_uuid, else input name)")
+    ap.add_argument("--timestamp", default=None,
+                    help="revised_at for --deterministic (ISO 8601 or epoch; default: $SOURCE_DATE_EPOCH, else 0)")
+    add_output_arguments(ap, cache=True)
+    ap.add_argument("--row-index", action="store_true",
+                    help="Also write OUT.rows.json (per-row hashes) for a later --incremental run")
+    ap.add_argument("--incremental", default=None, metavar="PREV",
+                    help="Previous output (with PREV.rows.json): reuse elements of unchanged rows (implies --row-index)")
     args = ap.parse_args()
+    check_output_arguments(ap, args)
+    write_index = args.row_index or bool(args.incremental)
+
+    cache = cache_key = None
+    # a cache hit would not restore the row index
+    if (args.cache or args.cache_dir) and not write_index:
+        cache = ConversionCache(args.cache_dir, max_mb=args.cache_max_mb)
+        cache_key = cache.key([args.xlsx], args.schema, converter_sources(__file__),
+                              cache_options(args, ("xlsx",)))
+        info = cache.fetch(cache_key, args.out)
+        if info is not None:
+            print(f"[cache] hit {cache_key[:12]}")
+            print(f"[write] {args.out} (points={info['points']} lines={info['lines']})")
+            return
 
     schema = None
     if args.schema:
         schema = json.loads(Path(args.schema).read_text(encoding="utf-8"))
 
-    wb = load_workbook(args.xlsx, data_only=True)
-
-    points = _read_sheet(wb, "points")
-    lines = _read_sheet(wb, "lines")
-
-    document_meta = _read_document_meta(wb) or _default_document_meta(schema)
-
-    # If user left a placeholder in document_uuid, auto-fill
+    wb = _open_workbook(args.xlsx, full_load=args.full_load)
+
+    options = _index_options(args)
+    prev_doc, reuse = _load_previous(args.incremental, options) if args.incremental else (None, {})
+    prev_meta = prev_doc.get("document_meta") if isinstance(prev_doc, dict) else None
+    prev_uuid = prev_meta.get("document_uuid") if isinstance(prev_meta, dict) else None
+
+    document_meta = _read_document_meta(wb)
+    ids = None
+    if args.deterministic:
+        ns = document_namespace(args.uuid_namespace, document_meta, Path(args.xlsx).name)
+        ids = DeterministicIds(ns)
+        document_meta = document_meta or default_document_meta(
+            schema, document_uuid=str(ns), revised_at=pinned_timestamp(args.timestamp))
+    else:
+        document_meta = document_meta or default_document_meta(
+            schema, document_uuid=prev_uuid if isinstance(prev_uuid, str) else None)
+
+    # If user left a placeholder in document_uuid, auto-fill (an incremental run keeps the previous one)
     if isinstance(document_meta, dict):
         du = document_meta.get("document_uuid")
         if not du or (isinstance(du, str) and "PUT_UUID" in du):
-            document_meta["document_uuid"] = str(uuid.uuid4())
-
-    doc = {
-        "document_meta": document_meta,
-        "points": points,
-        "lines": lines,
-    }
-
-    Path(args.out).write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    if args.schema and not args.no_validate and jsonschema is not None:
-        try:
-            jsonschema.validate(instance=doc, schema=schema)
-        except Exception as e:
-            raise SystemExit(f"[validate] FAILED: {e}")
-        print("[validate] OK")
-
-    print(f"[write] {args.out} (points={len(points)} lines={len(lines)})")
+            document_meta["document_uuid"] = (str(ids.namespace) if ids
+                                              else prev_uuid if isinstance(prev_uuid, str) else str(uuid.uuid4()))
+
+    # elements are streamed from the sheets straight into the output file
+    row_index: Optional[Dict[str, Any]] = {} if write_index else None
+    # an incremental run revalidates only rebuilt rows (element-level validation cache)
+    stages = OutputStages(args, validation_cache=bool(args.incremental))
+    counts = write_document(args.out, document_meta, {
+        "points": stages.watch("points", _iter_sheet(wb, "points", ids, row_index, reuse.get("points"))),
+        "lines": stages.watch("lines", _iter_sheet(wb, "lines", ids, row_index, reuse.get("lines"))),
+    }, pretty=not args.compact)
+    wb.close()
+    for name, r in reuse.items():
+        print(f"[incremental] {name}: reused={r.reused} rebuilt={r.rebuilt}")
+    stages.finish(document_meta)
+
+    if row_index is not None:
+        index = {"format": ROW_INDEX_FORMAT, "output_sha256": file_hash(args.out), "options": options,
+                 "sheets": row_index}
+        _row_index_path(args.out).write_text(json.dumps(index), encoding="utf-8")
+
+    if cache is not None:
+        cache.store(cache_key, args.out, counts)
+        print(f"[cache] stored {cache_key[:12]}")
+    print(f"[write] {args.out} (points={counts['points']} lines={counts['lines']})")
 
 if __name__ == "__main__":
     main()